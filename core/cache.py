@@ -0,0 +1,154 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Small thread-safe LRU cache with an optional TTL.
+    With sliding=True the TTL is an idle timeout (refreshed on every hit),
+    otherwise it counts from the moment the value was written.
+    on_evict(key, value) is called for every entry that leaves the cache.
+    With max_bytes and sizeof(value), entries are also evicted to keep the
+    summed sizes under max_bytes.
+    """
+
+    def __init__(self, max_size: int = 128, ttl: float = None, sliding: bool = False, on_evict=None,
+                 max_bytes: int = None, sizeof=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.sliding = sliding
+        self.on_evict = on_evict
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+
+        self._data = OrderedDict()  # key -> (value, expires_at)
+        self._sizes = {}  # key -> bytes, only when sizeof is set
+        self.total_bytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _expiry(self):
+        return time.monotonic() + self.ttl if self.ttl else None
+
+    def get(self, key, default=None):
+        expired = None
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                expired = self._remove(key)
+                self.misses += 1
+                self.evictions += 1
+            else:
+                self._data.move_to_end(key)
+                if self.sliding:
+                    self._data[key] = (value, self._expiry())
+                self.hits += 1
+                return value
+
+        self._notify([(key, expired[0])])
+        return default
+
+    def set(self, key, value):
+        evicted = []
+        with self._lock:
+            old = self._remove(key)
+            if old is not None and old[0] is not value:
+                evicted.append((key, old[0]))
+
+            self._data[key] = (value, self._expiry())
+            if self.sizeof:
+                self._sizes[key] = self.sizeof(value)
+                self.total_bytes += self._sizes[key]
+            while len(self._data) > self.max_size or (self.max_bytes and self.total_bytes > self.max_bytes and len(self._data) > 1):
+                old_key = next(iter(self._data))
+                evicted.append((old_key, self._remove(old_key)[0]))
+                self.evictions += 1
+
+        self._notify(evicted)
+        return value
+
+    def pop(self, key, default=None):
+        """Removes an entry (running the eviction hook) and returns its value."""
+        with self._lock:
+            entry = self._remove(key)
+        if entry is None:
+            return default
+        self._notify([(key, entry[0])])
+        return entry[0]
+
+    def pop_where(self, predicate):
+        """Removes every entry whose key matches predicate(key)."""
+        with self._lock:
+            keys = [k for k in self._data if predicate(k)]
+            removed = [(k, self._remove(k)[0]) for k in keys]
+        self._notify(removed)
+        return len(removed)
+
+    def purge_expired(self):
+        """Drops entries whose TTL has passed. Returns how many were removed."""
+        now = time.monotonic()
+        with self._lock:
+            keys = [k for k, (_, exp) in self._data.items() if exp is not None and exp <= now]
+            removed = [(k, self._remove(k)[0]) for k in keys]
+            self.evictions += len(removed)
+        self._notify(removed)
+        return len(removed)
+
+    def clear(self):
+        with self._lock:
+            removed = [(k, v) for k, (v, _) in self._data.items()]
+            self._data.clear()
+            self._sizes.clear()
+            self.total_bytes = 0
+        self._notify(removed)
+
+    def items(self):
+        """Snapshot of (key, value) pairs, least recently used first."""
+        with self._lock:
+            return [(k, v) for k, (v, _) in self._data.items()]
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                **({"bytes": self.total_bytes, "max_bytes": self.max_bytes} if self.sizeof else {}),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def _remove(self, key):
+        """Pops an entry and its size; call with the lock held."""
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= self._sizes.pop(key, 0)
+        return entry
+
+    def _notify(self, entries):
+        if not self.on_evict:
+            return
+        for key, value in entries:
+            try:
+                self.on_evict(key, value)
+            except Exception as e:
+                print(f"WARNING: cache eviction hook failed for {key}: {e}")
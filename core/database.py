@@ -1,12 +1,173 @@
 import os
-from pymongo import MongoClient
+import threading
+import time
+from pymongo import MongoClient, monitoring
 from pymongo.server_api import ServerApi
 from dotenv import load_dotenv
 from fastapi.exceptions import HTTPException
+from core.cache import LRUCache
+from core.workspace_config import WorkspaceConfigCache
+from core.tenant_indexes import ensure_tenant_indexes
 
 
 load_dotenv()
 
+
+class _PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Counts connection pool events for one tenant client."""
+
+    def __init__(self):
+        self.created = 0
+        self.closed = 0
+        self.checked_out = 0
+        self.checkout_failed = 0
+        self.in_use = 0
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_check_out_started(self, event): pass
+    def connection_ready(self, event): pass
+
+    def connection_created(self, event):
+        self.created += 1
+
+    def connection_closed(self, event):
+        self.closed += 1
+
+    def connection_check_out_failed(self, event):
+        self.checkout_failed += 1
+
+    def connection_checked_out(self, event):
+        self.checked_out += 1
+        self.in_use += 1
+
+    def connection_checked_in(self, event):
+        self.in_use = max(0, self.in_use - 1)
+
+    def as_dict(self):
+        return {
+            "open_connections": self.created - self.closed,
+            "in_use": self.in_use,
+            "total_checkouts": self.checked_out,
+            "checkout_failures": self.checkout_failed,
+        }
+
+
+class _TenantConnection:
+    def __init__(self, workspace_id: str, uri: str, client: MongoClient, listener: _PoolStatsListener):
+        self.workspace_id = workspace_id
+        self.uri = uri
+        self.client = client
+        self.listener = listener
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.uses = 0
+
+
+class TenantConnectionRegistry:
+    """
+    Keeps one long-lived, pooled MongoClient per workspace.
+    Clients are reused across requests, evicted when idle (TTL) or when the
+    registry is full (LRU), and closed TENANT_CLIENT_CLOSE_GRACE_SECONDS after
+    eviction, since in-flight requests and background jobs may still hold them.
+    If a workspace's URI changes the old client is retired the same way and a
+    new one is built on next use.
+    """
+
+    def __init__(self):
+        self.max_pool_size = int(os.getenv("TENANT_MAX_POOL_SIZE", "20"))
+        self.server_selection_timeout_ms = int(os.getenv("TENANT_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+        self.close_grace_seconds = float(os.getenv("TENANT_CLIENT_CLOSE_GRACE_SECONDS", "120"))
+        self._connections = LRUCache(
+            max_size=int(os.getenv("TENANT_MAX_CLIENTS", "64")),
+            ttl=float(os.getenv("TENANT_IDLE_TTL_SECONDS", "1800")),
+            sliding=True,
+            on_evict=self._close,
+        )
+        self._create_lock = threading.Lock()
+        # Evicted clients waiting out the grace period: id(conn) -> (conn, timer)
+        self._retired = {}
+        self._retired_lock = threading.Lock()
+
+    def get_client(self, workspace_id: str, uri: str) -> MongoClient:
+        conn = self._connections.get(workspace_id)
+        if conn is None or conn.uri != uri:
+            with self._create_lock:
+                conn = self._connections.get(workspace_id)
+                if conn is not None and conn.uri != uri:
+                    # The admin pointed the workspace at a different cluster
+                    self._connections.pop(workspace_id)
+                    conn = None
+                if conn is None:
+                    conn = self._connect(workspace_id, uri)
+                    self._connections.set(workspace_id, conn)
+
+        conn.last_used = time.time()
+        conn.uses += 1
+        return conn.client
+
+    def release(self, workspace_id: str):
+        """Forgets the client for a workspace (e.g. after a URI change); it is closed after the grace period."""
+        self._connections.pop(workspace_id)
+
+    def close_all(self):
+        """Shutdown: closes every client now, including retired ones still in their grace period."""
+        self._connections.clear()
+        with self._retired_lock:
+            retired = list(self._retired.values())
+            self._retired.clear()
+        for conn, timer in retired:
+            timer.cancel()
+            conn.client.close()
+
+    def stats(self, workspace_id: str = None):
+        self._connections.purge_expired()
+        tenants = []
+        for key, conn in self._connections.items():
+            if workspace_id and key != workspace_id:
+                continue
+            tenants.append({
+                "workspace_id": key,
+                "created_at": conn.created_at,
+                "last_used": conn.last_used,
+                "uses": conn.uses,
+                "max_pool_size": self.max_pool_size,
+                **conn.listener.as_dict(),
+            })
+        with self._retired_lock:
+            retired = len(self._retired)
+        return {"registry": self._connections.stats(), "tenants": tenants, "retired_clients": retired}
+
+    def _connect(self, workspace_id: str, uri: str):
+        listener = _PoolStatsListener()
+        client = MongoClient(
+            uri,
+            serverSelectionTimeoutMS=self.server_selection_timeout_ms,
+            maxPoolSize=self.max_pool_size,
+            maxIdleTimeMS=60000,
+            event_listeners=[listener],
+        )
+        print(f"DEBUG: Opened pooled MongoDB client for workspace {workspace_id}.")
+        return _TenantConnection(workspace_id, uri, client, listener)
+
+    def _close(self, workspace_id, conn):
+        # pymongo 4 raises InvalidOperation on a closed client, so give holders time to finish
+        timer = threading.Timer(self.close_grace_seconds, self._close_retired, (workspace_id, conn))
+        timer.daemon = True
+        with self._retired_lock:
+            self._retired[id(conn)] = (conn, timer)
+        timer.start()
+
+    def _close_retired(self, workspace_id, conn):
+        with self._retired_lock:
+            if self._retired.pop(id(conn), None) is None:
+                return  # Already closed by close_all
+        print(f"DEBUG: Closing MongoDB client for workspace {workspace_id}.")
+        conn.client.close()
+
+
 class Database:
     def __init__(self):
         # The URI is pulled from your .env file for security
@@ -14,27 +175,55 @@ class Database:
         self.mongo_client = MongoClient(self.uri, server_api=ServerApi('1'))
 
         self.system_db = self.mongo_client["alphadoc_system"]
+        self.tenant_connections = TenantConnectionRegistry()
+        self.workspace_config = WorkspaceConfigCache(self.system_db.workspaces)
+        # (workspace_id, uri) pairs whose tenant indexes this process has ensured
+        self._indexed_tenants = set()
+        self._indexed_tenants_lock = threading.Lock()
 
     def get_system_db(self):
         return self.system_db
-    
+
 
     def get_tenant_db(self, workspace_id: str):
 
-        workspace = self.system_db.workspaces.find_one({"workspace_id": workspace_id})
-        if not workspace or "user_mongodb_uri" not in workspace:
+        config = self.workspace_config.get(workspace_id)
+        if not config or not config.mongodb_uri:
             # Raise 428 so the frontend shows the 'Configuration Required' popup
             raise HTTPException(status_code=428, detail="STORAGE_CONFIG_MISSING")
-        
-        user_uri = workspace["user_mongodb_uri"]
-        index_name = workspace.get("vector_index_name", "vector_index")
 
-        tenant_client = MongoClient(user_uri, serverSelectionTimeoutMS=5000)
+        index_name = config.vector_index_name
+
+        tenant_client = self.tenant_connections.get_client(workspace_id, config.mongodb_uri)
 
         tenant_db = tenant_client[f"workspace_{workspace_id}"]
-        
+
+        # First connection to this cluster from this process: bootstrap indexes.
+        # Only marked once it succeeds, so a failed bootstrap is retried on the next request
+        key = (workspace_id, config.mongodb_uri)
+        with self._indexed_tenants_lock:
+            indexed = key in self._indexed_tenants
+        if not indexed:
+            try:
+                ensure_tenant_indexes(tenant_db)
+                with self._indexed_tenants_lock:
+                    self._indexed_tenants.add(key)
+            except Exception as e:
+                print(f"WARNING: Tenant index bootstrap failed for workspace {workspace_id}: {e}")
+
         return tenant_db, index_name
 
+    def bootstrap_tenant(self, workspace_id: str):
+        """Connects to a (re)configured workspace and ensures its indexes, even if this process did before."""
+        with self._indexed_tenants_lock:
+            self._indexed_tenants = {key for key in self._indexed_tenants if key[0] != workspace_id}
+        return self.get_tenant_db(workspace_id)
+
+    def close(self):
+        self.tenant_connections.close_all()
+        self.mongo_client.close()
+
 # Create a singleton instance
 db_instance = Database()
-system_mongodb = db_instance.get_system_db()
\ No newline at end of file
+system_mongodb = db_instance.get_system_db()
+workspace_config = db_instance.workspace_config
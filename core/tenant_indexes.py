@@ -0,0 +1,67 @@
+import os
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+# Every index a tenant database needs, by collection. Default names are used so
+# indexes created elsewhere with the same keys (e.g. AnalysisStaging's TTL index)
+# are recognised; create_indexes is a no-op for those, so this is safe to re-run.
+TENANT_INDEXES = {
+    "documents": [
+        # Archive listing: current documents, newest first, keyset on (upload_date, _id)
+        IndexModel([("is_current", ASCENDING), ("upload_date", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("is_current", ASCENDING), ("filename", ASCENDING), ("upload_date", DESCENDING)]),
+        IndexModel([("parent_group_id", ASCENDING), ("is_current", ASCENDING)]),
+    ],
+    "chunks": [
+        IndexModel([("parent_doc_id", ASCENDING), ("chunk_index", ASCENDING)]),
+        IndexModel([("parent_group_id", ASCENDING)]),
+    ],
+    "analysis_cache": [
+        IndexModel([("last_access", ASCENDING)]),
+    ],
+    "analysis_staging": [
+        IndexModel([("expire_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "answer_cache": [
+        IndexModel([("generation", ASCENDING)]),
+    ],
+}
+
+# TTL indexes whose expiry comes from configuration, by collection: (field, seconds)
+TENANT_TTL_INDEXES = {
+    "embedding_cache": ("created_at", int(float(os.getenv("EMBEDDING_CACHE_TTL_DAYS", "30")) * 86400)),
+}
+
+
+def ensure_ttl_index(collection, field: str, seconds: int):
+    """
+    Creates a TTL index on field, or changes the expiry of the existing one in
+    place with collMod, so a new retention setting never fails with IndexOptionsConflict.
+    """
+    for index in collection.list_indexes():
+        if list(index["key"].items()) == [(field, 1)]:
+            if index.get("expireAfterSeconds") != seconds:
+                collection.database.command(
+                    "collMod", collection.name, index={"keyPattern": {field: 1}, "expireAfterSeconds": seconds}
+                )
+                print(f"DEBUG: TTL on {collection.name}.{field} set to {seconds}s.")
+            return index["name"]
+    return collection.create_index(field, expireAfterSeconds=seconds)
+
+
+def ensure_tenant_indexes(tenant_db):
+    """Creates any missing tenant indexes. Returns the names per collection."""
+    created = {}
+    for collection, indexes in TENANT_INDEXES.items():
+        try:
+            created[collection] = tenant_db[collection].create_indexes(indexes)
+        except OperationFailure as e:
+            # e.g. an index with the same keys but different options created by hand
+            print(f"WARNING: Could not create indexes on {tenant_db.name}.{collection}: {e}")
+    for collection, (field, seconds) in TENANT_TTL_INDEXES.items():
+        try:
+            created.setdefault(collection, []).append(ensure_ttl_index(tenant_db[collection], field, seconds))
+        except OperationFailure as e:
+            print(f"WARNING: Could not create TTL index on {tenant_db.name}.{collection}: {e}")
+    print(f"DEBUG: Tenant indexes ensured for {tenant_db.name}.")
+    return created
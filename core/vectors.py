@@ -0,0 +1,48 @@
+import os
+from bson.binary import Binary, BinaryVectorDtype, VECTOR_SUBTYPE
+
+# "array": BSON array of doubles (original format, ~9 bytes/dim + per-element overhead)
+# "float32": packed float32 BSON vector (4 bytes/dim)
+# "int8": int8-quantized BSON vector (1 byte/dim)
+VECTOR_FORMATS = ("array", "float32", "int8")
+VECTOR_STORAGE_FORMAT = os.getenv("VECTOR_STORAGE_FORMAT", "array").lower()
+
+if VECTOR_STORAGE_FORMAT not in VECTOR_FORMATS:
+    raise ValueError(f"VECTOR_STORAGE_FORMAT must be one of {VECTOR_FORMATS}, got '{VECTOR_STORAGE_FORMAT}'")
+
+
+def quantize_int8(values) -> list[int]:
+    """
+    Scales a vector so its largest component maps to +/-127.
+    The per-vector scale is dropped, which is fine for cosine similarity
+    (what the vector index uses) since it ignores magnitude.
+    """
+    peak = max((abs(v) for v in values), default=0.0)
+    if peak == 0:
+        return [0] * len(values)
+    scale = 127.0 / peak
+    return [max(-128, min(127, round(v * scale))) for v in values]
+
+
+def encode_vector(values, fmt: str = None):
+    """Converts an embedding to the configured storage format. Atlas Vector Search indexes all three."""
+    fmt = fmt or VECTOR_STORAGE_FORMAT
+    if fmt == "float32":
+        return Binary.from_vector([float(v) for v in values], BinaryVectorDtype.FLOAT32)
+    if fmt == "int8":
+        return Binary.from_vector(quantize_int8(values), BinaryVectorDtype.INT8)
+    return [float(v) for v in values]
+
+
+def decode_vector(value) -> list[float]:
+    """Reads any stored format back as a list of floats (int8 vectors come back unscaled)."""
+    if isinstance(value, Binary) and value.subtype == VECTOR_SUBTYPE:
+        return [float(v) for v in value.as_vector().data]
+    return list(value)
+
+
+def vector_format(value) -> str:
+    if isinstance(value, Binary) and value.subtype == VECTOR_SUBTYPE:
+        # The first byte of a BSON vector is its dtype
+        return "int8" if bytes(value[:1]) == BinaryVectorDtype.INT8.value else "float32"
+    return "array"
@@ -0,0 +1,62 @@
+import os
+from core.cache import LRUCache
+
+
+class WorkspaceConfig:
+    """The per-workspace settings every hot path needs."""
+
+    def __init__(self, workspace_id: str, google_api_key=None, mongodb_uri=None, vector_index_name="vector_index"):
+        self.workspace_id = workspace_id
+        self.google_api_key = google_api_key
+        self.mongodb_uri = mongodb_uri
+        self.vector_index_name = vector_index_name
+
+    @classmethod
+    def from_document(cls, doc: dict):
+        return cls(
+            workspace_id=doc["workspace_id"],
+            google_api_key=doc.get("google_api_key"),
+            mongodb_uri=doc.get("user_mongodb_uri"),
+            vector_index_name=doc.get("vector_index_name", "vector_index"),
+        )
+
+
+class WorkspaceConfigCache:
+    """
+    In-process cache of workspace configuration read from alphadoc_system.workspaces.
+    Entries expire after a TTL (so other workers' writes are picked up) and are
+    dropped immediately when this process changes a workspace's configuration.
+    """
+
+    _PROJECTION = {"_id": 0, "workspace_id": 1, "google_api_key": 1, "user_mongodb_uri": 1, "vector_index_name": 1}
+
+    def __init__(self, workspaces_collection):
+        self.collection = workspaces_collection
+        self._cache = LRUCache(
+            max_size=int(os.getenv("WORKSPACE_CONFIG_CACHE_SIZE", "1024")),
+            ttl=float(os.getenv("WORKSPACE_CONFIG_TTL_SECONDS", "300")),
+        )
+
+    def get(self, workspace_id: str):
+        """Returns the WorkspaceConfig, or None if the workspace does not exist."""
+        config = self._cache.get(workspace_id)
+        if config is not None:
+            return config
+
+        doc = self.collection.find_one({"workspace_id": workspace_id}, self._PROJECTION)
+        if not doc:
+            return None
+        return self._cache.set(workspace_id, WorkspaceConfig.from_document(doc))
+
+    def get_api_key(self, workspace_id: str):
+        config = self.get(workspace_id)
+        if config and config.google_api_key:
+            return config.google_api_key
+        print(f"DEBUG: No key found in DB for {workspace_id}.")
+        return None
+
+    def invalidate(self, workspace_id: str):
+        self._cache.pop(workspace_id)
+
+    def stats(self):
+        return self._cache.stats()
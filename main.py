@@ -1,6 +1,6 @@
+import asyncio
 import os
-import shutil
-import uuid
+from datetime import datetime, timedelta
 from fastapi import FastAPI, UploadFile, File, BackgroundTasks, HTTPException, Body, Header, Depends
 from fastapi.responses import JSONResponse
 from routes.auth import router as auth_router
@@ -11,8 +11,18 @@ from services.ingestion import IngestionService
 from services.intelligence import IntelligenceService
 from services.storage import StorageService
 from services.rag_pipeline import RAGEngine
-from services.audit import AuditService
+from services.audit import AuditService, AuditWriter, AUDIT_RETENTION_DAYS
+from services.analysis import AnalysisPipeline
+from services.jobs import JobManager, MongoJobStore
+from services.staging import AnalysisStaging, public_result
+from services.vector_backends import get_vector_backend
+from services.lexical_index import get_lexical_index
+from services.answer_cache import answer_cache
+from services.corpus_state import get_corpus_generation
+from services.dashboard import DashboardService
+from services.upload import UploadBuffer, UPLOAD_TOO_LARGE, configure_multipart_spooling, exceeds_upload_limit
 from core.security import get_current_user
+from models.schemas import StoreRequest
 
 app = FastAPI(title="Document Understanding and Summarization")
 
@@ -29,123 +39,255 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+configure_multipart_spooling()
+
+
+@app.middleware("http")
+async def limit_upload_size(request, call_next):
+    # Refuse oversize uploads before Starlette buffers the multipart body
+    if request.method == "POST" and exceeds_upload_limit(request.headers.get("content-length")):
+        return JSONResponse(status_code=413, content={"detail": UPLOAD_TOO_LARGE})
+    return await call_next(request)
+
+
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "200"))
+
 ingestion_service = IngestionService()
 intel_service = IntelligenceService()
-audit_service = AuditService(system_mongodb)
+audit_writer = AuditWriter(system_mongodb.audit_logs)
+background_loops = []
+audit_service = AuditService(system_mongodb, audit_writer)
 # storage_service = StorageService(mongodb)
 # rag_engine = RAGEngine(mongodb["chunks"], mongodb['documents'])
 
-processing_status = {}
+analysis_pipeline = AnalysisPipeline(ingestion_service, intel_service, db_instance)
+analysis_staging = AnalysisStaging()
+job_manager = JobManager(
+    MongoJobStore(system_mongodb), analysis_pipeline, audit_service,
+    stager=lambda result, job: stage_analysis(result, job["workspace_id"], job["username"])
+)
+
+
+@app.on_event("startup")
+async def start_job_workers():
+    await asyncio.to_thread(audit_service.ensure_indexes)
+    audit_writer.start()
+    await job_manager.start()
+    if AUDIT_RETENTION_DAYS:
+        background_loops.append(asyncio.create_task(audit_retention_loop()))
+
+
+async def audit_retention_loop():
+    interval = float(os.getenv("AUDIT_RETENTION_INTERVAL_SECONDS", "3600"))
+    while True:
+        try:
+            await asyncio.to_thread(audit_service.enforce_retention)
+        except Exception as e:
+            print(f"WARNING: Audit retention run failed: {e}")
+        await asyncio.sleep(interval)
+
+
+@app.on_event("shutdown")
+async def close_connections():
+    for task in background_loops:
+        task.cancel()
+    await job_manager.stop()
+    ingestion_service.shutdown()
+    # Flush buffered audit events before the system client goes away
+    audit_writer.stop()
+    db_instance.close()
 
 @app.get("/")
 async def root():
     return {"message": "AlphaDoc API is running", "status": "healthy"}
 
 @app.get("/history")
-async def get_history_list(user: dict = Depends(get_current_user)):
+async def get_history_list(limit: int = 50, cursor: str = None, filename_prefix: str = None,
+                           date_from: str = None, date_to: str = None,
+                           user: dict = Depends(get_current_user)):
     """
-    Returns a lightweight list of all processed documents.
-    Used to populate the 'Individual Bars' in the Archive tab.
+    Returns one page of processed documents, newest first.
+    Used to populate the 'Individual Bars' in the Archive tab; pass
+    next_cursor back as cursor for the following page. date_from/date_to
+    are ISO dates (both inclusive).
     """
+    if not 1 <= limit <= HISTORY_MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {HISTORY_MAX_PAGE_SIZE}.")
+    try:
+        uploaded_after = datetime.fromisoformat(date_from).isoformat() if date_from else None
+        uploaded_before = None
+        if date_to:
+            end = datetime.fromisoformat(date_to)
+            # A bare date covers that whole day
+            uploaded_before = (end + timedelta(days=1) if len(date_to) == 10 else end).isoformat()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="date_from/date_to must be ISO dates.")
 
     tenant_db, _ = db_instance.get_tenant_db(user["workspace_id"])
     storage_service = StorageService(tenant_db)
 
     try:
-        return storage_service.get_all_documents()
+        return storage_service.get_all_documents(limit, cursor, filename_prefix, uploaded_after, uploaded_before)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch history: {str(e)}")
     
 
 @app.get("/history/{doc_id}")
-async def get_history_detail(doc_id: str, user: dict = Depends(get_current_user)):
+async def get_history_detail(doc_id: str, section: str = None, offset: int = 0, limit: int = None,
+                             user: dict = Depends(get_current_user)):
     """
-    Retrieves the full reconstructed report for a specific document.
-    Assembles summaries from 'documents' and insights from 'chunks'.
+    Retrieves the materialized report for a specific document.
+    Large reports can be fetched one section at a time (?section=entities)
+    and paged with offset/limit.
     """
+    if offset < 0 or (limit is not None and limit <= 0):
+        raise HTTPException(status_code=400, detail="offset must be >= 0 and limit > 0.")
 
     tenant_db, _ = db_instance.get_tenant_db(user["workspace_id"])
     storage_service = StorageService(tenant_db)
 
     try:
-        data = storage_service.get_document_full_history(doc_id)
-        if not data:
-            raise HTTPException(status_code=404, detail="Document not found")
-        return data
+        data = storage_service.get_document_full_history(doc_id, section=section, offset=offset, limit=limit)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to retrieve document details: {str(e)}")
+    if not data:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return data
     
 
+def audit_user_id(user: dict):
+    """user_id comes from the JWT; tokens issued before it was a claim fall back to a lookup."""
+    if "user_id" in user:
+        return user["user_id"]
+    user_record = system_mongodb.users.find_one({"username": user["username"]}, {"user_id": 1})
+    return user_record.get("user_id") if user_record else None
+
+
+def stage_analysis(result: dict, workspace_id: str, username: str, include_embeddings: bool = False):
+    """Keeps the full analysis server-side and returns the UI payload with its analysis_id."""
+    try:
+        tenant_db, _ = db_instance.get_tenant_db(workspace_id)
+    except HTTPException:
+        tenant_db = None
+    analysis_id = analysis_staging.stage(tenant_db, workspace_id, username, result)
+    return public_result(result, analysis_id, include_embeddings)
+
+
 @app.post("/analyze")
-async def analyze_document(file: UploadFile = File(...), user: dict = Depends(get_current_user)):
+async def analyze_document(file: UploadFile = File(...), include_embeddings: bool = False, user: dict = Depends(get_current_user)):
     """
     Step 1: Ingests and analyzes the PDF, returning results to the UI.
-    Does NOT store in MongoDB yet.
+    Does NOT store in MongoDB yet; the result is staged under analysis_id for /store.
+    Embeddings are only returned when include_embeddings=true.
     """
     if not file.filename.endswith((".pdf", ".docx", ".doc")):
         raise HTTPException(status_code=400, detail="Only PDF files are supported.")
 
-    temp_path = f"temp_{uuid.uuid4()}_{file.filename}"
-
+    buffer = await UploadBuffer.from_upload(file)
 
     try:
-        with open(temp_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
         # Run AI Intelligence immediately
-        chunks = ingestion_service.process_file(temp_path)
-        chunk_texts = [c.page_content for c in chunks]
-        full_text = "\n--- NEW CHUNK ---\n".join(chunk_texts)
-
-        all_intelligence = intel_service.generate_all_intelligence(full_text, user["workspace_id"])
-        all_insights = intel_service.generate_actionable_insights(full_text, len(chunks), user["workspace_id"])
-        final_report = intel_service.generate_final_summaries(all_insights, full_text, user["workspace_id"])
-        embeddings = intel_service.generate_embedding(chunk_texts, user["workspace_id"])
-
-        # Clean up temp file
-        os.remove(temp_path)
+        result = await analysis_pipeline.run(buffer.source, file.filename, user["workspace_id"], content_hash=buffer.sha256)
 
-        user_record = system_mongodb.users.find_one({"username": user["username"]})
-        
         audit_service.log_event(
-            user_id= user_record.get("user_id"),
+            user_id=audit_user_id(user),
             username=user["username"],
-            role=user_record.get("role"),
+            role=user["role"],
             workspace_id=user["workspace_id"],
             action="AI_ANALYSIS",
             details={"filename": file.filename}
         )
         # Return everything to the frontend for user review
-        return {
-            "filename": file.filename,
-            "intelligence": all_intelligence.model_dump(),
-            "insights": all_insights.model_dump(),  # ActionableInsightList
-            "summaries": final_report.model_dump(),   # DocumentSummaries
-            "raw_chunks": chunk_texts,
-            "embeddings": embeddings
-        }
+        return stage_analysis(result, user["workspace_id"], user["username"], include_embeddings)
     
     except HTTPException as he:
         # CRITICAL: Re-raise the 428 error so the frontend sees it!
-        if os.path.exists(temp_path): os.remove(temp_path)
         raise he
 
     except Exception as e:
-        if os.path.exists(temp_path): os.remove(temp_path)
         raise HTTPException(status_code=500, detail=str(e))
 
+    finally:
+        buffer.close()
+
+
+@app.post("/jobs/analyze")
+async def submit_analysis_job(file: UploadFile = File(...), user: dict = Depends(get_current_user)):
+    """
+    Queues an analysis and returns immediately with a job id.
+    Poll /jobs/{job_id} for progress and fetch /jobs/{job_id}/result when done.
+    """
+    if not file.filename.endswith((".pdf", ".docx", ".doc")):
+        raise HTTPException(status_code=400, detail="Only PDF files are supported.")
+
+    buffer = await UploadBuffer.from_upload(file)
+    try:
+        data = buffer.read_bytes()
+    finally:
+        buffer.close()
+
+    job_id = await job_manager.submit(data, file.filename, user, user_id=audit_user_id(user))
+    return JSONResponse(status_code=202, content={"job_id": job_id, "status": "queued"})
+
+
+@app.get("/jobs/{job_id}")
+async def get_analysis_job(job_id: str, user: dict = Depends(get_current_user)):
+    """Current stage (converting, chunking, extracting, summarizing, embedding) with timings."""
+    return job_manager.status(job_id, user["workspace_id"])
+
+
+@app.get("/jobs/{job_id}/result")
+async def get_analysis_job_result(job_id: str, include_embeddings: bool = False, user: dict = Depends(get_current_user)):
+    """Same payload as /analyze, available once the job has succeeded."""
+    result = job_manager.result(job_id, user["workspace_id"])
+    if include_embeddings:
+        tenant_db, _ = db_instance.get_tenant_db(user["workspace_id"])
+        staged = analysis_staging.get(tenant_db, user["workspace_id"], result["analysis_id"])
+        if not staged:
+            raise HTTPException(status_code=410, detail="ANALYSIS_EXPIRED")
+        result = {**result, "embeddings": staged["embeddings"]}
+    return result
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_analysis_job(job_id: str, user: dict = Depends(get_current_user)):
+    status = job_manager.cancel(job_id, user["workspace_id"])
+    return {"job_id": job_id, "status": status}
+
 
 @app.post("/store")
-async def store_document(payload: dict = Body(...), user: dict = Depends(get_current_user)):
+async def store_document(payload: StoreRequest, background_tasks: BackgroundTasks, user: dict = Depends(get_current_user)):
     """
     Step 2: Receives the reviewed data from the UI and commits to MongoDB.
+    Chunks and embeddings come from the server-side staging entry named by
+    analysis_id; the body only carries the user's edits.
     """
-    tenant_db, _ = db_instance.get_tenant_db(user['workspace_id'])
-    filename = payload.get("filename")
+    tenant_db, index_name = db_instance.get_tenant_db(user['workspace_id'])
+
+    if payload.analysis_id:
+        staged = analysis_staging.get(tenant_db, user['workspace_id'], payload.analysis_id)
+        if not staged:
+            raise HTTPException(status_code=410, detail="ANALYSIS_EXPIRED")
+    elif payload.raw_chunks is not None and payload.embeddings is not None:
+        # Legacy clients that still send the full analysis back
+        staged = {"raw_chunks": payload.raw_chunks, "embeddings": payload.embeddings}
+    else:
+        raise HTTPException(status_code=400, detail="analysis_id is required.")
+
+    filename = payload.filename or staged.get("filename")
+    summaries = payload.summaries or staged.get("summaries")
+    insights = payload.insights or staged.get("insights")
+    intelligence = payload.intelligence or staged.get("intelligence")
+    if not (filename and summaries and insights and intelligence):
+        raise HTTPException(status_code=400, detail="Incomplete analysis payload.")
     
     # Flags sent by frontend after user sees the collision modal
-    confirm_update = payload.get("confirm_update", False)
-    force_new = payload.get("force_new", False)
+    confirm_update = payload.confirm_update
+    force_new = payload.force_new
 
     if confirm_update and user['role'].lower() != "admin":
         raise HTTPException(
@@ -155,7 +297,7 @@ async def store_document(payload: dict = Body(...), user: dict = Depends(get_cur
 
     # 1. AUTO-DETECTION LOGIC
     existing_group_id = None
-    existing_doc = tenant_db.documents.find_one({"filename": filename, "is_current": True})
+    existing_doc = tenant_db.documents.find_one({"filename": filename, "is_current": True}, {"parent_group_id": 1})
     
     if existing_doc:
         existing_group_id = existing_doc.get("parent_group_id")
@@ -171,32 +313,40 @@ async def store_document(payload: dict = Body(...), user: dict = Depends(get_cur
             )
 
 
-    user_record = system_mongodb.users.find_one({"username": user['username']})
-    storage_service = StorageService(tenant_db)
+    # With VECTOR_BACKEND=local the first use loads the workspace's vectors; keep it off the loop
+    vector_backend = await asyncio.to_thread(get_vector_backend, user['workspace_id'], tenant_db, index_name)
+    storage_service = StorageService(tenant_db, vector_backend, get_lexical_index(user['workspace_id']))
 
 
     try:
         doc_id = storage_service.final_storage_logic(
-            doc_summaries=payload["summaries"],
-            insight_list=payload["insights"],
-            intelligence=payload["intelligence"],
-            raw_chunks=payload["raw_chunks"],
-            embeddings=payload["embeddings"],
-            filename=payload["filename"],
+            doc_summaries=summaries,
+            insight_list=insights,
+            intelligence=intelligence,
+            raw_chunks=staged["raw_chunks"],
+            embeddings=staged["embeddings"],
+            filename=filename,
             owner=user['username'],
-            parent_group_id=existing_group_id if confirm_update else None
+            parent_group_id=existing_group_id if confirm_update else None,
+            chunk_records=staged.get("chunks")
         )
 
+        if payload.analysis_id:
+            analysis_staging.discard(tenant_db, payload.analysis_id)
+        answer_cache.on_generation_changed(tenant_db, user['workspace_id'], storage_service.generation)
+        # New versions get their dashboard built off the request path
+        background_tasks.add_task(DashboardService(tenant_db, index_name).generate_snapshot_in_background, doc_id, user['workspace_id'])
+
         audit_service.log_event(
-            user_id= user_record.get("user_id"),
+            user_id=audit_user_id(user),
             username=user['username'],
-            role=user_record.get("role"),
+            role=user['role'],
             workspace_id=user['workspace_id'],
             action="DOCUMENT_STORED",
             details={
-                "filename": payload["filename"], 
+                "filename": filename, 
                 "doc_id": doc_id,
-                "chunk_count": len(payload.get("raw_chunks", []))
+                "chunk_count": len(staged["raw_chunks"])
             }
         )
 
@@ -209,30 +359,32 @@ async def store_document(payload: dict = Body(...), user: dict = Depends(get_cur
 async def get_dashboard(user: dict = Depends(get_current_user)):
 
     tenant_db, index_name = db_instance.get_tenant_db(user['workspace_id'])
-    latest_doc = tenant_db.documents.find_one(sort=[("upload_date", -1)])
-    if not latest_doc:
-        raise HTTPException(status_code=404, detail="No documents found")
-    
-    rag_engine = RAGEngine(tenant_db["chunks"], tenant_db['documents'], index_name=index_name)
-    
-    query = f"Provide insights for document {latest_doc['_id']}"
-    result = rag_engine.generate_intelligence(query, user['workspace_id'], mode="dashboard")
-
-    return {"dashboard_summary": result}
+    # May wait on a snapshot being generated, so keep it off the event loop
+    return await asyncio.to_thread(DashboardService(tenant_db, index_name).latest, user['workspace_id'])
 
 
 @app.post("/search")
 async def search_repository(user_query: str, user: dict = Depends(get_current_user)):
 
     tenant_db, index_name = db_instance.get_tenant_db(user['workspace_id'])
-    rag_engine = RAGEngine(tenant_db["chunks"], tenant_db['documents'], index_name=index_name)
-    result = rag_engine.generate_intelligence(user_query, user['workspace_id'], mode="search")
+    # Answers are only reused while the corpus they were generated from is unchanged
+    generation = get_corpus_generation(tenant_db)
+    result = answer_cache.get(tenant_db, user['workspace_id'], user_query, "search", generation)
+    if result is None:
+        lexical_index = get_lexical_index(user['workspace_id'])
+        # The first search (or one after another worker wrote) loads the whole corpus; keep it off the loop.
+        # So does the local vector index the first time the workspace uses it.
+        await asyncio.to_thread(lexical_index.build, tenant_db["chunks"], generation)
+        vector_backend = await asyncio.to_thread(get_vector_backend, user['workspace_id'], tenant_db, index_name)
+        rag_engine = RAGEngine(tenant_db["chunks"], tenant_db['documents'], index_name=index_name,
+                               vector_backend=vector_backend, lexical_index=lexical_index)
+        result = rag_engine.generate_intelligence(user_query, user['workspace_id'], mode="search", generation=generation)
+        answer_cache.put(tenant_db, user['workspace_id'], user_query, "search", generation, result)
 
-    user_record = system_mongodb.users.find_one({"username": user['username']})
     audit_service.log_event(
-            user_id= user_record.get("user_id"),
+            user_id=audit_user_id(user),
             username=user['username'],
-            role=user_record.get("role"),
+            role=user['role'],
             workspace_id=user['workspace_id'],
             action="RAG_QUERY",
             details={"query": user_query}
@@ -250,17 +402,19 @@ async def delete_version(doc_id: str, user: dict = Depends(get_current_user)):
             detail="Forbidden: Only administrators can remove document versions."
         )
 
-    tenant_db, _ = db_instance.get_tenant_db(user['workspace_id'])
-    storage_service = StorageService(tenant_db)
+    tenant_db, index_name = db_instance.get_tenant_db(user['workspace_id'])
+    # With VECTOR_BACKEND=local the first use loads the workspace's vectors; keep it off the loop
+    vector_backend = await asyncio.to_thread(get_vector_backend, user['workspace_id'], tenant_db, index_name)
+    storage_service = StorageService(tenant_db, vector_backend, get_lexical_index(user['workspace_id']))
 
 
-    user_record = system_mongodb.users.find_one({"username": user['username']})
     try:
         storage_service.soft_delete_document(doc_id)
+        answer_cache.on_generation_changed(tenant_db, user['workspace_id'], storage_service.generation)
 
         # Audit Log: Record exactly which version was removed
         audit_service.log_event(
-            user_id=user_record.get("user_id"),
+            user_id=audit_user_id(user),
             username=user['username'],
             role=user['role'],
             workspace_id=user['workspace_id'],
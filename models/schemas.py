@@ -40,4 +40,18 @@ class SectionSummary(BaseModel):
 class DocumentSummaries(BaseModel):
     executive_summary: str
     technical_summary: str
-    section_summaries: List[SectionSummary]
\ No newline at end of file
+    section_summaries: List[SectionSummary]
+
+
+class StoreRequest(BaseModel):
+    # Normally just the staged analysis id plus the user's edits
+    analysis_id: Optional[str] = None
+    filename: Optional[str] = None
+    summaries: Optional[dict] = None
+    insights: Optional[dict] = None
+    intelligence: Optional[dict] = None
+    confirm_update: bool = False
+    force_new: bool = False
+    # Legacy clients round-trip the full analysis
+    raw_chunks: Optional[List[str]] = None
+    embeddings: Optional[List[List[float]]] = None
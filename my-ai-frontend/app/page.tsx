@@ -32,7 +32,10 @@ export default function DocumentIntelligence() {
   const [dashboard, setDashboard] = useState<string>("");
   const [drawerOpen, setDrawerOpen] = useState(false);
   const [historyList, setHistoryList] = useState<any[]>([]);
+  const [historyCursor, setHistoryCursor] = useState<string | null>(null);
+  const [historyFilter, setHistoryFilter] = useState("");
   const [auditLogs, setAuditLogs] = useState<any[]>([]);
+  const [auditCursor, setAuditCursor] = useState<string | null>(null);
 
   // Configuration States
   const [configKey, setConfigKey] = useState("");
@@ -86,12 +89,18 @@ export default function DocumentIntelligence() {
     document.body.removeChild(link);
   };
 
-  const fetchHistory = async () => {
+  // Pass a cursor to append the next page; without one the list restarts from the newest document
+  const fetchHistory = async (cursor: string | null = null, filenamePrefix: string = historyFilter) => {
     try {
+      const params: Record<string, string> = { limit: "50" };
+      if (cursor) params.cursor = cursor;
+      if (filenamePrefix) params.filename_prefix = filenamePrefix;
       const res = await axios.get(`${API_BASE}/history`, {
-        headers: getHeaders()
+        headers: getHeaders(),
+        params
       });
-      setHistoryList(res.data);
+      setHistoryList(prev => cursor ? [...prev, ...res.data.items] : res.data.items);
+      setHistoryCursor(res.data.next_cursor);
     } catch (err: any) { 
         if (err.response?.status === 401) {
             localStorage.clear();
@@ -102,13 +111,16 @@ export default function DocumentIntelligence() {
     }
   };
 
-  const fetchAuditLogs = async () => {
+  // With a cursor, appends the next (older) page
+  const fetchAuditLogs = async (cursor: string | null = null) => {
     setLoading(true);
     try {
       const res = await axios.get(`${API_BASE}/admin/audit-logs`, {
-        headers: getHeaders()
+        headers: getHeaders(),
+        params: cursor ? { cursor } : {}
       });
-      setAuditLogs(res.data);
+      setAuditLogs(prev => cursor ? [...prev, ...res.data.items] : res.data.items);
+      setAuditCursor(res.data.next_cursor);
       setActiveTab("audit");
     } catch (err) { 
       alert("Unauthorized: Admin access required."); 
@@ -216,7 +228,7 @@ export default function DocumentIntelligence() {
         summaries: data.summaries, 
         insights: data.insights,   
         raw_chunks: data.raw_chunks,
-        embeddings: data.embeddings,
+        analysis_id: data.analysis_id,
         intelligence: data.intelligence
       });
     } catch (err: any) { 
@@ -242,8 +254,7 @@ export default function DocumentIntelligence() {
           entities: analysis.entities, 
           relationships: analysis.relationships 
         },
-        raw_chunks: analysis.raw_chunks,
-        embeddings: analysis.embeddings,
+        analysis_id: analysis.analysis_id,
         filename: analysis.filename,
         confirm_update: confirmUpdate,
         force_new: forceNew
@@ -436,6 +447,12 @@ export default function DocumentIntelligence() {
             <h2 className="text-sm font-bold text-slate-500 uppercase tracking-widest text-[10px]">Library Archive</h2>
             <button onClick={() => setDrawerOpen(false)} className="p-2 hover:bg-slate-100 rounded-md transition-colors text-slate-400"><X size={18} /></button>
           </div>
+          <input
+            value={historyFilter}
+            onChange={(e) => { setHistoryFilter(e.target.value); fetchHistory(null, e.target.value); }}
+            placeholder="Filter by filename..."
+            className="mb-4 w-full px-3 py-2 text-sm border border-slate-200 rounded-md outline-none focus:border-indigo-400"
+          />
           <div className="flex-1 overflow-y-auto space-y-2 scrollbar-thin">
             {historyList.map((doc) => (
               <div key={doc.id} className="group flex items-center justify-between p-3 rounded-lg border border-transparent hover:border-slate-200 hover:bg-slate-50 transition-all">
@@ -454,6 +471,11 @@ export default function DocumentIntelligence() {
                 )}
               </div>
             ))}
+            {historyCursor && (
+              <button onClick={() => fetchHistory(historyCursor)} className="w-full py-2 text-[10px] font-bold uppercase tracking-widest text-indigo-600 hover:bg-indigo-50 rounded-md transition-all">
+                Load more
+              </button>
+            )}
           </div>
         </div>
       </div>
@@ -486,7 +508,7 @@ export default function DocumentIntelligence() {
                 </button>
                 {getRole() === "admin" && (
                   <>
-                    <button onClick={fetchAuditLogs} className={`flex-1 md:flex-none flex items-center justify-center gap-2 px-3 md:px-6 py-2 rounded-md text-[10px] md:text-xs font-bold transition-all whitespace-nowrap ${activeTab === "audit" ? "bg-white text-indigo-600 shadow-sm border border-slate-200" : "text-slate-500 hover:text-slate-700"}`}>
+                    <button onClick={() => fetchAuditLogs()} className={`flex-1 md:flex-none flex items-center justify-center gap-2 px-3 md:px-6 py-2 rounded-md text-[10px] md:text-xs font-bold transition-all whitespace-nowrap ${activeTab === "audit" ? "bg-white text-indigo-600 shadow-sm border border-slate-200" : "text-slate-500 hover:text-slate-700"}`}>
                         <ShieldAlert size={14} /> Audit
                     </button>
                     <button onClick={() => setActiveTab("config")} className={`flex-1 md:flex-none flex items-center justify-center gap-2 px-3 md:px-6 py-2 rounded-md text-[10px] md:text-xs font-bold transition-all whitespace-nowrap ${activeTab === "config" ? "bg-white text-indigo-600 shadow-sm border border-slate-200" : "text-slate-500 hover:text-slate-700"}`}>
@@ -773,6 +795,11 @@ export default function DocumentIntelligence() {
                       ))}
                     </tbody>
                   </table>
+                  {auditCursor && (
+                    <button onClick={() => fetchAuditLogs(auditCursor)} className="w-full py-3 text-[10px] font-bold uppercase tracking-widest text-indigo-600 hover:bg-indigo-50 border-t border-slate-100 transition-all">
+                      Load older events
+                    </button>
+                  )}
                 </div>
               </div>
             )}
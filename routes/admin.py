@@ -1,10 +1,14 @@
 from fastapi import APIRouter, Header, HTTPException, Body, Depends
-from core.database import system_mongodb
+from core.database import system_mongodb, db_instance, workspace_config
 from services.audit import AuditService
 from datetime import datetime
 import os
 from pymongo import MongoClient
 from core.security import get_current_user
+from services.intelligence import genai_client_cache, embedding_store, embedding_executor
+from services.rag_pipeline import rag_component_cache
+from services.answer_cache import answer_cache
+from services.query_translation import query_translator
 
 
 router = APIRouter(prefix="/admin", tags=["Admin Operations"])
@@ -13,14 +17,43 @@ audit_service = AuditService(system_mongodb)
 
 @router.get("/audit-logs")
 async def get_audit_logs(
+    limit: int = 50,
+    cursor: str = None,
+    action: str = None,
+    username: str = None,
+    start: datetime = None,
+    end: datetime = None,
     user: dict = Depends(get_current_user)
 ):
+    """Pages back through the workspace's audit trail, optionally filtered by action, user and time range."""
     # Security: Only Admins can see the audit trail
     if user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Forbidden: Researcher cannot access logs.")
-    
-    logs = audit_service.get_workspace_logs(user["workspace_id"])
-    return logs
+    if not 1 <= limit <= 500:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 500.")
+
+    try:
+        return audit_service.get_workspace_logs(user["workspace_id"], limit, cursor, action, username, start, end)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+
+
+@router.get("/audit-logs/daily")
+async def get_audit_daily_counts(days: int = 30, user: dict = Depends(get_current_user)):
+    """Events per day and action, read from the pre-aggregated counters."""
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Forbidden: Researcher cannot access logs.")
+
+    return audit_service.get_daily_counts(user["workspace_id"], max(1, min(days, 366)))
+
+
+@router.get("/audit-logs/archive/{day}")
+async def get_archived_audit_logs(day: str, user: dict = Depends(get_current_user)):
+    """Events of one day (YYYY-MM-DD) that retention moved to the compressed archive."""
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Forbidden: Researcher cannot access logs.")
+
+    return audit_service.get_archived_logs(user["workspace_id"], day)
 
 
 @router.post("/config/gemini-key")
@@ -47,7 +80,8 @@ async def update_gemini_key(
         }},
         upsert=True
     )
-    
+    workspace_config.invalidate(user["workspace_id"])
+
     return {"message": "Google API Key successfully set for the workspace."}
 
 
@@ -67,11 +101,15 @@ async def update_mongodb_config(
         raise HTTPException(status_code=400, detail="MongoDB URI is required.")
 
     # Validate connection before saving
+    test_client = None
     try:
         test_client = MongoClient(uri, serverSelectionTimeoutMS=5000)
         test_client.admin.command('ping')
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Database Connection Failed: {str(e)}")
+    finally:
+        if test_client is not None:
+            test_client.close()
 
     # Update System DB
     system_mongodb.workspaces.update_one(
@@ -82,4 +120,37 @@ async def update_mongodb_config(
         }},
         upsert=True
     )
-    return {"status": "success", "message": "Storage Engine configured. Repository and Search are now active."}
\ No newline at end of file
+
+    workspace_config.invalidate(user['workspace_id'])
+    # Drop the pooled client so the next request connects to the new cluster
+    db_instance.tenant_connections.release(user['workspace_id'])
+    # Create the tenant's indexes now rather than on the first user request
+    db_instance.bootstrap_tenant(user['workspace_id'])
+
+    return {"status": "success", "message": "Storage Engine configured. Repository and Search are now active."}
+
+
+@router.get("/stats/connections")
+async def get_connection_stats(user: dict = Depends(get_current_user)):
+    """Reports the pooled tenant MongoDB client for this workspace."""
+    if user['role'].lower() != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required.")
+
+    return db_instance.tenant_connections.stats(user['workspace_id'])
+
+
+@router.get("/stats/caches")
+async def get_cache_stats(user: dict = Depends(get_current_user)):
+    """Hit/miss counters for the in-process caches."""
+    if user['role'].lower() != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required.")
+
+    return {
+        "workspace_config": workspace_config.stats(),
+        "genai_clients": genai_client_cache.stats(),
+        "rag_components": rag_component_cache.stats(),
+        "embeddings": embedding_store.stats(),
+        "embedding_batches": embedding_executor.stats(),
+        "answers": answer_cache.stats(),
+        "query_translation": query_translator.stats(),
+    }
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, Body
+from fastapi import APIRouter, Depends, HTTPException, Body, BackgroundTasks
 from models.auth import AdminSignupSchema, ResearcherSignupSchema, LoginSchema
 from services.auth import AuthService
 from core.database import system_mongodb
@@ -12,7 +12,7 @@ auth_service = AuthService(system_mongodb)
 
 @router.post("/signup/admin")
 async def signup_admin(data: AdminSignupSchema):
-    result = auth_service.create_admin(
+    result = await auth_service.create_admin(
         data.username, data.password, data.workspace_name, data.google_api_key
     )
     if "error" in result:
@@ -22,7 +22,7 @@ async def signup_admin(data: AdminSignupSchema):
 
 @router.post("/signup/researcher")
 async def signup_researcher(data: ResearcherSignupSchema):
-    result = auth_service.create_researcher(
+    result = await auth_service.create_researcher(
         data.username, data.password, data.workspace_id
     )
     if "error" in result:
@@ -31,16 +31,21 @@ async def signup_researcher(data: ResearcherSignupSchema):
 
 
 @router.post("/login")
-async def login(data: LoginSchema):
+async def login(data: LoginSchema, background_tasks: BackgroundTasks):
     # 1. Find user in the system database
     user = system_mongodb.users.find_one({"username": data.username})
     
-    if not user or not auth_service.verify_password(data.password, user["password_hash"]):
+    if not user or not await auth_service.verify_password_async(data.password, user["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid username or password")
+
+    # Work factor changed since this hash was made: upgrade it after responding
+    if auth_service.needs_rehash(user["password_hash"]):
+        background_tasks.add_task(auth_service.rehash_password, user["_id"], data.password)
     
 
     token = create_access_token(
     {"username": user["username"],
+    "user_id": user.get("user_id"),
     "role": user["role"],
     "workspace_id": user["workspace_id"]})
 
@@ -0,0 +1,80 @@
+"""
+Rebuilds audit_daily_counts for days logged before the counts were kept,
+from audit_logs and the compressed audit_logs_archive parts.
+
+    python -m scripts.backfill_audit_daily_counts
+    python -m scripts.backfill_audit_daily_counts --workspace acme --until 2025-06-01 --dry-run
+
+Counts are recomputed and overwritten, so rerunning is safe. Days from --until
+(default: today, UTC) onwards are left alone: the live writer keeps those.
+"""
+import argparse
+import zlib
+from collections import Counter
+from datetime import datetime
+import bson
+from pymongo import UpdateOne
+from core.database import db_instance
+
+
+def count_events(system_db, until: str, workspace_id: str = None):
+    counts = Counter()
+    match = {"timestamp": {"$lt": datetime.strptime(until, "%Y-%m-%d")}}
+    if workspace_id:
+        match["workspace_id"] = workspace_id
+    for row in system_db.audit_logs.aggregate([
+        {"$match": match},
+        {"$group": {
+            "_id": {
+                "workspace_id": "$workspace_id",
+                "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$timestamp"}},
+                "action": "$action",
+            },
+            "count": {"$sum": 1},
+        }},
+    ], allowDiskUse=True):
+        key = row["_id"]
+        counts[(key["workspace_id"], key["day"], key["action"])] += row["count"]
+
+    # Archived days are disjoint from audit_logs, but only their decompressed events carry the action
+    archive_query = {"day": {"$lt": until}}
+    if workspace_id:
+        archive_query["workspace_id"] = workspace_id
+    for part in system_db.audit_logs_archive.find(archive_query):
+        for log in bson.decode(zlib.decompress(part["data"]))["logs"]:
+            counts[(part["workspace_id"], part["day"], log["action"])] += 1
+    return counts
+
+
+def backfill(until: str, workspace_id: str = None, batch_size: int = 1000, dry_run: bool = False):
+    system_db = db_instance.get_system_db()
+    counts = count_events(system_db, until, workspace_id)
+
+    if dry_run:
+        days = {(ws, day) for ws, day, _ in counts}
+        print(f"Would write {len(counts)} counts covering {len(days)} workspace-days before {until}.")
+        return len(counts)
+
+    ops = [
+        UpdateOne({"workspace_id": ws, "day": day, "action": action}, {"$set": {"count": n}}, upsert=True)
+        for (ws, day, action), n in counts.items()
+    ]
+    for start in range(0, len(ops), batch_size):
+        system_db.audit_daily_counts.bulk_write(ops[start:start + batch_size], ordered=False)
+    print(f"Backfilled {len(ops)} daily audit counts before {until}.")
+    return len(ops)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild audit_daily_counts from existing and archived audit events.")
+    parser.add_argument("--until", default=datetime.utcnow().strftime("%Y-%m-%d"),
+                        help="First day (YYYY-MM-DD, UTC) to leave untouched; defaults to today")
+    parser.add_argument("--workspace", help="Only this workspace id")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    try:
+        backfill(args.until, args.workspace, args.batch_size, args.dry_run)
+    finally:
+        db_instance.close()
@@ -0,0 +1,49 @@
+"""
+Copies filename and upload_date from each parent document onto chunks stored
+before those fields were denormalized.
+
+    python -m scripts.backfill_chunk_metadata --workspace acme
+    python -m scripts.backfill_chunk_metadata --workspace acme --dry-run
+"""
+import argparse
+from pymongo import UpdateMany
+from core.database import db_instance
+
+
+def backfill(workspace_id: str, batch_size: int = 500, dry_run: bool = False):
+    tenant_db, _ = db_instance.get_tenant_db(workspace_id)
+
+    parent_ids = tenant_db.chunks.distinct("parent_doc_id", {"filename": {"$exists": False}})
+    pending = []
+    updated = 0
+    for parent in tenant_db.documents.find({"_id": {"$in": parent_ids}}, {"filename": 1, "upload_date": 1}):
+        pending.append(UpdateMany(
+            {"parent_doc_id": parent["_id"], "filename": {"$exists": False}},
+            {"$set": {"filename": parent["filename"], "upload_date": parent.get("upload_date")}},
+        ))
+        if len(pending) >= batch_size:
+            if not dry_run:
+                updated += tenant_db.chunks.bulk_write(pending, ordered=False).modified_count
+            pending = []
+
+    if pending and not dry_run:
+        updated += tenant_db.chunks.bulk_write(pending, ordered=False).modified_count
+
+    if dry_run:
+        print(f"Would backfill chunks of {len(parent_ids)} documents in workspace_{workspace_id}.")
+    else:
+        print(f"Backfilled {updated} chunks across {len(parent_ids)} documents in workspace_{workspace_id}.")
+    return updated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Denormalize parent filename/upload_date onto older chunks.")
+    parser.add_argument("--workspace", required=True, help="Workspace id whose tenant database to backfill")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    try:
+        backfill(args.workspace, args.batch_size, args.dry_run)
+    finally:
+        db_instance.close()
@@ -0,0 +1,72 @@
+"""
+Measures login throughput against a running API, and how much a login burst
+slows unrelated requests (GET / is probed while the burst runs).
+
+    python -m scripts.benchmark_login --username alice --password secret
+    python -m scripts.benchmark_login --username alice --password secret --requests 400 --concurrency 50
+
+Compare runs with different BCRYPT_ROUNDS / AUTH_HASH_WORKERS on the server.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import httpx
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def run(base_url: str, username: str, password: str, total: int, concurrency: int):
+    login_latencies = []
+    probe_latencies = []
+    statuses = {}
+    done = asyncio.Event()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        async def login():
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post("/auth/login", json={"username": username, "password": password})
+                login_latencies.append(time.perf_counter() - start)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        async def probe():
+            while not done.is_set():
+                start = time.perf_counter()
+                await client.get("/")
+                probe_latencies.append(time.perf_counter() - start)
+                await asyncio.sleep(0.05)
+
+        prober = asyncio.create_task(probe())
+        started = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(total)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await prober
+
+    print(f"Logins: {total} in {elapsed:.2f}s -> {total / elapsed:.1f}/s (concurrency {concurrency})")
+    print(f"Status codes: {statuses}")
+    print(f"Login latency   p50 {percentile(login_latencies, 50) * 1000:.0f}ms  "
+          f"p95 {percentile(login_latencies, 95) * 1000:.0f}ms  max {max(login_latencies) * 1000:.0f}ms")
+    if probe_latencies:
+        print(f"GET / during burst  p50 {percentile(probe_latencies, 50) * 1000:.0f}ms  "
+              f"p95 {percentile(probe_latencies, 95) * 1000:.0f}ms  mean {statistics.mean(probe_latencies) * 1000:.0f}ms "
+              f"({len(probe_latencies)} probes)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark /auth/login throughput and its impact on other requests.")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.base_url, args.username, args.password, args.requests, args.concurrency))
@@ -0,0 +1,60 @@
+"""
+Rewrites the stored embeddings of a workspace's chunks collection in another format.
+
+    python -m scripts.migrate_vectors --workspace acme --format float32
+    python -m scripts.migrate_vectors --workspace acme --format int8 --dry-run
+
+Converting int8 vectors back to float32/array is lossy (the quantization scale
+isn't stored); re-embed if full precision is needed.
+"""
+import argparse
+from pymongo import UpdateOne
+from core.database import db_instance
+from core.vectors import VECTOR_FORMATS, decode_vector, encode_vector, vector_format
+
+
+def migrate(workspace_id: str, target: str, batch_size: int = 500, dry_run: bool = False):
+    tenant_db, _ = db_instance.get_tenant_db(workspace_id)
+    chunks = tenant_db.chunks
+
+    scanned = converted = 0
+    pending = []
+    cursor = chunks.find({"embedding": {"$exists": True}}, {"embedding": 1}, batch_size=batch_size)
+    for doc in cursor:
+        scanned += 1
+        current = vector_format(doc["embedding"])
+        if current == target:
+            continue
+        if current == "int8":
+            print(f"WARNING: chunk {doc['_id']} is int8; converting to {target} keeps only its direction.")
+
+        converted += 1
+        pending.append(UpdateOne(
+            {"_id": doc["_id"]},
+            {"$set": {"embedding": encode_vector(decode_vector(doc["embedding"]), target)}},
+        ))
+        if len(pending) >= batch_size:
+            if not dry_run:
+                chunks.bulk_write(pending, ordered=False)
+            pending = []
+
+    if pending and not dry_run:
+        chunks.bulk_write(pending, ordered=False)
+
+    action = "Would convert" if dry_run else "Converted"
+    print(f"{action} {converted} of {scanned} chunk embeddings in workspace_{workspace_id} to {target}.")
+    return converted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert stored chunk embeddings between vector formats.")
+    parser.add_argument("--workspace", required=True, help="Workspace id whose tenant database to migrate")
+    parser.add_argument("--format", required=True, choices=VECTOR_FORMATS, help="Target storage format")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    try:
+        migrate(args.workspace, args.format, args.batch_size, args.dry_run)
+    finally:
+        db_instance.close()
@@ -0,0 +1,94 @@
+from fastapi import HTTPException
+from langchain_core.documents import Document
+from services.analysis_cache import AnalysisCache, hash_source
+from services.ingestion import CHUNK_SIZE, CHUNK_OVERLAP, HEADERS_TO_SPLIT, CHUNK_RECORD_FIELDS
+from services.intelligence import GENERATION_MODEL, EMBEDDING_MODEL, MAP_REDUCE_THRESHOLD_CHARS, MAP_REDUCE_WINDOW_CHUNKS
+
+
+class AnalysisPipeline:
+    """
+    The end-to-end /analyze flow: Docling conversion, chunking and the
+    intelligence stages. Shared by the synchronous endpoint and the job workers.
+    Every stage is memoized in the content-addressed AnalysisCache, so a
+    repeated upload skips Docling and the Gemini calls entirely.
+    """
+
+    def __init__(self, ingestion_service, intel_service, db=None):
+        self.ingestion = ingestion_service
+        self.intelligence = intel_service
+        self.db = db
+        self.cache = AnalysisCache({
+            "chunk_size": CHUNK_SIZE,
+            "chunk_overlap": CHUNK_OVERLAP,
+            "headers": HEADERS_TO_SPLIT,
+            "generation_model": GENERATION_MODEL,
+            "embedding_model": EMBEDDING_MODEL,
+            "map_reduce_threshold": MAP_REDUCE_THRESHOLD_CHARS,
+            "map_reduce_window": MAP_REDUCE_WINDOW_CHUNKS,
+            # Chunks carry header paths, pages and offsets since format 2; format 3 fixed their spans
+            "chunk_format": 3,
+            # Single-pass summaries read the whole text instead of the first 10000 characters
+            "summary_text_limit": None,
+        })
+
+    def _cache_scope(self, source, workspace_id: str, content_hash: str = None):
+        tenant_db = None
+        if self.db is not None:
+            try:
+                tenant_db, _ = self.db.get_tenant_db(workspace_id)
+            except HTTPException:
+                # Storage not configured yet: analysis still works, cache stays in memory
+                tenant_db = None
+        return self.cache.scope(workspace_id, content_hash or hash_source(source), tenant_db)
+
+    async def run(self, source, filename: str, workspace_id: str, on_stage=None, content_hash: str = None):
+        """
+        source is a file path or a (filename, bytes) pair.
+        on_stage(stage, event) receives "started"/"finished" for converting,
+        chunking, extracting, summarizing and embedding.
+        """
+        def report(stage, event):
+            if on_stage:
+                on_stage(stage, event)
+
+        cache = self._cache_scope(source, workspace_id, content_hash)
+
+        cached_chunks = await cache.get("chunks")
+        if cached_chunks is not None:
+            chunks = [Document(page_content=c["page_content"], metadata=c["metadata"]) for c in cached_chunks]
+        else:
+            converted = await cache.get("converted")
+            if converted is None:
+                report("converting", "started")
+                converted = await self.ingestion.convert_async(source)
+                report("converting", "finished")
+                cache.put("converted", converted)
+
+            report("chunking", "started")
+            chunks = await self.ingestion.split_async(converted)
+            report("chunking", "finished")
+            cache.put("chunks", [{"page_content": c.page_content, "metadata": c.metadata} for c in chunks])
+
+        chunk_texts = [c.page_content for c in chunks]
+        # Structural metadata per chunk, carried through staging to storage
+        chunk_records = [
+            {"chunk_index": i, **{field: c.metadata.get(field) for field in CHUNK_RECORD_FIELDS}}
+            for i, c in enumerate(chunks)
+        ]
+        intelligence, insights, summaries, embeddings = await self.intelligence.analyze_document(
+            chunk_texts, workspace_id, on_stage=on_stage, cache=cache,
+            chunk_headers=[r["section_header"] for r in chunk_records],
+        )
+
+        if cache.hits:
+            print(f"DEBUG: Analysis cache hits for '{filename}': {', '.join(cache.hits)}")
+
+        return {
+            "filename": filename,
+            "intelligence": intelligence.model_dump(),
+            "insights": insights.model_dump(),  # ActionableInsightList
+            "summaries": summaries.model_dump(),   # DocumentSummaries
+            "raw_chunks": chunk_texts,
+            "chunks": chunk_records,
+            "embeddings": embeddings
+        }
@@ -0,0 +1,157 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import bson
+from core.cache import LRUCache
+
+
+def hash_source(source) -> str:
+    """SHA-256 of an upload given as a file path or a (filename, bytes) pair."""
+    digest = hashlib.sha256()
+    if isinstance(source, tuple):
+        digest.update(source[1])
+    else:
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+class AnalysisCache:
+    """
+    Content-addressed cache of /analyze stage outputs.
+    Entries are keyed by the SHA-256 of the upload plus a fingerprint of the
+    pipeline configuration, so any change to chunking or models misses.
+    In memory, one byte-bounded LRU is shared by all workspaces. Entries are
+    also persisted to the tenant's analysis_cache collection (byte-bounded per
+    tenant, least recently used first) so they survive restarts and are shared
+    by workers. Persisting runs on a background thread: the tenant's size is
+    tracked incrementally and trimmed there, never on the request path.
+    """
+
+    STAGES = ("converted", "chunks", "extraction", "insights", "summaries", "embeddings")
+    # Leave headroom below MongoDB's 16MB document limit
+    _MAX_DOCUMENT_BYTES = 15 * 1024 * 1024
+
+    def __init__(self, config: dict):
+        self.fingerprint = hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+        self.max_memory_bytes = int(os.getenv("ANALYSIS_CACHE_MEMORY_BYTES", str(64 * 1024 * 1024)))
+        self.max_persisted_bytes = int(os.getenv("ANALYSIS_CACHE_PERSISTED_BYTES", str(512 * 1024 * 1024)))
+        # Other processes write to the same collections, so the running totals are re-read this often
+        self.resync_seconds = float(os.getenv("ANALYSIS_CACHE_RESYNC_SECONDS", "300"))
+        # (workspace_id, key, stage) -> (value, size)
+        self._memory = LRUCache(
+            max_size=int(os.getenv("ANALYSIS_CACHE_MEMORY_ENTRIES", "4096")),
+            max_bytes=self.max_memory_bytes,
+            sizeof=lambda entry: entry[1],
+        )
+        self._persisted = {}  # workspace_id -> (approximate bytes stored, monotonic time of last resync)
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="analysis-cache")
+
+    def scope(self, workspace_id: str, content_hash: str, tenant_db=None):
+        """Returns the cache view for one upload; tenant_db=None keeps it memory-only."""
+        return AnalysisCacheScope(self, workspace_id, f"{content_hash}:{self.fingerprint}", tenant_db)
+
+    def get_memory(self, workspace_id: str, key: str, stage: str):
+        entry = self._memory.get((workspace_id, key, stage))
+        return entry[0] if entry is not None else None
+
+    def get_persisted(self, workspace_id: str, tenant_db, key: str, stage: str):
+        """Blocking lookup in the tenant's analysis_cache; hits are kept in memory."""
+        doc = tenant_db.analysis_cache.find_one_and_update(
+            {"_id": f"{key}:{stage}"},
+            {"$set": {"last_access": datetime.utcnow()}},
+            projection={"value": 1, "size": 1},
+        )
+        if not doc:
+            return None
+        self._remember(workspace_id, key, stage, doc["value"], doc.get("size", 0))
+        return doc["value"]
+
+    def _remember(self, workspace_id: str, key: str, stage: str, value, size: int):
+        # A single entry larger than the whole bound would evict everything else
+        if size <= self.max_memory_bytes:
+            self._memory.set((workspace_id, key, stage), (value, size))
+
+    def put(self, workspace_id: str, tenant_db, key: str, stage: str, value):
+        size = len(bson.encode({"value": value}))
+        self._remember(workspace_id, key, stage, value, size)
+
+        if tenant_db is None or size > self._MAX_DOCUMENT_BYTES:
+            return
+        self._writer.submit(self._persist, workspace_id, tenant_db, key, stage, value, size)
+
+    def _persist(self, workspace_id: str, tenant_db, key: str, stage: str, value, size: int):
+        # Single writer thread: the per-workspace totals need no further locking
+        try:
+            previous = tenant_db.analysis_cache.find_one_and_replace(
+                {"_id": f"{key}:{stage}"},
+                {"key": key, "stage": stage, "value": value, "size": size, "last_access": datetime.utcnow()},
+                projection={"size": 1},
+                upsert=True,
+            )
+            total, synced_at = self._persisted.get(workspace_id, (None, 0.0))
+            if total is None or time.monotonic() - synced_at > self.resync_seconds:
+                total, synced_at = self._persisted_bytes(tenant_db), time.monotonic()
+            else:
+                total += size - (previous.get("size", 0) if previous else 0)
+            if total > self.max_persisted_bytes:
+                total, synced_at = self._trim(tenant_db), time.monotonic()
+            self._persisted[workspace_id] = (total, synced_at)
+        except Exception as e:
+            print(f"WARNING: Could not persist analysis cache '{stage}' for {key}: {e}")
+
+    @staticmethod
+    def _persisted_bytes(tenant_db) -> int:
+        totals = list(tenant_db.analysis_cache.aggregate([{"$group": {"_id": None, "bytes": {"$sum": "$size"}}}]))
+        return totals[0]["bytes"] if totals else 0
+
+    def _trim(self, tenant_db) -> int:
+        """Deletes least recently used entries until the tenant is under its bound. Returns the bytes left."""
+        total = self._persisted_bytes(tenant_db)
+        overflow = total - self.max_persisted_bytes
+        if overflow <= 0:
+            return total
+
+        stale_ids = []
+        for doc in tenant_db.analysis_cache.find({}, {"size": 1}).sort("last_access", 1):
+            stale_ids.append(doc["_id"])
+            overflow -= doc.get("size", 0)
+            if overflow <= 0:
+                break
+        tenant_db.analysis_cache.delete_many({"_id": {"$in": stale_ids}})
+        return self.max_persisted_bytes + overflow
+
+
+class AnalysisCacheScope:
+    """get/put for the stages of a single upload. get is a coroutine: a memory miss reads MongoDB off the event loop."""
+
+    def __init__(self, cache: AnalysisCache, workspace_id: str, key: str, tenant_db):
+        self.cache = cache
+        self.workspace_id = workspace_id
+        self.key = key
+        self.tenant_db = tenant_db
+        self.hits = []
+
+    async def get(self, stage: str):
+        try:
+            value = self.cache.get_memory(self.workspace_id, self.key, stage)
+            if value is None and self.tenant_db is not None:
+                value = await asyncio.to_thread(self.cache.get_persisted, self.workspace_id, self.tenant_db, self.key, stage)
+        except Exception as e:
+            print(f"WARNING: Analysis cache lookup failed for '{stage}': {e}")
+            return None
+        if value is not None:
+            self.hits.append(stage)
+        return value
+
+    def put(self, stage: str, value):
+        try:
+            self.cache.put(self.workspace_id, self.tenant_db, self.key, stage, value)
+        except Exception as e:
+            # Caching is an optimisation; never fail an analysis because of it
+            print(f"WARNING: Could not cache '{stage}' for {self.key}: {e}")
@@ -0,0 +1,118 @@
+import hashlib
+import os
+import re
+import threading
+from datetime import datetime
+from core.cache import LRUCache
+from core.database import workspace_config
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s?.!]+$")
+
+
+def normalize_query(query: str) -> str:
+    """Case, spacing and trailing punctuation don't change what a question asks."""
+    return _TRAILING_PUNCTUATION.sub("", _WHITESPACE.sub(" ", query).strip().lower())
+
+
+class AnswerCache:
+    """
+    RAG answers keyed by (workspace, storage URI, normalized query, mode,
+    corpus generation). The generation (services.corpus_state) moves on every
+    store or version removal, and the URI separates clusters whose generation
+    numbers can coincide, so an entry can only ever be served for the corpus
+    it was generated from. A bounded LRU sits in front of an optional tenant
+    answer_cache collection (ANSWER_CACHE_PERSIST=true) that lets answers
+    survive restarts and be shared between workers.
+    """
+
+    def __init__(self):
+        ttl = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "0"))
+        self._memory = LRUCache(max_size=int(os.getenv("ANSWER_CACHE_SIZE", "512")), ttl=ttl or None)
+        self.persist = os.getenv("ANSWER_CACHE_PERSIST", "false").lower() == "true"
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.persisted_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _entry_id(query: str, mode: str, generation: int) -> str:
+        raw = f"{generation}:{mode}:{normalize_query(query)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _memory_key(workspace_id: str, entry_id: str):
+        # The persisted collection lives on the tenant's cluster; in memory the cluster must be part of the key
+        config = workspace_config.get(workspace_id)
+        source = hashlib.sha256((config.mongodb_uri if config else "").encode()).hexdigest()[:12]
+        return workspace_id, source, entry_id
+
+    def get(self, tenant_db, workspace_id: str, query: str, mode: str, generation: int):
+        entry_id = self._entry_id(query, mode, generation)
+        memory_key = self._memory_key(workspace_id, entry_id)
+        entry = self._memory.get(memory_key)
+
+        if entry is None and self.persist and tenant_db is not None:
+            doc = tenant_db.answer_cache.find_one({"_id": entry_id, "generation": generation})
+            if doc:
+                entry = {"query": doc["query"], "answer": doc["answer"], "hits": doc.get("hits", 0),
+                         "created_at": doc["created_at"]}
+                self._memory.set(memory_key, entry)
+                with self._lock:
+                    self.persisted_hits += 1
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry["hits"] += 1
+            entry["last_hit_at"] = datetime.utcnow()
+
+        if self.persist and tenant_db is not None:
+            try:
+                tenant_db.answer_cache.update_one({"_id": entry_id}, {"$inc": {"hits": 1}, "$set": {"last_hit_at": entry["last_hit_at"]}})
+            except Exception as e:
+                print(f"WARNING: Could not record answer cache hit: {e}")
+        return entry["answer"]
+
+    def put(self, tenant_db, workspace_id: str, query: str, mode: str, generation: int, answer: str):
+        entry_id = self._entry_id(query, mode, generation)
+        entry = {"query": normalize_query(query), "answer": answer, "hits": 0, "created_at": datetime.utcnow()}
+        self._memory.set(self._memory_key(workspace_id, entry_id), entry)
+
+        if self.persist and tenant_db is not None:
+            try:
+                tenant_db.answer_cache.replace_one(
+                    {"_id": entry_id},
+                    {**entry, "mode": mode, "generation": generation},
+                    upsert=True,
+                )
+            except Exception as e:
+                print(f"WARNING: Could not persist answer cache entry: {e}")
+
+    def on_generation_changed(self, tenant_db, workspace_id: str, generation: int):
+        """Drops entries from older generations; they can never be hit again."""
+        self._memory.pop_where(lambda key: key[0] == workspace_id)
+        if self.persist and tenant_db is not None:
+            tenant_db.answer_cache.delete_many({"generation": {"$lt": generation}})
+
+    def stats(self, top: int = 10):
+        with self._lock:
+            lookups = self.hits + self.misses
+            counters = {
+                "hits": self.hits,
+                "persisted_hits": self.persisted_hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+        popular = sorted(self._memory.items(), key=lambda item: item[1]["hits"], reverse=True)[:top]
+        return {
+            **counters,
+            "persistent": self.persist,
+            "memory": self._memory.stats(),
+            "top_queries": [{"query": entry["query"], "hits": entry["hits"]} for _, entry in popular],
+        }
+
+
+answer_cache = AnswerCache()
@@ -1,9 +1,203 @@
-from datetime import datetime
+from collections import Counter
+from datetime import datetime, timedelta
+import base64
+import json
+import os
+import queue
+import threading
+import time
 import uuid
+import zlib
+import bson
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+from core.tenant_indexes import ensure_ttl_index
+
+# 0 keeps audit events forever. "archive" moves older days into compressed
+# audit_logs_archive documents; "ttl" lets MongoDB expire them.
+AUDIT_RETENTION_DAYS = int(os.getenv("AUDIT_RETENTION_DAYS", "0"))
+AUDIT_RETENTION_MODE = os.getenv("AUDIT_RETENTION_MODE", "archive").lower()
+AUDIT_ARCHIVE_BATCH = int(os.getenv("AUDIT_ARCHIVE_BATCH", "5000"))
+
+
+def record_daily_counts(system_db, entries: list):
+    """Keeps audit_daily_counts ({workspace_id, day, action, count}) in step with inserted events."""
+    counts = Counter((e["workspace_id"], e["timestamp"].strftime("%Y-%m-%d"), e["action"]) for e in entries)
+    if not counts:
+        return
+    system_db.audit_daily_counts.bulk_write([
+        UpdateOne({"workspace_id": ws, "day": day, "action": action}, {"$inc": {"count": n}}, upsert=True)
+        for (ws, day, action), n in counts.items()
+    ], ordered=False)
+
+
+class AuditWriter:
+    """
+    Writes audit events off the request path. Events are buffered and flushed
+    with insert_many once AUDIT_BATCH_SIZE are waiting or AUDIT_FLUSH_INTERVAL_SECONDS
+    have passed. The buffer is bounded (AUDIT_MAX_QUEUE): when it is full the
+    caller waits up to AUDIT_ENQUEUE_TIMEOUT_SECONDS and then writes the event
+    itself, so bursts slow down to database speed instead of dropping events.
+    stop() drains everything still queued.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.batch_size = int(os.getenv("AUDIT_BATCH_SIZE", "100"))
+        self.flush_interval = float(os.getenv("AUDIT_FLUSH_INTERVAL_SECONDS", "1.0"))
+        self.enqueue_timeout = float(os.getenv("AUDIT_ENQUEUE_TIMEOUT_SECONDS", "0.05"))
+        self.max_retries = int(os.getenv("AUDIT_MAX_RETRIES", "3"))
+        self._queue = queue.Queue(maxsize=int(os.getenv("AUDIT_MAX_QUEUE", "10000")))
+        self._stopping = threading.Event()
+        self._thread = None
+        self.written = 0
+        self.direct_writes = 0
+        self.failed = 0
+
+    def start(self):
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Flushes every queued event, then ends the writer thread."""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            # Still flushing (e.g. retrying a slow write): draining now would race it
+            print(f"WARNING: Audit writer still busy after {timeout}s; {self._queue.qsize()} events left to it.")
+            return
+        self._thread = None
+        # Anything enqueued after the thread exited
+        self._flush(self._drain(self._queue.qsize()))
+
+    def write(self, entry: dict):
+        if self._thread is None:
+            self._insert_direct(entry)
+            return
+        try:
+            self._queue.put(entry, timeout=self.enqueue_timeout)
+        except queue.Full:
+            self._insert_direct(entry)
+
+    def _insert_direct(self, entry: dict):
+        self.collection.insert_one(entry)
+        self.direct_writes += 1
+        self._count([entry])
+
+    def _count(self, entries: list):
+        try:
+            record_daily_counts(self.collection.database, entries)
+        except Exception as e:
+            print(f"WARNING: Could not update audit daily counts: {e}")
+
+    def _drain(self, limit: int):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or (self._stopping.is_set() and self._queue.empty()):
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=min(remaining, 0.1)))
+                except queue.Empty:
+                    continue
+            self._flush(batch)
+
+    def _flush(self, batch: list):
+        if not batch:
+            return
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.collection.insert_many(batch, ordered=False)
+                self.written += len(batch)
+                self._count(batch)
+                return
+            except BulkWriteError as e:
+                # Retry only what failed; duplicate keys mean an earlier attempt already wrote it
+                failed = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+                failed_indexes = {err["index"] for err in failed}
+                self.written += len(batch) - len(failed)
+                self._count([entry for i, entry in enumerate(batch) if i not in failed_indexes])
+                batch = [batch[i] for i in sorted(failed_indexes)]
+                if not batch:
+                    return
+                if attempt == self.max_retries:
+                    self.failed += len(batch)
+                    print(f"ERROR: Dropped {len(batch)} audit events after {attempt + 1} attempts: {e}")
+                    return
+                time.sleep(min(2 ** attempt * 0.2, 5))
+            except Exception as e:
+                if attempt == self.max_retries:
+                    self.failed += len(batch)
+                    print(f"ERROR: Dropped {len(batch)} audit events after {attempt + 1} attempts: {e}")
+                    return
+                time.sleep(min(2 ** attempt * 0.2, 5))
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "max_queue": self._queue.maxsize,
+            "written": self.written,
+            "direct_writes": self.direct_writes,
+            "failed": self.failed,
+        }
+
 
 class AuditService:
-    def __init__(self, system_db):
+    def __init__(self, system_db, writer: AuditWriter = None):
         self.db = system_db # Points to alphadoc_system
+        # Without a writer, events are inserted synchronously
+        self.writer = writer
+
+    def ensure_indexes(self):
+        """Run at startup. An index problem or an unreachable system DB must not keep the API from starting."""
+        try:
+            self._ensure_indexes()
+        except PyMongoError as e:
+            print(f"WARNING: Could not ensure audit indexes: {e}")
+
+    def _ensure_indexes(self):
+        logs = self.db.audit_logs
+        # Keyset paging on (timestamp, _id) within a workspace, optionally narrowed by action or user
+        logs.create_index([("workspace_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)])
+        logs.create_index([("workspace_id", ASCENDING), ("action", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)])
+        logs.create_index([("workspace_id", ASCENDING), ("username", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)])
+        self._ensure_timestamp_index(logs)
+        self.db.audit_daily_counts.create_index([("workspace_id", ASCENDING), ("day", ASCENDING), ("action", ASCENDING)], unique=True)
+        self.db.audit_logs_archive.create_index([("workspace_id", ASCENDING), ("day", ASCENDING)])
+
+    @staticmethod
+    def _ensure_timestamp_index(logs):
+        """
+        The cross-workspace {timestamp: 1} index retention needs: a TTL index in
+        "ttl" mode (expiry updated in place when AUDIT_RETENTION_DAYS changes),
+        a plain one for the hourly archive scan in "archive" mode.
+        """
+        if AUDIT_RETENTION_DAYS and AUDIT_RETENTION_MODE == "ttl":
+            ensure_ttl_index(logs, "timestamp", AUDIT_RETENTION_DAYS * 86400)
+            return
+        existing = next((index for index in logs.list_indexes() if list(index["key"].items()) == [("timestamp", 1)]), None)
+        if existing is not None and "expireAfterSeconds" in existing:
+            # Left over from "ttl" mode; it would keep deleting events
+            logs.drop_index(existing["name"])
+            existing = None
+        if existing is None and AUDIT_RETENTION_DAYS:
+            logs.create_index("timestamp")
 
     def log_event(self, user_id: str, username: str, role: str, workspace_id: str, action: str, details: dict):
         """
@@ -20,12 +214,109 @@ class AuditService:
             "action": action,
             "details": details  # e.g. {"filename": "report.pdf"} or {"query": "How to..."}
         }
-        self.db.audit_logs.insert_one(log_entry)
+        if self.writer is not None:
+            self.writer.write(log_entry)
+        else:
+            self.db.audit_logs.insert_one(log_entry)
+            record_daily_counts(self.db, [log_entry])
+
+
+    def get_workspace_logs(self, workspace_id: str, limit: int = 50, cursor: str = None, action: str = None,
+                           username: str = None, start: datetime = None, end: datetime = None):
+        """
+        One page of a workspace's logs, newest first (Admin view).
+        Pass next_cursor back as cursor for the following page.
+        """
+        query = {"workspace_id": workspace_id}
+        if action:
+            query["action"] = action
+        if username:
+            query["username"] = username
+        if start or end:
+            query["timestamp"] = {}
+            if start:
+                query["timestamp"]["$gte"] = start
+            if end:
+                query["timestamp"]["$lt"] = end
+        if cursor:
+            last_time, last_id = self._decode_cursor(cursor)
+            query = {"$and": [query, {"$or": [
+                {"timestamp": {"$lt": last_time}},
+                {"timestamp": last_time, "_id": {"$lt": last_id}},
+            ]}]}
+
+        logs = list(self.db.audit_logs.find(query).sort([("timestamp", -1), ("_id", -1)]).limit(limit + 1))
+        has_more = len(logs) > limit
+        logs = logs[:limit]
+        next_cursor = self._encode_cursor(logs[-1]) if has_more else None
+        for log in logs:
+            log.pop("_id")
+        return {"items": logs, "next_cursor": next_cursor}
+
+    @staticmethod
+    def _encode_cursor(log: dict) -> str:
+        raw = json.dumps([log["timestamp"].isoformat(), str(log["_id"])]).encode("utf-8")
+        return base64.urlsafe_b64encode(raw).decode("ascii")
+
+    @staticmethod
+    def _decode_cursor(cursor: str):
+        try:
+            last_time, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+            return datetime.fromisoformat(last_time), ObjectId(last_id)
+        except Exception:
+            raise ValueError("Invalid cursor")
+
+    def get_daily_counts(self, workspace_id: str, days: int = 30):
+        """Pre-aggregated events per day and action for the last `days` days."""
+        since = (datetime.utcnow() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+        cursor = self.db.audit_daily_counts.find(
+            {"workspace_id": workspace_id, "day": {"$gte": since}},
+            {"_id": 0, "day": 1, "action": 1, "count": 1},
+        ).sort([("day", -1), ("action", 1)])
+        return list(cursor)
+
+    def enforce_retention(self):
+        """
+        Archives events older than AUDIT_RETENTION_DAYS (in "archive" mode): each
+        workspace-day is zlib-compressed BSON in audit_logs_archive, in parts of
+        AUDIT_ARCHIVE_BATCH events. In "ttl" mode the TTL index does the work.
+        Returns the number of events archived.
+        """
+        if not AUDIT_RETENTION_DAYS or AUDIT_RETENTION_MODE != "archive":
+            return 0
+
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        cutoff = today - timedelta(days=AUDIT_RETENTION_DAYS)
+        archived = 0
+        while True:
+            batch = list(self.db.audit_logs.find({"timestamp": {"$lt": cutoff}}).sort("timestamp", 1).limit(AUDIT_ARCHIVE_BATCH))
+            if not batch:
+                break
+            parts = {}
+            for log in batch:
+                parts.setdefault((log["workspace_id"], log["timestamp"].strftime("%Y-%m-%d")), []).append(log)
+            for (workspace_id, day), logs in parts.items():
+                # Keyed by the part's first event so a rerun after a crash overwrites instead of duplicating
+                part_id = f"{workspace_id}:{day}:{logs[0]['_id']}"
+                self.db.audit_logs_archive.replace_one({"_id": part_id}, {
+                    "workspace_id": workspace_id,
+                    "day": day,
+                    "count": len(logs),
+                    "archived_at": datetime.utcnow(),
+                    "data": bson.Binary(zlib.compress(bson.encode({"logs": logs}))),
+                }, upsert=True)
+            self.db.audit_logs.delete_many({"_id": {"$in": [log["_id"] for log in batch]}})
+            archived += len(batch)
 
+        if archived:
+            print(f"DEBUG: Archived {archived} audit events older than {cutoff.date()}.")
+        return archived
 
-    def get_workspace_logs(self, workspace_id: str, limit: int = 50):
-        """Retrieves the latest logs for a specific workspace (Admin view)."""
-        return list(self.db.audit_logs.find(
-            {"workspace_id": workspace_id}, 
-            {"_id": 0}
-        ).sort("timestamp", -1).limit(limit))
\ No newline at end of file
+    def get_archived_logs(self, workspace_id: str, day: str):
+        """Decompresses a workspace's archived events for one day (YYYY-MM-DD)."""
+        logs = []
+        for part in self.db.audit_logs_archive.find({"workspace_id": workspace_id, "day": day}):
+            logs.extend(bson.decode(zlib.decompress(part["data"]))["logs"])
+        for log in logs:
+            log.pop("_id", None)
+        return sorted(logs, key=lambda log: log["timestamp"], reverse=True)
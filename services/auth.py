@@ -1,17 +1,31 @@
+import asyncio
 import bcrypt
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from fastapi import HTTPException
+import os
 import uuid
 
+# bcrypt work factor for new hashes; existing hashes are upgraded on the next login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# bcrypt releases the GIL, so a small thread pool hashes in parallel without blocking the event loop
+AUTH_HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Hashes waiting for a worker beyond this are refused with 503 instead of queueing without bound
+AUTH_HASH_MAX_PENDING = int(os.getenv("AUTH_HASH_MAX_PENDING", "64"))
+
+_hash_executor = ThreadPoolExecutor(max_workers=AUTH_HASH_WORKERS, thread_name_prefix="bcrypt")
+
 
 class AuthService:
     def __init__(self, system_db):
         self.db = system_db
+        self._pending = 0
 
     def hash_password(self, password: str):
         """Hashes a password using bcrypt."""
         # Convert password to bytes, generate salt, and hash
         pwd_bytes = password.encode('utf-8')
-        salt = bcrypt.gensalt()
+        salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
         hashed_password = bcrypt.hashpw(pwd_bytes, salt)
         return hashed_password.decode('utf-8')
     
@@ -20,8 +34,35 @@ class AuthService:
                 plain_password.encode('utf-8'), 
                 hashed_password.encode('utf-8')
             )
+
+    @staticmethod
+    def needs_rehash(hashed_password: str) -> bool:
+        """True when a hash ($2b$<rounds>$...) was made with a different work factor."""
+        try:
+            return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS
+        except (IndexError, ValueError):
+            return False
+
+    async def _run_bounded(self, fn, *args):
+        if self._pending >= AUTH_HASH_MAX_PENDING:
+            raise HTTPException(status_code=503, detail="AUTH_BUSY", headers={"Retry-After": "1"})
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(_hash_executor, fn, *args)
+        finally:
+            self._pending -= 1
+
+    async def hash_password_async(self, password: str):
+        return await self._run_bounded(self.hash_password, password)
+
+    async def verify_password_async(self, plain_password, hashed_password):
+        return await self._run_bounded(self.verify_password, plain_password, hashed_password)
+
+    def rehash_password(self, user_id, plain_password: str):
+        """Upgrades a stored hash to the current work factor (run after a successful login)."""
+        self.db.users.update_one({"_id": user_id}, {"$set": {"password_hash": self.hash_password(plain_password)}})
     
-    def create_admin(self, username, password, workspace_name, google_api_key):
+    async def create_admin(self, username, password, workspace_name, google_api_key):
         """Creates a new Admin and registers their workspace."""
 
         # 1. Check if Username already exists globally
@@ -46,14 +87,14 @@ class AuthService:
         self.db.users.insert_one({
             "user_id": user_id,
             "username": username,
-            "password_hash": self.hash_password(password),
+            "password_hash": await self.hash_password_async(password),
             "role": "admin",
             "workspace_id": workspace_id
         })
         return {"message": "Admin and Workspace created", "workspace_id": workspace_id}
     
 
-    def create_researcher(self, username, password, workspace_id):
+    async def create_researcher(self, username, password, workspace_id):
         """Links a new Researcher to an existing Admin's workspace."""
 
         # 1. Check if Username already exists globally
@@ -69,7 +110,7 @@ class AuthService:
         self.db.users.insert_one({
             "user_id": user_id,
             "username": username,
-            "password_hash": self.hash_password(password),
+            "password_hash": await self.hash_password_async(password),
             "role": "researcher",
             "workspace_id": workspace_id
         })
@@ -0,0 +1,20 @@
+from pymongo import ReturnDocument
+
+# One document per tenant DB; its generation changes whenever the searchable corpus does
+_STATE_ID = "corpus"
+
+
+def get_corpus_generation(tenant_db) -> int:
+    state = tenant_db.corpus_state.find_one({"_id": _STATE_ID}, {"generation": 1})
+    return state.get("generation", 0) if state else 0
+
+
+def bump_corpus_generation(tenant_db) -> int:
+    """Marks the corpus as changed (document stored or version removed). Returns the new generation."""
+    state = tenant_db.corpus_state.find_one_and_update(
+        {"_id": _STATE_ID},
+        {"$inc": {"generation": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return state["generation"]
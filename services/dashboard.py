@@ -0,0 +1,78 @@
+import threading
+from concurrent.futures import Future
+from datetime import datetime
+from fastapi import HTTPException
+from services.rag_pipeline import RAGEngine
+
+# (workspace_id, doc_id) -> Future of the snapshot being generated in this process
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+class DashboardService:
+    """
+    Executive dashboards are generated once per stored document version and
+    kept on the document as dashboard_snapshot, so the Repository tab is a
+    single indexed read instead of a retrieval + LLM round trip.
+    Generation is single-flight per document: concurrent callers wait for the
+    run already in progress instead of each starting their own.
+    """
+
+    def __init__(self, tenant_db, index_name):
+        self.db = tenant_db
+        self.index_name = index_name
+
+    def generate_snapshot(self, doc_id: str, workspace_id: str):
+        engine = RAGEngine(self.db["chunks"], self.db["documents"], index_name=self.index_name)
+        summary = engine.generate_document_dashboard(doc_id, workspace_id)
+        snapshot = {"dashboard_summary": summary, "generated_at": datetime.utcnow().isoformat()}
+        self.db.documents.update_one({"_id": doc_id}, {"$set": {"dashboard_snapshot": snapshot}})
+        return snapshot
+
+    def generate_snapshot_once(self, doc_id: str, workspace_id: str):
+        """generate_snapshot, joining a run for the same document that is already in progress."""
+        key = (workspace_id, doc_id)
+        with _in_flight_lock:
+            future = _in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = _in_flight[key] = Future()
+        if not owner:
+            return future.result()
+
+        try:
+            snapshot = self.generate_snapshot(doc_id, workspace_id)
+            future.set_result(snapshot)
+            return snapshot
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with _in_flight_lock:
+                _in_flight.pop(key, None)
+
+    def generate_snapshot_in_background(self, doc_id: str, workspace_id: str):
+        """BackgroundTasks entry point: failures are logged, /dashboard/latest retries on demand."""
+        try:
+            self.generate_snapshot_once(doc_id, workspace_id)
+            print(f"DEBUG: Dashboard snapshot ready for document {doc_id}.")
+        except HTTPException as he:
+            print(f"WARNING: Dashboard snapshot for {doc_id} failed: {he.detail}")
+        except Exception as e:
+            print(f"WARNING: Dashboard snapshot for {doc_id} failed: {e}")
+
+    def latest(self, workspace_id: str):
+        latest_doc = self.db.documents.find_one(
+            {"is_current": True},
+            {"dashboard_snapshot": 1},
+            sort=[("upload_date", -1)],
+        )
+        if not latest_doc:
+            raise HTTPException(status_code=404, detail="No documents found")
+
+        snapshot = latest_doc.get("dashboard_snapshot")
+        if snapshot is None:
+            # Stored before snapshots existed, still being built, or the background run failed
+            snapshot = self.generate_snapshot_once(latest_doc["_id"], workspace_id)
+        return {"dashboard_summary": snapshot["dashboard_summary"], "doc_id": latest_doc["_id"],
+                "generated_at": snapshot["generated_at"]}
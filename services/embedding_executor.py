@@ -0,0 +1,95 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+
+
+def _is_transient(error: Exception) -> bool:
+    """Quota (429), timeouts and server-side failures are worth retrying; bad requests are not."""
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code in (408, 429) or code >= 500
+    return isinstance(error, (httpx.TransportError, ConnectionError, TimeoutError))
+
+
+class EmbeddingExecutor:
+    """
+    Sends embedding requests in provider-sized batches.
+    Batches run concurrently on a shared thread pool; every request, including
+    a single batch sent from the caller's thread, takes a slot of a process-wide
+    semaphore, so EMBEDDING_CONCURRENCY caps in-flight requests for the whole
+    process, not per document. Slots are not held during backoff. Transient
+    failures are retried with full-jitter exponential backoff. Output order
+    always matches input order.
+    """
+
+    def __init__(self):
+        self.batch_size = int(os.getenv("EMBEDDING_BATCH_SIZE", "100"))
+        self.concurrency = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+        self.max_retries = int(os.getenv("EMBEDDING_MAX_RETRIES", "5"))
+        self.base_delay = float(os.getenv("EMBEDDING_BACKOFF_BASE_SECONDS", "0.5"))
+        self.max_delay = float(os.getenv("EMBEDDING_BACKOFF_MAX_SECONDS", "20"))
+
+        self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="embed")
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self._latencies = deque(maxlen=1000)  # (batch_size, seconds, attempts)
+        self._retries = 0
+        self._failures = 0
+        self._lock = threading.Lock()
+
+    def embed(self, client, model: str, texts: list[str]) -> list[list[float]]:
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1:
+            return self._embed_batch(client, model, batches[0])
+
+        futures = [self._pool.submit(self._embed_batch, client, model, batch) for batch in batches]
+        vectors = []
+        for future in futures:
+            vectors.extend(future.result())
+        return vectors
+
+    def _embed_batch(self, client, model: str, batch: list[str]):
+        attempt = 0
+        start = time.perf_counter()
+        while True:
+            try:
+                with self._slots:
+                    result = client.models.embed_content(model=model, contents=batch)
+                break
+            except Exception as e:
+                if attempt >= self.max_retries or not _is_transient(e):
+                    with self._lock:
+                        self._failures += 1
+                    raise
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+                attempt += 1
+                with self._lock:
+                    self._retries += 1
+                print(f"WARNING: Embedding batch of {len(batch)} failed ({e}); retry {attempt} in {delay:.2f}s")
+                time.sleep(delay)
+
+        with self._lock:
+            self._latencies.append((len(batch), time.perf_counter() - start, attempt + 1))
+        return [e.values for e in result.embeddings]
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(seconds for _, seconds, _ in self._latencies)
+            retries, failures = self._retries, self._failures
+            batches = len(self._latencies)
+
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 4) if latencies else None
+
+        return {
+            "batch_size": self.batch_size,
+            "concurrency": self.concurrency,
+            "recent_batches": batches,
+            "latency_p50_seconds": percentile(0.5),
+            "latency_p95_seconds": percentile(0.95),
+            "retries": retries,
+            "failed_batches": failures,
+        }
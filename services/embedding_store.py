@@ -0,0 +1,98 @@
+import hashlib
+import os
+import re
+import sys
+import threading
+from array import array
+from datetime import datetime
+from pymongo import UpdateOne
+from core.cache import LRUCache
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Whitespace-insensitive form used for cache keys (layout noise shouldn't force a re-embed)."""
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    Vectors keyed by (model, normalized-text hash), so unchanged chunks of a
+    re-versioned document, or boilerplate repeated across documents, are never
+    embedded twice. A per-process LRU sits in front of the tenant's
+    embedding_cache collection; memory keys include the workspace so tenants
+    never share entries. In memory vectors are packed float32 arrays and the
+    cache is bounded by EMBEDDING_CACHE_BYTES; persisted vectors expire EMBEDDING_CACHE_TTL_DAYS
+    after they were first stored (TTL index from core.tenant_indexes).
+    """
+
+    def __init__(self):
+        self._memory = LRUCache(
+            max_size=int(os.getenv("EMBEDDING_CACHE_SIZE", "50000")),
+            max_bytes=int(os.getenv("EMBEDDING_CACHE_BYTES", str(128 * 1024 * 1024))),
+            sizeof=sys.getsizeof,
+        )
+        self._lock = threading.Lock()
+        self.requested = 0
+        self.deduplicated = 0
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, workspace_id: str, model: str, hashes: list[str], tenant_db=None) -> dict:
+        """Returns {hash: vector} for every hash already known."""
+        found = {}
+        remaining = []
+        for h in hashes:
+            vector = self._memory.get((workspace_id, model, h))
+            if vector is not None:
+                found[h] = vector.tolist()
+            else:
+                remaining.append(h)
+
+        if remaining and tenant_db is not None:
+            ids = [f"{model}:{h}" for h in remaining]
+            for doc in tenant_db.embedding_cache.find({"_id": {"$in": ids}}, {"vector": 1}):
+                h = doc["_id"].split(":", 1)[1]
+                found[h] = doc["vector"]
+                self._memory.set((workspace_id, model, h), array("f", doc["vector"]))
+        return found
+
+    def save(self, workspace_id: str, model: str, vectors: dict, tenant_db=None):
+        """Stores {hash: vector}."""
+        for h, vector in vectors.items():
+            self._memory.set((workspace_id, model, h), array("f", vector))
+
+        if tenant_db is not None and vectors:
+            now = datetime.utcnow()
+            tenant_db.embedding_cache.bulk_write([
+                UpdateOne(
+                    {"_id": f"{model}:{h}"},
+                    {"$setOnInsert": {"model": model, "vector": vector, "created_at": now}},
+                    upsert=True,
+                )
+                for h, vector in vectors.items()
+            ], ordered=False)
+
+    def record(self, requested: int, unique: int, hits: int):
+        with self._lock:
+            self.requested += requested
+            self.deduplicated += requested - unique
+            self.hits += hits
+            self.misses += unique - hits
+
+    def stats(self):
+        with self._lock:
+            unique = self.hits + self.misses
+            return {
+                "texts_requested": self.requested,
+                "duplicates_in_request": self.deduplicated,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / unique, 4) if unique else 0.0,
+                "memory": self._memory.stats(),
+            }
@@ -1,20 +1,308 @@
-from docling.document_converter import DocumentConverter
+import asyncio
+import bisect
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import HTTPException
 from langchain_text_splitters import MarkdownHeaderTextSplitter, RecursiveCharacterTextSplitter
 
+HEADERS_TO_SPLIT = [("#", "Header 1"), ("##", "Header 2"), ("###", "Header 3")]
+CHUNK_SIZE = 1500
+CHUNK_OVERLAP = 150
+
+
+def _build_converter():
+    # Imported lazily: Docling pulls in torch and the layout models
+    from docling.document_converter import DocumentConverter
+    return DocumentConverter()
+
+
+def _build_splitters():
+    markdown_splitter = MarkdownHeaderTextSplitter(headers_to_split_on=HEADERS_TO_SPLIT, strip_headers=False)
+    child_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, add_start_index=True)
+    return markdown_splitter, child_splitter
+
+
+# Structural metadata every chunk carries from ingestion to storage
+CHUNK_RECORD_FIELDS = ("header_path", "section_header", "section_id", "pages", "char_start", "char_end")
+
+_PROBE_LENGTH = 80
+
+
+def normalize_header(header: str) -> str:
+    """Comparable form of a header: no markdown marks, numbering-agnostic spacing, lowercase."""
+    return re.sub(r"[^0-9a-z]+", "-", (header or "").lstrip("#").strip().lower()).strip("-")
+
+
+def section_id(header_path: list[str]) -> str:
+    return "/".join(normalize_header(h) for h in header_path) or "general"
+
+
+def export_markdown(document):
+    """
+    Markdown for a Docling document plus [offset, page_no] pairs marking where
+    each page starts in it. The document is exported once; page starts are the
+    positions of each page's first text item, taken from the items' provenance.
+    """
+    markdown_text = document.export_to_markdown()
+    page_starts, cursor, last_page = [], 0, None
+    for item, _ in document.iterate_items():
+        prov = getattr(item, "prov", None)
+        text = (getattr(item, "text", None) or "").strip()
+        if not prov or not text or (last_page is not None and prov[0].page_no <= last_page):
+            continue
+        # Markdown escaping can hide an item; the next item on the same page is tried instead
+        offset = markdown_text.find(text[:_PROBE_LENGTH], cursor)
+        if offset < 0:
+            continue
+        # Anything before the first located item belongs to the first page
+        page_starts.append([offset if page_starts else 0, prov[0].page_no])
+        cursor, last_page = offset, prov[0].page_no
+    return {"markdown": markdown_text, "page_starts": page_starts}
+
+
+_NON_SPACE = re.compile(r"\S")
+
+
+def _non_space(text: str) -> int:
+    return sum(1 for _ in _NON_SPACE.finditer(text))
+
+
+def _locate_section(markdown_text: str, section_text: str, cursor: int):
+    """Offset of a section in the Markdown, searched by its first line from where the previous one ended."""
+    lines = [line.strip() for line in section_text.splitlines() if line.strip()]
+    if not lines:
+        return None
+    start = markdown_text.find(lines[0][:_PROBE_LENGTH], cursor)
+    if start < 0:
+        start = markdown_text.find(lines[0][:_PROBE_LENGTH])
+    return start if start >= 0 else None
+
+
+def _pages_for(start, end, page_starts):
+    if start is None or not page_starts:
+        return []
+    offsets = [offset for offset, _ in page_starts]
+    first = max(0, bisect.bisect_right(offsets, start) - 1)
+    last = max(first, bisect.bisect_right(offsets, max(start, end - 1)) - 1)
+    return [page_no for _, page_no in page_starts[first:last + 1]]
+
+
+def _split_markdown(converted, markdown_splitter, child_splitter):
+    """
+    Splits into logical sections, then into final chunks, and annotates each
+    chunk with its header path, section id, character span and pages.
+    converted is export_markdown() output (or plain Markdown text).
+
+    The header splitter rejoins lines, changing only whitespace, so a chunk's
+    span is found by counting non-whitespace characters: from the section's
+    offset in the Markdown to the chunk's start_index in the section. Text
+    repeated within a section, like identical table rows, can't misplace it.
+    """
+    if isinstance(converted, str):
+        converted = {"markdown": converted, "page_starts": []}
+    markdown_text, page_starts = converted["markdown"], converted["page_starts"]
+    non_space_at = [m.start() for m in _NON_SPACE.finditer(markdown_text)]
+
+    chunks, cursor = [], 0
+    for section in markdown_splitter.split_text(markdown_text):
+        section_start = _locate_section(markdown_text, section.page_content, cursor)
+        # Index into non_space_at of the section's first non-whitespace character
+        base = bisect.bisect_left(non_space_at, section_start) if section_start is not None else None
+        counted_to = 0  # start_index only grows within a section, so its prefix is counted incrementally
+        for chunk in child_splitter.split_documents([section]):
+            path = [chunk.metadata[name] for _, name in HEADERS_TO_SPLIT if chunk.metadata.get(name)]
+            offset = chunk.metadata.pop("start_index", -1)
+            start = end = None
+            if base is not None and offset >= 0:
+                base += _non_space(section.page_content[counted_to:offset])
+                counted_to = offset
+                last = base + _non_space(chunk.page_content) - 1
+                if base <= last < len(non_space_at):
+                    start, end = non_space_at[base], non_space_at[last] + 1
+                    cursor = max(cursor, end)
+            chunk.metadata.update({
+                "header_path": path,
+                "section_header": path[-1] if path else "General",
+                "section_id": section_id(path),
+                "pages": _pages_for(start, end, page_starts),
+                "char_start": start,
+                "char_end": end,
+            })
+            chunks.append(chunk)
+    return chunks
+
+
+# --- Worker process state: each pool worker loads Docling once and keeps it warm ---
+_worker_converter = None
+_worker_splitters = None
+
+
+def _init_worker():
+    global _worker_converter, _worker_splitters
+    _worker_converter = _build_converter()
+    _worker_splitters = _build_splitters()
+    try:
+        from docling.datamodel.base_models import InputFormat
+        _worker_converter.initialize_pipeline(InputFormat.PDF)
+    except Exception as e:
+        # Models will load on the first conversion instead
+        print(f"WARNING: Docling warm-up failed in worker {os.getpid()}: {e}")
+
+
+def _to_docling_source(source):
+    """Accepts a file path or a (filename, bytes) pair for in-memory uploads."""
+    if isinstance(source, tuple):
+        from io import BytesIO
+        from docling.datamodel.base_models import DocumentStream
+        name, data = source
+        return DocumentStream(name=name, stream=BytesIO(data))
+    return source
+
+
+def _convert_in_worker(source):
+    return export_markdown(_worker_converter.convert(_to_docling_source(source)).document)
+
+
+def _split_in_worker(converted):
+    return _split_markdown(converted, *_worker_splitters)
+
+
 class IngestionService:
+    """
+    Converts uploads to Markdown with Docling and splits them into chunks.
+    The async API runs conversion and splitting in a pool of warm worker
+    processes so CPU-heavy layout analysis / OCR never holds the API's GIL.
+    At most workers + max_queue jobs are accepted at once; beyond that callers
+    get a 503 with Retry-After. A timed-out job's pool is recycled: its workers
+    are terminated so a hung conversion can't hold a slot past the limit, and
+    the next job starts a fresh pool. A pool broken by a crashed worker (e.g.
+    OOM-killed) is discarded the same way instead of failing every later job.
+    """
+
     def __init__(self):
-        self.converter = DocumentConverter()
-        self.headers_to_split = [("#", "Header 1"), ("##", "Header 2"), ("###", "Header 3")]
-        self.markdown_splitter = MarkdownHeaderTextSplitter(headers_to_split_on=self.headers_to_split, strip_headers=False)
-        self.child_splitter = RecursiveCharacterTextSplitter(chunk_size=1500, chunk_overlap=150)
+        self.headers_to_split = HEADERS_TO_SPLIT
+        self.markdown_splitter, self.child_splitter = _build_splitters()
+        self._converter = None
+
+        self.workers = int(os.getenv("INGESTION_WORKERS", str(min(4, os.cpu_count() or 1))))
+        self.max_queue = int(os.getenv("INGESTION_MAX_QUEUE", "8"))
+        self.job_timeout = float(os.getenv("INGESTION_TIMEOUT_SECONDS", "600"))
+        self.retry_after = int(os.getenv("INGESTION_RETRY_AFTER_SECONDS", "30"))
+        self.max_tasks_per_child = int(os.getenv("INGESTION_MAX_TASKS_PER_CHILD", "50"))
+
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._pool_restarts = 0
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+
+    @property
+    def converter(self):
+        if self._converter is None:
+            self._converter = _build_converter()
+        return self._converter
 
     def process_file(self, source_path: str):
+        """Synchronous, in-process conversion (notebooks and scripts)."""
         # Convert PDF to Markdown
         result = self.converter.convert(source_path)
-        markdown_text = result.document.export_to_markdown()
-        
-        # Split into logical sections
-        section_docs = self.markdown_splitter.split_text(markdown_text)
-        
-        # Split into final chunks
-        return self.child_splitter.split_documents(section_docs)
\ No newline at end of file
+        converted = export_markdown(result.document)
+        return _split_markdown(converted, self.markdown_splitter, self.child_splitter)
+
+    async def convert_async(self, source):
+        """source is a file path or a (filename, bytes) pair. Returns export_markdown() output."""
+        return await self._submit(_convert_in_worker, source)
+
+    async def split_async(self, converted):
+        return await self._submit(_split_in_worker, converted)
+
+    async def process_file_async(self, source):
+        converted = await self.convert_async(source)
+        return await self.split_async(converted)
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "in_flight": self._in_flight,
+            "timeout_seconds": self.job_timeout,
+            "pool_restarts": self._pool_restarts,
+        }
+
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    # spawn: forking a process that already imported torch is unsafe
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    max_tasks_per_child=self.max_tasks_per_child or None,
+                )
+            return self._pool
+
+    def _recycle_pool(self, pool, reason: str):
+        """Terminates a pool's workers and forgets it; the next job builds a new one."""
+        with self._pool_lock:
+            if self._pool is not pool:
+                return  # Another caller already recycled it
+            self._pool = None
+            self._pool_restarts += 1
+        print(f"WARNING: Recycling ingestion worker pool ({reason}).")
+        # The executor can't cancel a running task, so stop its processes directly
+        for process in list((getattr(pool, "_processes", None) or {}).values()):
+            if process.is_alive():
+                process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    async def _submit(self, fn, arg):
+        with self._in_flight_lock:
+            capacity = max(1, self.workers) + self.max_queue
+            if self._in_flight >= capacity:
+                raise HTTPException(
+                    status_code=503,
+                    detail="INGESTION_BUSY",
+                    headers={"Retry-After": str(self.retry_after)},
+                )
+            self._in_flight += 1
+
+        pool = None
+        try:
+            if self.workers <= 0:
+                # Pool disabled (INGESTION_WORKERS=0): run in a thread of this process
+                future = asyncio.to_thread(self._run_inline, fn, arg)
+            else:
+                pool = self._get_pool()
+                future = asyncio.wrap_future(pool.submit(fn, arg))
+            return await asyncio.wait_for(future, timeout=self.job_timeout)
+        except asyncio.TimeoutError:
+            if pool is not None:
+                self._recycle_pool(pool, "job timed out")
+            raise HTTPException(status_code=504, detail="CONVERSION_TIMEOUT")
+        except BrokenProcessPool:
+            # A worker died mid-job; every job on that pool fails, later ones get a new pool
+            self._recycle_pool(pool, "worker process died")
+            raise HTTPException(
+                status_code=503,
+                detail="INGESTION_WORKER_CRASHED",
+                headers={"Retry-After": str(self.retry_after)},
+            )
+        finally:
+            with self._in_flight_lock:
+                self._in_flight -= 1
+
+    def _run_inline(self, fn, arg):
+        if fn is _convert_in_worker:
+            return export_markdown(self.converter.convert(_to_docling_source(arg)).document)
+        return _split_markdown(arg, self.markdown_splitter, self.child_splitter)
@@ -1,26 +1,39 @@
 from google import genai
-from models.schemas import ActionableInsightList, DocumentSummaries, FullDocumentExtraction
+from models.schemas import ActionableInsight, ActionableInsightList, DocumentSummaries, FullDocumentExtraction
 from fastapi import HTTPException
-from core.database import system_mongodb
+from core.database import workspace_config, db_instance
+from core.cache import LRUCache
+from services.embedding_store import EmbeddingStore, text_hash
+from services.embedding_executor import EmbeddingExecutor
+from services.ingestion import normalize_header
 from dotenv import load_dotenv
+import asyncio
 import os
 
+GENERATION_MODEL = "gemini-3-flash-preview"
+EMBEDDING_MODEL = "models/text-embedding-004"
 
-def get_workspace_key(workspace_id: str):
-    """Checks the DB for a key and puts it in the system memory."""
-    workspace = system_mongodb.workspaces.find_one({"workspace_id": workspace_id})
-    if workspace and "google_api_key" in workspace:
-        print(f"DEBUG: Found key in DB for {workspace_id}. Loading to environment...")
-        return workspace["google_api_key"]
-    print(f"DEBUG: No key found in DB for {workspace_id}.")
-    return None
+# Above this many characters extraction and summaries run as windowed map-reduce
+MAP_REDUCE_THRESHOLD_CHARS = int(os.getenv("MAP_REDUCE_THRESHOLD_CHARS", "60000"))
+MAP_REDUCE_WINDOW_CHUNKS = int(os.getenv("MAP_REDUCE_WINDOW_CHUNKS", "16"))
+MAP_REDUCE_CONCURRENCY = int(os.getenv("MAP_REDUCE_CONCURRENCY", "4"))
+
+# genai.Client is thread-safe and keeps its HTTP connections alive, so reuse it per key
+genai_client_cache = LRUCache(
+    max_size=int(os.getenv("GENAI_CLIENT_CACHE_SIZE", "64")),
+    ttl=float(os.getenv("GENAI_CLIENT_IDLE_TTL_SECONDS", "3600")),
+    sliding=True,
+)
+
+embedding_store = EmbeddingStore()
+embedding_executor = EmbeddingExecutor()
 
 
 class IntelligenceService:
     def _get_client(self, workspace_id: str):
 
         # 2. load it from the Database
-        api_key = get_workspace_key(workspace_id)
+        api_key = workspace_config.get_api_key(workspace_id)
 
         # 3. If it's still not there, the Admin hasn't set it yet
         if not api_key:
@@ -29,8 +42,12 @@ class IntelligenceService:
                 detail="AI_CONFIG_MISSING"
             )
         
+        client = genai_client_cache.get((workspace_id, api_key))
+        if client is not None:
+            return client
+
         try:
-            client = genai.Client(api_key=api_key)
+            client = genai_client_cache.set((workspace_id, api_key), genai.Client(api_key=api_key))
             # A tiny "ping" or check can be done here if you want to verify immediately, 
             # otherwise, the error will be caught during the first generation call.
             return client
@@ -38,13 +55,244 @@ class IntelligenceService:
             raise HTTPException(status_code=401, detail="INVALID_API_KEY")
 
 
-    def generate_embedding(self, texts: list[str], workspace_id: str) -> list[list[float]]:
+    async def analyze_document(self, chunk_texts: list[str], workspace_id: str, on_stage=None, cache=None,
+                               chunk_headers: list[str] = None):
+        """
+        Runs the full intelligence pipeline without blocking the event loop.
+        Extraction, insights and embeddings don't depend on each other and run
+        concurrently; the summary stage starts as soon as the insights are ready.
+        Documents longer than MAP_REDUCE_THRESHOLD_CHARS go through the windowed
+        map-reduce path instead of a single prompt.
+        on_stage(stage, event) is called with "started"/"finished" for progress reporting.
+        cache (optional) exposes async get(name) and put(name, value); stages found there are skipped.
+        chunk_headers (optional) is each chunk's section header from ingestion; section
+        summaries are asked to use exactly these so storage can join them by header.
+        """
+        full_text = "\n--- NEW CHUNK ---\n".join(chunk_texts)
+        windowed = len(full_text) > MAP_REDUCE_THRESHOLD_CHARS
+        windows = self._windows(chunk_texts) if windowed else None
+
+        async def stage(name, cache_name, schema, compute):
+            cached = await cache.get(cache_name) if cache else None
+            if cached is not None:
+                return schema.model_validate(cached) if schema else cached
+
+            if on_stage:
+                on_stage(name, "started")
+            result = await compute()
+            if on_stage:
+                on_stage(name, "finished")
+
+            if cache:
+                cache.put(cache_name, result.model_dump() if schema else result)
+            return result
+
+        async def extraction():
+            if windowed:
+                return await self._map_extraction(windows, workspace_id)
+            return await asyncio.to_thread(self.generate_all_intelligence, full_text, workspace_id)
+
+        async def insights():
+            if windowed:
+                return await self._map_insights(windows, len(chunk_texts), workspace_id)
+            return await asyncio.to_thread(self.generate_actionable_insights, full_text, len(chunk_texts), workspace_id)
+
+        async def insights_then_summaries():
+            insight_list = await stage("extracting", "insights", ActionableInsightList, insights)
+
+            async def summaries():
+                if windowed:
+                    return await self._hierarchical_summaries(windows, insight_list, workspace_id, chunk_headers)
+                # Below MAP_REDUCE_THRESHOLD_CHARS the whole text fits one prompt, so don't cut it
+                return await asyncio.to_thread(
+                    self.generate_final_summaries, insight_list, full_text, workspace_id,
+                    text_limit=None, section_headers=self._distinct_headers(chunk_headers),
+                )
+
+            return insight_list, await stage("summarizing", "summaries", DocumentSummaries, summaries)
+
+        async def embeddings():
+            return await asyncio.to_thread(self.generate_embedding, chunk_texts, workspace_id)
+
+        intelligence, (insight_list, summaries), vectors = await asyncio.gather(
+            stage("extracting", "extraction", FullDocumentExtraction, extraction),
+            insights_then_summaries(),
+            stage("embedding", "embeddings", None, embeddings),
+        )
+        return intelligence, insight_list, summaries, vectors
+
+
+    # --- Map-reduce mode for documents that don't fit a single prompt ---
+
+    def _windows(self, chunk_texts: list[str]):
+        """Groups chunks into (first_index, count, text) windows, numbering chunks with their global index."""
+        windows = []
+        for start in range(0, len(chunk_texts), MAP_REDUCE_WINDOW_CHUNKS):
+            window = chunk_texts[start:start + MAP_REDUCE_WINDOW_CHUNKS]
+            text = "\n".join(f"--- CHUNK {start + i} ---\n{chunk}" for i, chunk in enumerate(window))
+            windows.append((start, len(window), text))
+        return windows
+
+    async def _map(self, windows, fn):
+        """Runs fn(window) for every window, at most MAP_REDUCE_CONCURRENCY at a time, in window order."""
+        semaphore = asyncio.Semaphore(MAP_REDUCE_CONCURRENCY)
+
+        async def run(window):
+            async with semaphore:
+                return await asyncio.to_thread(fn, window)
+
+        return await asyncio.gather(*(run(w) for w in windows))
+
+    @staticmethod
+    def _global_index(index: int, start: int, count: int):
+        # Models sometimes restart numbering at 0 inside a window
+        if start <= index < start + count:
+            return index
+        if 0 <= index < count:
+            return start + index
+        return min(max(index, start), start + count - 1)
+
+    async def _map_extraction(self, windows, workspace_id: str):
+        results = await self._map(windows, lambda w: self.generate_all_intelligence(w[2], workspace_id))
+
+        entities, relationships, topics = {}, {}, {}
+        for (start, count, _), result in zip(windows, results):
+            for ent in result.entities:
+                ent.chunk_index = self._global_index(ent.chunk_index, start, count)
+                entities.setdefault((ent.chunk_index, ent.name.strip().lower(), ent.type.strip().lower()), ent)
+            for rel in result.relationships:
+                rel.chunk_index = self._global_index(rel.chunk_index, start, count)
+                key = (rel.chunk_index, rel.subject.strip().lower(), rel.relation.strip().lower(), rel.object.strip().lower())
+                relationships.setdefault(key, rel)
+            for topic in result.topics:
+                topics.setdefault(topic.strip().lower(), [topic, 0])[1] += 1
+
+        # Documents state their purpose up front, so the first window's intent leads
+        return FullDocumentExtraction(
+            document_intent=results[0].document_intent,
+            topics=[t for t, _ in sorted(topics.values(), key=lambda t: -t[1])],
+            entities=list(entities.values()),
+            relationships=list(relationships.values()),
+        )
+
+    async def _map_insights(self, windows, chunk_count: int, workspace_id: str):
+        results = await self._map(
+            windows, lambda w: self.generate_actionable_insights(w[2], w[1], workspace_id, first_index=w[0])
+        )
+
+        merged, covered = {}, set()
+        for (start, count, _), result in zip(windows, results):
+            for ins in result.insights:
+                ins.chunk_index = self._global_index(ins.chunk_index, start, count)
+                merged.setdefault((ins.chunk_index, ins.type.strip().lower(), ins.description.strip().lower()), ins)
+                covered.add(ins.chunk_index)
+
+        insights = list(merged.values())
+        for idx in range(chunk_count):
+            if idx not in covered:
+                insights.append(ActionableInsight(chunk_index=idx, type="N/A", description="N/A", entities=[], date_or_value="N/A"))
+        insights.sort(key=lambda ins: ins.chunk_index)
+        return ActionableInsightList(insights=insights)
+
+    @staticmethod
+    def _distinct_headers(headers):
+        """Headers in document order without repeats, or None when ingestion supplied none."""
+        if not headers:
+            return None
+        return list(dict.fromkeys(h for h in headers if h and h != "General")) or None
+
+    async def _hierarchical_summaries(self, windows, insight_list, workspace_id: str, chunk_headers=None):
+        def summarize_window(window):
+            start, count, text = window
+            window_insights = [i for i in insight_list.insights if start <= i.chunk_index < start + count and i.type != "N/A"]
+            headers = self._distinct_headers(chunk_headers[start:start + count]) if chunk_headers else None
+            return self.generate_final_summaries(window_insights, text, workspace_id, text_limit=None,
+                                                 section_headers=headers)
+
+        partials = await self._map(windows, summarize_window)
+
+        sections, seen = [], set()
+        for partial in partials:
+            for section in partial.section_summaries:
+                key = normalize_header(section.section_header)
+                if key not in seen:
+                    seen.add(key)
+                    sections.append(section)
+
+        reduced = await asyncio.to_thread(self.generate_summaries_from_parts, partials, workspace_id)
+        return DocumentSummaries(
+            executive_summary=reduced.executive_summary,
+            technical_summary=reduced.technical_summary,
+            section_summaries=sections,
+        )
+
+    def generate_summaries_from_parts(self, partial_summaries, workspace_id: str):
+        """Reduce step: one executive/technical summary from the per-window summaries."""
         client = self._get_client(workspace_id)
-        result = client.models.embed_content(
-            model="models/text-embedding-004",
-            contents=texts
+        parts = "\n\n".join(
+            f"PART {i + 1}\nEXECUTIVE: {p.executive_summary}\nTECHNICAL: {p.technical_summary}\n"
+            f"SECTIONS: {'; '.join(s.section_header for s in p.section_summaries)}"
+            for i, p in enumerate(partial_summaries)
+        )
+        prompt = f"""
+        The following are summaries of consecutive parts of ONE long document, in order.
+        Combine them into summaries of the whole document.
+
+        PART SUMMARIES:
+        {parts}
+
+        REQUIREMENTS:
+        1. Executive: 3-5 sentences, high-level, covering the whole document.
+        2. Technical: Detailed, focusing on dependencies across parts.
+        3. Section-wise: Return an empty list (sections are taken from the parts).
+        """
+        response = client.models.generate_content(
+            model=GENERATION_MODEL,
+            contents=prompt,
+            config={
+                "response_mime_type": "application/json",
+                "response_schema": DocumentSummaries,
+            }
         )
-        return [e.values for e in result.embeddings]
+        return response.parsed
+
+
+    def generate_embedding(self, texts: list[str], workspace_id: str) -> list[list[float]]:
+        """
+        Embeds texts, deduplicating them first and only sending texts the
+        EmbeddingStore hasn't seen for this workspace and model to the API.
+        """
+        hashes = [text_hash(t) for t in texts]
+        unique = {}
+        for h, text in zip(hashes, texts):
+            unique.setdefault(h, text)
+
+        tenant_db = self._get_tenant_db(workspace_id)
+        vectors = embedding_store.lookup(workspace_id, EMBEDDING_MODEL, list(unique), tenant_db)
+        hits = len(vectors)
+
+        missing = [h for h in unique if h not in vectors]
+        if missing:
+            client = self._get_client(workspace_id)
+            embedded = embedding_executor.embed(client, EMBEDDING_MODEL, [unique[h] for h in missing])
+            new_vectors = dict(zip(missing, embedded))
+            vectors.update(new_vectors)
+            try:
+                embedding_store.save(workspace_id, EMBEDDING_MODEL, new_vectors, tenant_db)
+            except Exception as e:
+                print(f"WARNING: Could not persist {len(new_vectors)} embeddings: {e}")
+
+        embedding_store.record(len(texts), len(unique), hits)
+        return [vectors[h] for h in hashes]
+
+
+    def _get_tenant_db(self, workspace_id: str):
+        # The embedding store still works in memory if storage isn't configured yet
+        try:
+            tenant_db, _ = db_instance.get_tenant_db(workspace_id)
+            return tenant_db
+        except HTTPException:
+            return None
     
 
     def generate_all_intelligence(self, full_text_to_analyze, workspace_id: str):
@@ -65,7 +313,7 @@ class IntelligenceService:
             """
 
         response = client.models.generate_content(
-            model='gemini-3-flash-preview',
+            model=GENERATION_MODEL,
             contents=prompt,
             config={
                 'response_mime_type': 'application/json',
@@ -75,20 +323,20 @@ class IntelligenceService:
         return response.parsed
 
 
-    def generate_actionable_insights(self, full_text_to_analyze: str, chunk_count: int, workspace_id: str):
+    def generate_actionable_insights(self, full_text_to_analyze: str, chunk_count: int, workspace_id: str, first_index: int = 0):
         client = self._get_client(workspace_id)
         prompt = f"""
             Analyze these document segments. For EVERY numbered chunk index, you MUST return at least one entry in the 'insights' list.
 
             - If a chunk contains a Risk, Decision, Deadline or other Action: Extract it normally.
             - If a chunk contains NO actionable insights: Set 'type' to "N/A", 'description' to "N/A", 'date_or_value' to "N/A" and 'entities' to [].
-            - Every chunk index from 0 to {chunk_count-1} must be represented in your output.
+            - Every chunk index from {first_index} to {first_index + chunk_count - 1} must be represented in your output.
 
             SEGMENTS:
             {full_text_to_analyze}
             """
         response = client.models.generate_content(
-            model='gemini-3-flash-preview',
+            model=GENERATION_MODEL,
             contents=prompt,
             config={
                 'response_mime_type': 'application/json',
@@ -98,10 +346,19 @@ class IntelligenceService:
         return response.parsed
     
 
-    def generate_final_summaries(self, insights_list, original_text: str, workspace_id: str):
+    def generate_final_summaries(self, insights_list, original_text: str, workspace_id: str, text_limit: int = 10000,
+                                 section_headers: list[str] = None):
         # We pass the list of extracted insights as a helper to the model
         # This ensures the summary doesn't miss the specific risks/deadlines we found
         client = self._get_client(workspace_id)
+        if section_headers:
+            # Headers come from the chunker; reusing them verbatim lets storage join summaries to chunks
+            section_requirement = (
+                "A summary for each of these headers, using each header exactly as written as section_header: "
+                + "; ".join(section_headers)
+            )
+        else:
+            section_requirement = "A summary for each major header identified."
         prompt = f"""
         Using the following extracted insights and the original text, generate three types of summaries.
 
@@ -109,17 +366,17 @@ class IntelligenceService:
         {insights_list}
 
         ORIGINAL TEXT:
-        {original_text[:10000]} # Using a large window
+        {original_text[:text_limit]} # Using a large window
 
         REQUIREMENTS:
         1. Executive: 3-5 sentences, high-level.
         2. Technical: Detailed, focusing on dependencies.
-        3. Section-wise: A summary for each major header identified.
+        3. Section-wise: {section_requirement}
         """
 
         # Using your working extraction pattern
         response = client.models.generate_content(
-            model="gemini-3-flash-preview",
+            model=GENERATION_MODEL,
             contents=prompt,
             config={
                 "response_mime_type": "application/json",
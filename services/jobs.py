@@ -0,0 +1,433 @@
+import asyncio
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from fastapi import HTTPException
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class InMemoryJobStore:
+    """Process-local job store with the same interface as MongoJobStore (tests, single-worker dev)."""
+
+    def __init__(self):
+        self._jobs = {}
+        self._sources = {}
+        self._lock = threading.Lock()
+
+    def ensure_indexes(self):
+        pass
+
+    def create(self, job: dict, source: bytes):
+        with self._lock:
+            self._jobs[job["_id"]] = dict(job)
+            self._sources[job["_id"]] = source
+
+    def get(self, job_id: str, include_result: bool = False):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job = dict(job)
+        if not include_result:
+            job.pop("result", None)
+        return job
+
+    def get_source(self, job_id: str):
+        with self._lock:
+            return self._sources.get(job_id)
+
+    def update(self, job_id: str, fields: dict, expected_status: str = None):
+        """Returns False when the job is gone or no longer in expected_status."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or (expected_status and job["status"] != expected_status):
+                return False
+            for key, value in fields.items():
+                # Support the dotted "stages.<name>" paths MongoJobStore uses
+                target = job
+                *parents, leaf = key.split(".")
+                for part in parents:
+                    target = target.setdefault(part, {})
+                target[leaf] = value
+            job["updated_at"] = datetime.utcnow()
+            return True
+
+    def claim(self, job_id: str, instance_id: str):
+        """Atomically moves a queued job to running. Returns None if it was taken or cancelled."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["status"] != QUEUED:
+                return None
+            job.update({"status": RUNNING, "instance_id": instance_id, "started_at": datetime.utcnow()})
+            return dict(job)
+
+    def clear_source(self, job_id: str):
+        with self._lock:
+            self._sources.pop(job_id, None)
+
+    def heartbeat(self, job_ids: list[str], instance_id: str):
+        with self._lock:
+            for job_id in job_ids:
+                job = self._jobs.get(job_id)
+                if job and job["status"] == RUNNING and job.get("instance_id") == instance_id:
+                    job["updated_at"] = datetime.utcnow()
+
+    def recoverable_job_ids(self, stale_before: datetime, instance_id: str = None):
+        with self._lock:
+            for job_id, job in self._jobs.items():
+                if job["status"] == RUNNING and job["updated_at"] < stale_before:
+                    if job_id in self._sources:
+                        job.update({"status": QUEUED, "stage": None})
+                    else:
+                        job.update({"status": FAILED, "error": "INTERRUPTED", "finished_at": datetime.utcnow()})
+            queued = [job for job in self._jobs.values() if job["status"] == QUEUED]
+            return [job["_id"] for job in sorted(queued, key=lambda job: job["created_at"])]
+
+
+class MongoJobStore:
+    """
+    Job records in alphadoc_system.analysis_jobs so queued work survives restarts.
+    Finished jobs expire after JOB_RETENTION_HOURS. Uploads larger than what fits
+    in a BSON document are kept in memory only: those jobs are marked
+    volatile_source and only the submitting instance (submitted_by) may run
+    them. If it stops heartbeating them they fail as INTERRUPTED.
+    """
+
+    _MAX_PERSISTED_SOURCE = 15 * 1024 * 1024
+
+    def __init__(self, system_db):
+        self.collection = system_db.analysis_jobs
+        self.retention = timedelta(hours=float(os.getenv("JOB_RETENTION_HOURS", "24")))
+        self._volatile_sources = {}
+
+    def ensure_indexes(self):
+        self.collection.create_index([("status", 1), ("updated_at", 1)])
+        self.collection.create_index("expire_at", expireAfterSeconds=0)
+
+    def create(self, job: dict, source: bytes):
+        doc = dict(job)
+        if len(source) <= self._MAX_PERSISTED_SOURCE:
+            doc["source"] = source
+        else:
+            doc["volatile_source"] = True
+            self._volatile_sources[job["_id"]] = source
+        self.collection.insert_one(doc)
+
+    def get(self, job_id: str, include_result: bool = False):
+        projection = {"source": 0}
+        if not include_result:
+            projection["result"] = 0
+        return self.collection.find_one({"_id": job_id}, projection)
+
+    def get_source(self, job_id: str):
+        if job_id in self._volatile_sources:
+            return self._volatile_sources[job_id]
+        doc = self.collection.find_one({"_id": job_id}, {"source": 1})
+        return doc.get("source") if doc else None
+
+    def update(self, job_id: str, fields: dict, expected_status: str = None):
+        """Returns False when the job is gone or no longer in expected_status."""
+        fields = {**fields, "updated_at": datetime.utcnow()}
+        if fields.get("status") in FINISHED_STATES:
+            fields["expire_at"] = datetime.utcnow() + self.retention
+        query = {"_id": job_id}
+        if expected_status:
+            query["status"] = expected_status
+        return self.collection.update_one(query, {"$set": fields}).matched_count > 0
+
+    def claim(self, job_id: str, instance_id: str):
+        now = datetime.utcnow()
+        return self.collection.find_one_and_update(
+            {"_id": job_id, "status": QUEUED},
+            {"$set": {"status": RUNNING, "instance_id": instance_id, "started_at": now, "updated_at": now}},
+            projection={"source": 0, "result": 0},
+        )
+
+    def clear_source(self, job_id: str):
+        self._volatile_sources.pop(job_id, None)
+        self.collection.update_one({"_id": job_id}, {"$unset": {"source": ""}})
+
+    def heartbeat(self, job_ids: list[str], instance_id: str):
+        if job_ids:
+            self.collection.update_many(
+                {"_id": {"$in": job_ids}, "status": RUNNING, "instance_id": instance_id},
+                {"$set": {"updated_at": datetime.utcnow()}},
+            )
+        # Queued uploads only this instance holds: peers fail them once these stop
+        self.collection.update_many(
+            {"status": QUEUED, "volatile_source": True, "submitted_by": instance_id},
+            {"$set": {"updated_at": datetime.utcnow()}},
+        )
+
+    def recoverable_job_ids(self, stale_before: datetime, instance_id: str = None):
+        # Jobs whose worker died mid-run stop heartbeating; put them back in the queue
+        self.collection.update_many(
+            {"status": RUNNING, "updated_at": {"$lt": stale_before}, "source": {"$exists": True}},
+            {"$set": {"status": QUEUED, "stage": None}},
+        )
+        self.collection.update_many(
+            {"status": RUNNING, "updated_at": {"$lt": stale_before}, "source": {"$exists": False}},
+            {"$set": {"status": FAILED, "error": "INTERRUPTED",
+                      "expire_at": datetime.utcnow() + self.retention}},
+        )
+        # A queued upload held in memory by an instance that is gone can't be run anywhere
+        self.collection.update_many(
+            {"status": QUEUED, "volatile_source": True, "submitted_by": {"$ne": instance_id},
+             "updated_at": {"$lt": stale_before}},
+            {"$set": {"status": FAILED, "error": "INTERRUPTED",
+                      "expire_at": datetime.utcnow() + self.retention}},
+        )
+        # Peers' in-memory uploads are theirs to run
+        query = {"status": QUEUED, "$or": [{"volatile_source": {"$exists": False}}, {"submitted_by": instance_id}]}
+        return [d["_id"] for d in self.collection.find(query, {"_id": 1}).sort("created_at", 1)]
+
+
+class JobManager:
+    """
+    Runs analysis jobs on a bounded pool of asyncio workers.
+    Submissions beyond the queue limit are rejected with 503 + Retry-After.
+    Running jobs heartbeat every ANALYSIS_JOB_HEARTBEAT_SECONDS; a sweep every
+    ANALYSIS_JOB_SWEEP_SECONDS requeues jobs whose instance stopped heartbeating
+    for ANALYSIS_JOB_STALE_SECONDS, so work survives restarts and crashed peers.
+    """
+
+    def __init__(self, store, pipeline, audit_service=None, stager=None):
+        self.store = store
+        # stager(result, job) turns the full pipeline output into what /result serves
+        self.stager = stager
+        self.pipeline = pipeline
+        self.audit_service = audit_service
+        self.workers = int(os.getenv("ANALYSIS_JOB_WORKERS", "2"))
+        self.max_queue = int(os.getenv("ANALYSIS_JOB_MAX_QUEUE", "32"))
+        self.stale_after = float(os.getenv("ANALYSIS_JOB_STALE_SECONDS", "900"))
+        self.heartbeat_interval = float(os.getenv("ANALYSIS_JOB_HEARTBEAT_SECONDS", "60"))
+        self.sweep_interval = float(os.getenv("ANALYSIS_JOB_SWEEP_SECONDS", "120"))
+        self.instance_id = str(uuid.uuid4())
+
+        self._queue = None
+        self._queued = set()  # job ids waiting in this instance's queue
+        self._worker_tasks = []
+        self._running = {}  # job_id -> asyncio.Task
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        # Created here rather than at import, so an unreachable system DB doesn't keep the API from starting
+        try:
+            await asyncio.to_thread(self.store.ensure_indexes)
+        except Exception as e:
+            print(f"WARNING: Could not create analysis job indexes: {e}")
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        try:
+            await self.recover()
+        except Exception as e:
+            # The periodic sweep retries
+            print(f"WARNING: Analysis job recovery failed at startup: {e}")
+        self._worker_tasks.append(asyncio.create_task(self._maintenance()))
+
+    async def stop(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    async def recover(self):
+        """Requeues stale running jobs and picks up queued ones no worker holds. Returns how many were enqueued."""
+        stale_before = datetime.utcnow() - timedelta(seconds=self.stale_after)
+        job_ids = await asyncio.to_thread(self.store.recoverable_job_ids, stale_before, self.instance_id)
+        enqueued = 0
+        for job_id in job_ids:
+            if self._queue.full():
+                break
+            if job_id in self._queued or job_id in self._running:
+                continue
+            self._enqueue(job_id)
+            enqueued += 1
+        return enqueued
+
+    async def _maintenance(self):
+        last_sweep = time.monotonic()
+        while True:
+            await asyncio.sleep(min(self.heartbeat_interval, self.sweep_interval))
+            try:
+                await asyncio.to_thread(self.store.heartbeat, list(self._running), self.instance_id)
+                if time.monotonic() - last_sweep >= self.sweep_interval:
+                    last_sweep = time.monotonic()
+                    await self.recover()
+            except Exception as e:
+                print(f"WARNING: Analysis job maintenance failed: {e}")
+
+    def _enqueue(self, job_id: str):
+        self._queue.put_nowait(job_id)
+        self._queued.add(job_id)
+
+    async def submit(self, data: bytes, filename: str, user: dict, user_id: str = None):
+        if self._queue.full():
+            raise HTTPException(status_code=503, detail="ANALYSIS_QUEUE_FULL", headers={"Retry-After": "30"})
+
+        now = datetime.utcnow()
+        job = {
+            "_id": str(uuid.uuid4()),
+            "workspace_id": user["workspace_id"],
+            "username": user["username"],
+            "user_id": user_id,
+            "role": user.get("role"),
+            "filename": filename,
+            "status": QUEUED,
+            "stage": None,
+            "stages": {},
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+            "submitted_by": self.instance_id,
+        }
+        await asyncio.to_thread(self.store.create, job, data)
+        # Concurrent submissions may have filled the queue meanwhile; the job is stored, so a sweep picks it up
+        if not self._queue.full():
+            self._enqueue(job["_id"])
+        return job["_id"]
+
+    def get_job(self, job_id: str, workspace_id: str, include_result: bool = False):
+        job = self.store.get(job_id, include_result=include_result)
+        # Jobs are only visible inside their own workspace
+        if not job or job.get("workspace_id") != workspace_id:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return job
+
+    def status(self, job_id: str, workspace_id: str):
+        job = self.get_job(job_id, workspace_id)
+        return {
+            "job_id": job["_id"],
+            "filename": job["filename"],
+            "status": job["status"],
+            "stage": job.get("stage"),
+            "stages": job.get("stages", {}),
+            "error": job.get("error"),
+            "created_at": job["created_at"],
+            "started_at": job.get("started_at"),
+            "finished_at": job.get("finished_at"),
+        }
+
+    def result(self, job_id: str, workspace_id: str):
+        job = self.get_job(job_id, workspace_id, include_result=True)
+        if job["status"] != SUCCEEDED:
+            raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+        return job["result"]
+
+    def cancel(self, job_id: str, workspace_id: str):
+        job = self.get_job(job_id, workspace_id)
+        if job["status"] in FINISHED_STATES:
+            return job["status"]
+
+        if not self.store.update(job_id, {"status": CANCELLED, "finished_at": datetime.utcnow()},
+                                 expected_status=job["status"]):
+            # Finished or was claimed in the meantime; report what it is now
+            job = self.get_job(job_id, workspace_id)
+            if job["status"] in FINISHED_STATES:
+                return job["status"]
+            return self.cancel(job_id, workspace_id)
+        self.store.clear_source(job_id)
+        task = self._running.get(job_id)
+        if task is not None:
+            task.cancel()
+        return CANCELLED
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            self._queued.discard(job_id)
+            try:
+                job = await asyncio.to_thread(self.store.claim, job_id, self.instance_id)
+                if job is not None:
+                    task = asyncio.create_task(self._run(job))
+                    self._running[job_id] = task
+                    try:
+                        await task
+                    except asyncio.CancelledError:
+                        # Swallow cancel() of the job, but not stop() cancelling this worker,
+                        # which cancels the awaited job too; that job is left for recovery
+                        if not task.cancelled() or asyncio.current_task().cancelling():
+                            raise
+                    finally:
+                        self._running.pop(job_id, None)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: dict):
+        job_id = job["_id"]
+        stages = {}
+        progress = None  # last stage write; each one waits for the previous so they land in order
+
+        def on_stage(stage, event):
+            nonlocal progress
+            now = time.time()
+            info = stages.setdefault(stage, {"started_at": now, "finished_at": None, "seconds": None, "_open": 0})
+            if event == "started":
+                info["_open"] += 1
+                fields = {"stage": stage}
+            else:
+                info["_open"] -= 1
+                if info["_open"] == 0:
+                    info["finished_at"] = now
+                    info["seconds"] = round(now - info["started_at"], 3)
+                fields = {}
+            fields[f"stages.{stage}"] = {k: v for k, v in info.items() if k != "_open"}
+            progress = asyncio.ensure_future(self._write_progress(progress, job_id, fields))
+
+        try:
+            source = await asyncio.to_thread(self.store.get_source, job_id)
+            if source is None:
+                raise RuntimeError("INTERRUPTED: upload is no longer available")
+
+            result = await self.pipeline.run((job["filename"], bytes(source)), job["filename"], job["workspace_id"], on_stage=on_stage)
+            if self.stager:
+                result = self.stager(result, job)
+
+            if progress is not None:
+                await progress
+            # Only if still ours: a cancel (here or on another instance) or a requeue wins
+            if not await asyncio.to_thread(self.store.update, job_id, {
+                "status": SUCCEEDED, "stage": None, "result": result, "finished_at": datetime.utcnow()
+            }, expected_status=RUNNING):
+                return
+            await asyncio.to_thread(self.store.clear_source, job_id)
+
+            if self.audit_service:
+                self.audit_service.log_event(
+                    user_id=job.get("user_id"),
+                    username=job["username"],
+                    role=job.get("role"),
+                    workspace_id=job["workspace_id"],
+                    action="AI_ANALYSIS",
+                    details={"filename": job["filename"], "job_id": job_id}
+                )
+        except asyncio.CancelledError:
+            # cancel() already recorded the state
+            raise
+        except HTTPException as he:
+            await self._fail(job_id, he.detail)
+        except Exception as e:
+            await self._fail(job_id, str(e))
+
+    async def _write_progress(self, previous, job_id: str, fields: dict):
+        if previous is not None:
+            await previous
+        try:
+            await asyncio.to_thread(self.store.update, job_id, fields, expected_status=RUNNING)
+        except Exception as e:
+            print(f"WARNING: Could not record progress for analysis job {job_id}: {e}")
+
+    async def _fail(self, job_id: str, error: str):
+        print(f"ERROR: Analysis job {job_id} failed: {error}")
+        if await asyncio.to_thread(self.store.update, job_id, {"status": FAILED, "error": error,
+                                                                "finished_at": datetime.utcnow()},
+                                   expected_status=RUNNING):
+            await asyncio.to_thread(self.store.clear_source, job_id)
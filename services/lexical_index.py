@@ -0,0 +1,176 @@
+import hashlib
+import math
+import os
+import re
+import threading
+from collections import Counter
+from core.cache import LRUCache
+from core.database import workspace_config
+from services.vector_backends import match_filter
+
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+# Keeps identifiers such as "GDPR-17", "2024/05" or "12.5" whole
+_TOKEN_RE = re.compile(r"\w+(?:[.\-/:]\w+)*")
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercased tokens; compound identifiers also contribute their parts."""
+    tokens = []
+    for token in _TOKEN_RE.findall((text or "").lower()):
+        tokens.append(token)
+        parts = re.split(r"[.\-/:]", token)
+        if len(parts) > 1:
+            tokens.extend(p for p in parts if p)
+    return tokens
+
+
+class BM25Index:
+    """
+    In-memory BM25 inverted index over one workspace's current chunks
+    (chunk_text plus entities.name). It is built from the chunks collection on
+    first search and kept up to date by StorageService afterwards; chunks that
+    stop being current are dropped from the postings. The corpus generation it
+    reflects is tracked so writes made by other workers trigger a rebuild.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = {}   # term -> {chunk_id: term frequency}
+        self._lengths = {}    # chunk_id -> token count
+        self._docs = {}       # chunk_id -> chunk metadata (no embedding)
+        self._total_length = 0
+        self.built = False
+        self.generation = None
+
+    def __len__(self):
+        return len(self._docs)
+
+    def build(self, collection, generation: int = None, batch_size: int = 1000):
+        """Loads the index, or reloads it if it's behind the given corpus generation."""
+        with self._lock:
+            if self.built and (generation is None or generation == self.generation):
+                return
+            self._postings, self._lengths, self._docs, self._total_length = {}, {}, {}, 0
+            cursor = collection.find({"is_current": True}, {"embedding": 0}, batch_size=batch_size)
+            self._add(cursor)
+            self.built = True
+            self.generation = generation
+            print(f"DEBUG: Built lexical index over {len(self._docs)} chunks (generation {generation}).")
+
+    def _add(self, chunks):
+        for chunk in chunks:
+            chunk_id = str(chunk["_id"])
+            if chunk_id in self._docs or not chunk.get("is_current", True):
+                continue
+            counts = self._term_counts(chunk)
+            for term, tf in counts.items():
+                self._postings.setdefault(term, {})[chunk_id] = tf
+            length = sum(counts.values())
+            self._lengths[chunk_id] = length
+            self._total_length += length
+            self._docs[chunk_id] = {k: v for k, v in chunk.items() if k != "embedding"}
+
+    @staticmethod
+    def _term_counts(chunk: dict) -> Counter:
+        names = " ".join(e.get("name", "") for e in chunk.get("entities", []))
+        return Counter(tokenize(chunk.get("chunk_text", "")) + tokenize(names))
+
+    def _remove(self, chunk_id: str):
+        doc = self._docs.pop(chunk_id, None)
+        if doc is None:
+            return
+        self._total_length -= self._lengths.pop(chunk_id, 0)
+        for term in self._term_counts(doc):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(chunk_id, None)
+                if not postings:
+                    del self._postings[term]
+
+    # StorageService hooks (same shape as VectorBackend's)
+
+    def on_chunks_inserted(self, chunks: list[dict]):
+        with self._lock:
+            if self.built:
+                self._add(chunks)
+
+    def on_chunks_updated(self, match: dict, values: dict):
+        with self._lock:
+            if not self.built:
+                return
+            matched = [cid for cid, doc in self._docs.items() if match_filter(doc, match)]
+            for chunk_id in matched:
+                if values.get("is_current") is False:
+                    self._remove(chunk_id)
+                else:
+                    self._docs[chunk_id].update(values)
+
+    def advance_generation(self, generation: int):
+        """Called after this process applied a write; a gap means another worker wrote too."""
+        with self._lock:
+            if self.built and self.generation is not None and self.generation == generation - 1:
+                self.generation = generation
+
+    def search(self, query: str, k: int = 8, pre_filter: dict = None):
+        """Returns [(chunk metadata, score)] best first."""
+        with self._lock:
+            n = len(self._docs)
+            if not n:
+                return []
+            avgdl = self._total_length / n
+            scores = {}
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, tf in postings.items():
+                    norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[chunk_id] / avgdl)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+
+            results = []
+            for chunk_id, score in sorted(scores.items(), key=lambda item: item[1], reverse=True):
+                doc = self._docs[chunk_id]
+                if pre_filter and not match_filter(doc, pre_filter):
+                    continue
+                results.append((doc, score))
+                if len(results) >= k:
+                    break
+            return results
+
+
+_lexical_indexes = LRUCache(max_size=int(os.getenv("LEXICAL_INDEX_CACHE_SIZE", "32")))
+_lexical_indexes_lock = threading.Lock()
+
+
+def get_lexical_index(workspace_id: str) -> BM25Index:
+    """
+    The workspace's index for its current storage cluster (possibly not built
+    yet; /search builds it off the event loop before searching). Keyed by URI
+    too, so postings from a cluster the workspace no longer uses are never served.
+    """
+    config = workspace_config.get(workspace_id)
+    key = (workspace_id, hashlib.sha256((config.mongodb_uri if config else "").encode()).hexdigest()[:12])
+    with _lexical_indexes_lock:
+        index = _lexical_indexes.get(key)
+        if index is None:
+            _lexical_indexes.pop_where(lambda k: k[0] == workspace_id)
+            index = _lexical_indexes.set(key, BM25Index())
+    return index
+
+
+def reciprocal_rank_fusion(ranked_lists, k: int, rrf_k: int = 60):
+    """
+    Merges ranked lists of (key, item) by summing 1 / (rrf_k + rank).
+    Returns the top k items; the first list wins ties on which item object is kept.
+    """
+    scores = {}
+    items = {}
+    for ranked in ranked_lists:
+        for rank, (key, item) in enumerate(ranked, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            items.setdefault(key, item)
+    best = sorted(scores, key=lambda key: scores[key], reverse=True)[:k]
+    return [items[key] for key in best]
@@ -0,0 +1,174 @@
+import hashlib
+import os
+import re
+import threading
+from core.cache import LRUCache
+from core.database import workspace_config
+from services.answer_cache import normalize_query
+
+CURRENT_ONLY = {"is_current": {"$eq": True}}
+
+# Phrases that map straight onto the insight_types attribute
+INSIGHT_KEYWORDS = {
+    "Risk": ("risk", "risks", "risky", "threat", "threats", "liability", "liabilities"),
+    "Deadline": ("deadline", "deadlines", "due date", "due dates", "due by", "timeline", "timelines"),
+    "Decision": ("decision", "decisions", "decided", "resolved"),
+    "Recommendation": ("recommendation", "recommendations", "recommend", "recommended", "suggestion", "suggestions"),
+}
+
+# Words that suggest a metadata constraint the parser may not have recognised;
+# a query with one of these and no parsed filter goes to the LLM translator
+FILTER_CUES = ("section", "chapter", "heading", "file", "document", "entity", "entities", "stakeholder",
+               "relationship", "relation", "obligation", "version", "type of", "category", "mentioned")
+
+_MIN_TERM_LENGTH = 3
+
+# A known header only becomes a filter when the question names it as a section,
+# an entity only when it is quoted exactly; a bare mention is left to the LLM
+_SECTION_WORDS = r"(?:section|chapter|heading)"
+_OPEN_QUOTE = "[\"\u201c']"
+_CLOSE_QUOTE = "[\"\u201d']"
+
+
+class QueryTranslation:
+    def __init__(self, query: str, search_kwargs: dict, source: str):
+        self.query = query
+        self.search_kwargs = search_kwargs
+        # "parser", "cache" or "llm"
+        self.source = source
+
+
+def _contains_phrase(text: str, phrase: str) -> bool:
+    return re.search(rf"(?<!\w){re.escape(phrase)}(?!\w)", text) is not None
+
+
+def _names_section(text: str, header: str) -> bool:
+    h = re.escape(header)
+    return (re.search(rf"{_SECTION_WORDS}\s+(?:(?:called|titled|named)\s+)?{_OPEN_QUOTE}?{h}(?!\w)", text) is not None
+            or re.search(rf"(?<!\w){h}{_CLOSE_QUOTE}?\s+{_SECTION_WORDS}", text) is not None)
+
+
+def _quotes(text: str, name: str) -> bool:
+    return re.search(rf"{_OPEN_QUOTE}{re.escape(name)}{_CLOSE_QUOTE}", text) is not None
+
+
+def _with_current(conditions: list[dict]) -> dict:
+    return {"$and": [CURRENT_ONLY] + conditions} if conditions else dict(CURRENT_ONLY)
+
+
+class QueryTranslator:
+    """
+    Turns a search question into (query, pre_filter) without the self-query
+    LLM call whenever it can:
+    1. a deterministic parser for insight-type keywords, sections asked for
+       by name ("in the Termination section") and quoted entity names;
+    2. a cache of earlier LLM translations keyed by normalized query;
+    3. the retriever's own query constructor, as before.
+    Every filter is ANDed with is_current so retired versions never match.
+    """
+
+    def __init__(self):
+        self._vocabulary = LRUCache(max_size=int(os.getenv("QUERY_VOCABULARY_CACHE_SIZE", "64")))
+        self._translations = LRUCache(
+            max_size=int(os.getenv("QUERY_TRANSLATION_CACHE_SIZE", "2048")),
+            ttl=float(os.getenv("QUERY_TRANSLATION_TTL_SECONDS", "86400")),
+        )
+        self._lock = threading.Lock()
+        self.counts = {"parser": 0, "cache": 0, "llm": 0}
+
+    def vocabulary(self, workspace_id: str, collection, generation: int):
+        """
+        Section headers and entity names of the current corpus, refreshed when
+        the generation moves. Keyed by storage URI too: a cluster the workspace
+        was moved to can share the old one's generation number.
+        """
+        config = workspace_config.get(workspace_id)
+        key = (workspace_id, hashlib.sha256((config.mongodb_uri if config else "").encode()).hexdigest()[:12])
+        cached = self._vocabulary.get(key)
+        if cached is not None and cached[0] == generation:
+            return cached[1]
+
+        def terms(field):
+            values = collection.distinct(field, {"is_current": True})
+            return {v.lower(): v for v in values if isinstance(v, str) and len(v) >= _MIN_TERM_LENGTH}
+
+        headers = terms("section_header")
+        headers.pop("general", None)
+        vocab = {"section_header": headers, "entities.name": terms("entities.name")}
+        self._vocabulary.pop_where(lambda k: k[0] == workspace_id and k != key)
+        self._vocabulary.set(key, (generation, vocab))
+        return vocab
+
+    def parse(self, query: str, vocab: dict):
+        """
+        Returns a QueryTranslation, or None when the LLM should decide.
+        A header or entity that is mentioned but not explicitly asked for
+        ("How is data retained?" with an entity "Data") could be a filter or
+        just a word, so those questions go to the translator instead.
+        """
+        text = normalize_query(query)
+        conditions = []
+
+        types = [t for t, phrases in INSIGHT_KEYWORDS.items() if any(_contains_phrase(text, p) for p in phrases)]
+        if types:
+            conditions.append({"insight_types": {"$in": types}} if len(types) > 1 else {"insight_types": {"$eq": types[0]}})
+
+        explicit = []
+        for field, asked_for in (("section_header", _names_section), ("entities.name", _quotes)):
+            # Longest first so "Data Protection Officer" wins over "Data"
+            matches = []
+            for lowered in sorted(vocab[field], key=len, reverse=True):
+                if asked_for(text, lowered) and not any(lowered in m for m in matches):
+                    matches.append(lowered)
+            if matches:
+                values = [vocab[field][m] for m in matches]
+                conditions.append({field: {"$in": values}} if len(values) > 1 else {field: {"$eq": values[0]}})
+            explicit.extend(matches)
+
+        mentioned = any(
+            _contains_phrase(text, lowered) and not any(lowered in m for m in explicit)
+            for field in ("section_header", "entities.name") for lowered in vocab[field]
+        )
+        if mentioned or (not conditions and any(_contains_phrase(text, cue) for cue in FILTER_CUES)):
+            return None
+        return QueryTranslation(query, {"pre_filter": _with_current(conditions)}, "parser")
+
+    def translate(self, query: str, workspace_id: str, retriever, collection, generation: int) -> QueryTranslation:
+        translation = self.parse(query, self.vocabulary(workspace_id, collection, generation))
+        if translation is None:
+            cache_key = (workspace_id, normalize_query(query))
+            cached = self._translations.get(cache_key)
+            if cached is not None:
+                translation = QueryTranslation(cached[0], dict(cached[1]), "cache")
+            else:
+                translation = self._translate_with_llm(query, retriever)
+                self._translations.set(cache_key, (translation.query, translation.search_kwargs))
+
+        with self._lock:
+            self.counts[translation.source] += 1
+        return translation
+
+    def _translate_with_llm(self, query: str, retriever) -> QueryTranslation:
+        # The same two steps SelfQueryRetriever runs internally
+        structured_query = retriever.query_constructor.invoke({"query": query})
+        new_query, kwargs = retriever.structured_query_translator.visit_structured_query(structured_query)
+        if structured_query.limit is not None:
+            kwargs["k"] = structured_query.limit
+
+        llm_filter = kwargs.pop("pre_filter", None)
+        kwargs["pre_filter"] = _with_current([llm_filter] if llm_filter else [])
+        return QueryTranslation(new_query or query, kwargs, "llm")
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+        total = sum(counts.values())
+        return {
+            **counts,
+            "llm_ratio": round(counts["llm"] / total, 4) if total else 0.0,
+            "translations": self._translations.stats(),
+            "vocabularies": self._vocabulary.stats(),
+        }
+
+
+query_translator = QueryTranslator()
@@ -1,141 +1,235 @@
-from langchain_mongodb import MongoDBAtlasVectorSearch
 from langchain_google_genai import GoogleGenerativeAIEmbeddings, GoogleGenerativeAI
 from langchain_google_genai.chat_models import ChatGoogleGenerativeAIError
 from langchain_classic.chains.query_constructor.base import AttributeInfo
 from langchain_classic.retrievers.self_query.base import SelfQueryRetriever
+from langchain_community.query_constructors.mongodb_atlas import MongoDBAtlasTranslator
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from core.database import system_mongodb
+from core.database import workspace_config
+from core.cache import LRUCache
+from services.intelligence import EMBEDDING_MODEL
+from services.vector_backends import AtlasVectorBackend
+from services.lexical_index import reciprocal_rank_fusion
+from services.corpus_state import get_corpus_generation
+from services.query_translation import query_translator
+from langchain_core.documents import Document
 from fastapi import HTTPException
 import os
 
-def get_workspace_key(workspace_id: str):
-    """Checks the DB for a key and puts it in the system memory."""
-    workspace = system_mongodb.workspaces.find_one({"workspace_id": workspace_id})
-    if workspace and "google_api_key" in workspace:
-        print(f"DEBUG: Found key in DB for {workspace_id}. Loading to environment...")
-        return workspace["google_api_key"]
-    print(f"DEBUG: No key found in DB for {workspace_id}.")
-    return None
+DOCUMENT_CONTENT_DESCRIPTION = "A collection of long-form technical and legal document chunks with extracted insights, entities, and relationships."
+
+METADATA_FIELD_INFO = [
+    AttributeInfo(
+        name="section_header",
+        description="The specific header or title of the section (e.g., Introduction, Methodology)",
+        type="string",
+    ),
+    AttributeInfo(
+        name="insight_types",
+        description="The category of insight: Risk, Deadline, Decision, or Recommendation",
+        type="string",
+    ),
+    AttributeInfo(
+        name="parent_doc_id",
+        description="The unique ID of the document to filter by a specific file",
+        type="string",
+    ),
+    AttributeInfo(
+        name="entities.name",
+        description="Names of specific entities mentioned (e.g., 'NLP', 'Researchers')",
+        type="string",
+    ),
+    AttributeInfo(
+        name="entities.type",
+        description="The category of the entity (e.g., 'Stakeholder', 'Legal Reference')",
+        type="string",
+    ),
+    AttributeInfo(
+        name="relationships.relation",
+        description="The type of connection detected (e.g., 'aims to address', 'supports')",
+        type="string",
+    ),
+    # Add this to your metadata_field_info list
+    AttributeInfo(
+        name="is_current",
+        description="Whether the document is the latest version. Always True for current docs.",
+        type="boolean",
+    ),
+]
+
+RAG_TEMPLATE = """
+        You are the Document Intelligence Engine.
+        You are provided with specific document chunks and their associated metadata (Risks, Decisions, Entities, and Obligations etc.).
+
+        TASK: {task_instruction}
+
+        CONTEXT FROM DOCUMENT:
+        {context}
+
+        STRICT GUIDELINES:
+        1. Use ONLY the provided context.
+        2. Pay special attention to 'KEY ENTITIES' and 'DETECTED OBLIGATIONS' metadata to identify stakeholders and responsibilities accurately.
+        3. If you are summarizing, use professional bullet points.
+        4. If you are answering a search, provide a concise 2-3 sentence explanation followed by the evidence.
+        4. For EVERY claim or summary point, you MUST mention the Source Filename and Section Header in brackets.
+        5. Format example: "The security protocol requires MFA (File: security_policy.pdf, Section: Authentication).
 
+        FINAL OUTPUT:
+        """
+
+RAG_PROMPT = ChatPromptTemplate.from_template(RAG_TEMPLATE)
+
+DASHBOARD_INSTRUCTION = """
+                Synthesize a high-level executive dashboard from these chunks.
+                You must highlight:
+                1. KEY DECISIONS & RISKS: From the actionable insights.
+                2. STAKEHOLDERS & OBLIGATIONS: From the entities and detected relationships.
+                3. PRIMARY THEMES: Based on the content and headers.
+
+                Format the output for a quick professional briefing.
+                """
+
+# How many of a document's chunks feed its dashboard snapshot
+DASHBOARD_CONTEXT_CHUNKS = int(os.getenv("DASHBOARD_CONTEXT_CHUNKS", "12"))
+
+# (tenant DB, parent_doc_id) -> filename; a stored document's filename never changes
+parent_filename_cache = LRUCache(max_size=int(os.getenv("PARENT_FILENAME_CACHE_SIZE", "10000")))
+
+# Each retriever contributes RAG_CANDIDATE_K chunks; fusion keeps the best RAG_FINAL_K for the prompt
+RAG_CANDIDATE_K = int(os.getenv("RAG_CANDIDATE_K", "8"))
+RAG_FINAL_K = int(os.getenv("RAG_FINAL_K", "3"))
+
+
+class _RAGComponents:
+    """The LangChain objects for one (workspace, API key, index) combination."""
+
+    def __init__(self, source, embedding_model, llm, vector_store, retriever):
+        self.source = source
+        self.embedding_model = embedding_model
+        self.llm = llm
+        self.vector_store = vector_store
+        self.retriever = retriever
+
+
+# Shared by every RAGEngine so a warm query only pays for retrieval and generation
+rag_component_cache = LRUCache(
+    max_size=int(os.getenv("RAG_COMPONENT_CACHE_SIZE", "64")),
+    ttl=float(os.getenv("RAG_COMPONENT_IDLE_TTL_SECONDS", "3600")),
+    sliding=True,
+)
 
 
 class RAGEngine:
-    def __init__(self, db_collection, parent_collection, index_name):
+    def __init__(self, db_collection, parent_collection, index_name, vector_backend=None, lexical_index=None):
         self.parent_collection = parent_collection
         self.db_collection = db_collection
         self.index_name = index_name
+        self.vector_backend = vector_backend or AtlasVectorBackend(db_collection, index_name)
+        self.lexical_index = lexical_index
 
-        self.document_content_description = "A collection of long-form technical and legal document chunks with extracted insights, entities, and relationships."
-
-        self.metadata_field_info = [
-            AttributeInfo(
-                name="section_header",
-                description="The specific header or title of the section (e.g., Introduction, Methodology)",
-                type="string",
-            ),
-            AttributeInfo(
-                name="insight_types",
-                description="The category of insight: Risk, Deadline, Decision, or Recommendation",
-                type="string",
-            ),
-            AttributeInfo(
-                name="parent_doc_id",
-                description="The unique ID of the document to filter by a specific file",
-                type="string",
-            ),
-            AttributeInfo(
-                name="entities.name",
-                description="Names of specific entities mentioned (e.g., 'NLP', 'Researchers')",
-                type="string",
-            ),
-            AttributeInfo(
-                name="entities.type",
-                description="The category of the entity (e.g., 'Stakeholder', 'Legal Reference')",
-                type="string",
-            ),
-            AttributeInfo(
-                name="relationships.relation",
-                description="The type of connection detected (e.g., 'aims to address', 'supports')",
-                type="string",
-            ),
-            # Add this to your metadata_field_info list
-            AttributeInfo(
-                name="is_current",
-                description="Whether the document is the latest version. Always True for current docs.",
-                type="boolean",
-            ),
-        ]
+        self.document_content_description = DOCUMENT_CONTENT_DESCRIPTION
+        self.metadata_field_info = METADATA_FIELD_INFO
+        self.template = RAG_TEMPLATE
+        self.prompt = RAG_PROMPT
 
     def _get_active_components(self, workspace_id: str):
 
         # 2. load it from the Database
-        api_key = get_workspace_key(workspace_id)
+        api_key = workspace_config.get_api_key(workspace_id)
 
         if not api_key:
             raise HTTPException(status_code=428, detail="AI_CONFIG_MISSING")
 
-        embedding_model = GoogleGenerativeAIEmbeddings(model="models/text-embedding-004", google_api_key=api_key)
+        cache_key = (workspace_id, api_key, self.vector_backend.name, self.index_name)
+        components = rag_component_cache.get(cache_key)
+        # The pooled tenant client can be rebuilt (e.g. new URI), so the vector
+        # store must still point at the collection (or local index) this engine was given
+        if components is None or components.source != self.vector_backend.source:
+            components = rag_component_cache.set(cache_key, self._build_components(api_key))
+
+        return components.llm, components.retriever
+
+    def _build_components(self, api_key: str):
+        embedding_model = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL, google_api_key=api_key)
         llm = GoogleGenerativeAI(model="models/gemma-3-27b-it", google_api_key=api_key)
 
 
-        vector_store = MongoDBAtlasVectorSearch(
-            collection=self.db_collection,
-            embedding=embedding_model, # Your text-embedding-004 wrapper
-            index_name=self.index_name,
-            text_key="chunk_text",
-            relevance_score_fn="cosine",
-        )
-        
+        vector_store = self.vector_backend.as_vectorstore(embedding_model)
 
         retriever = SelfQueryRetriever.from_llm(
             llm=llm,
             vectorstore=vector_store,
             document_contents=self.document_content_description,
             metadata_field_info=self.metadata_field_info,
+            # Both backends take Atlas-style pre_filter dicts
+            structured_query_translator=MongoDBAtlasTranslator(),
+            search_kwargs={"k": RAG_CANDIDATE_K},
             verbose=True # Helpful to see the "Query Translation" in the notebook
         )
 
-        
-        self.template = """
-        You are the Document Intelligence Engine.
-        You are provided with specific document chunks and their associated metadata (Risks, Decisions, Entities, and Obligations etc.).
+        return _RAGComponents(self.vector_backend.source, embedding_model, llm, vector_store, retriever)
 
-        TASK: {task_instruction}
-
-        CONTEXT FROM DOCUMENT:
-        {context}
 
-        STRICT GUIDELINES:
-        1. Use ONLY the provided context.
-        2. Pay special attention to 'KEY ENTITIES' and 'DETECTED OBLIGATIONS' metadata to identify stakeholders and responsibilities accurately.
-        3. If you are summarizing, use professional bullet points.
-        4. If you are answering a search, provide a concise 2-3 sentence explanation followed by the evidence.
-        4. For EVERY claim or summary point, you MUST mention the Source Filename and Section Header in brackets.
-        5. Format example: "The security protocol requires MFA (File: security_policy.pdf, Section: Authentication).
 
-        FINAL OUTPUT:
+    def _retrieve(self, retriever, user_query: str, workspace_id: str, generation: int = None):
         """
+        Vector retrieval, with metadata filters from the fast-path translator,
+        fused with BM25 over chunk text and entity names so exact identifiers
+        the embedding misses still make the cut.
+        """
+        if generation is None:
+            generation = get_corpus_generation(self.db_collection.database)
+
+        translation = query_translator.translate(user_query, workspace_id, retriever, self.db_collection, generation)
+        search_kwargs = {"k": RAG_CANDIDATE_K, **translation.search_kwargs}
+        vector_docs = retriever.vectorstore.search(translation.query, retriever.search_type, **search_kwargs)
+        if self.lexical_index is None:
+            return vector_docs[:RAG_FINAL_K]
+
+        self.lexical_index.build(self.db_collection, generation)
+        lexical_hits = self.lexical_index.search(user_query, k=RAG_CANDIDATE_K, pre_filter=search_kwargs.get("pre_filter"))
+
+        def key(metadata, text):
+            return str(metadata.get("_id") or hash(text))
+
+        vector_ranked = [(key(d.metadata, d.page_content), d) for d in vector_docs]
+        lexical_ranked = [
+            (key(meta, meta.get("chunk_text", "")),
+             Document(page_content=meta.get("chunk_text", ""), metadata={k: v for k, v in meta.items() if k != "chunk_text"}))
+            for meta, _ in lexical_hits
+        ]
+        return reciprocal_rank_fusion([vector_ranked, lexical_ranked], k=RAG_FINAL_K)
 
-        self.prompt = ChatPromptTemplate.from_template(self.template)
-
-        return llm, retriever
-
+    def _resolve_filenames(self, docs):
+        """
+        Filenames for chunks stored before they were denormalized: served from
+        parent_filename_cache, with one batched $in query for the rest.
+        """
+        tenant = self.parent_collection.database.name
+        filenames = {}
+        missing = set()
+        for doc in docs:
+            parent_id = doc.metadata.get("parent_doc_id")
+            if doc.metadata.get("filename") or parent_id in filenames:
+                continue
+            cached = parent_filename_cache.get((tenant, parent_id))
+            if cached is not None:
+                filenames[parent_id] = cached
+            else:
+                missing.add(parent_id)
 
+        if missing:
+            for parent_doc in self.parent_collection.find({"_id": {"$in": list(missing)}}, {"filename": 1}):
+                filenames[parent_doc["_id"]] = parent_filename_cache.set((tenant, parent_doc["_id"]), parent_doc.get("filename", "Unknown Document"))
+        return filenames
 
     def format_docs_with_metadata(self, docs):
-        filename_cache={}
+        filenames = self._resolve_filenames(docs)
         formatted = []
         for doc in docs:
              
             # 1. Extract the rich metadata we stored in MongoDB
-            parent_id = doc.metadata.get("parent_doc_id")
-            if parent_id not in filename_cache:
-                # Query the 'documents' collection for the filename
-                parent_doc = self.parent_collection.find_one({"_id": parent_id}, {"filename": 1})
-                filename_cache[parent_id] = parent_doc.get("filename", "Unknown Document") if parent_doc else "Unknown Document"
-            
-            filename = filename_cache[parent_id]
+            filename = doc.metadata.get("filename") or filenames.get(doc.metadata.get("parent_doc_id"), "Unknown Document")
 
             header = doc.metadata.get("section_header", "General")
             insights = doc.metadata.get("insight_types", [])
@@ -166,33 +260,45 @@ class RAGEngine:
     
 
 
-    def generate_intelligence(self, user_query: str, workspace_id, mode="search"):
+    def generate_intelligence(self, user_query: str, workspace_id, mode="search", generation: int = None):
 
         llm, retriever = self._get_active_components(workspace_id)
 
-        search_kwargs = {
-        "pre_filter": { "is_current": { "$eq": True } }
-        }
+        # Switch instructions based on the mode
+        if mode == "dashboard":
+            instruction = DASHBOARD_INSTRUCTION
+        else:
+            instruction = f"Answer the following user search query: {user_query}"
+
+        return self._run_chain(llm, instruction, lambda: self._retrieve(retriever, user_query, workspace_id, generation))
 
+    def generate_document_dashboard(self, doc_id: str, workspace_id):
+        """
+        Executive dashboard for one stored document. The context comes straight
+        from that document's chunks (those carrying insights first) rather than
+        from a similarity search, so it can't drift onto other files.
+        """
+        llm, _ = self._get_active_components(workspace_id)
+
+        def load_chunks():
+            chunks = list(self.db_collection.find(
+                {"parent_doc_id": doc_id},
+                {"embedding": 0, "section_summary": 0},
+            ).sort("chunk_index", 1))
+            chunks.sort(key=lambda c: (not c.get("actionable_insights"), c.get("chunk_index", 0)))
+            return [
+                Document(page_content=c.get("chunk_text", ""), metadata={k: v for k, v in c.items() if k != "chunk_text"})
+                for c in chunks[:DASHBOARD_CONTEXT_CHUNKS]
+            ]
+
+        return self._run_chain(llm, DASHBOARD_INSTRUCTION, load_chunks)
+
+    def _run_chain(self, llm, instruction: str, load_docs):
         try:
-            retrieved_docs = retriever.invoke(user_query, search_kwargs=search_kwargs)
+            retrieved_docs = load_docs()
             # Format the context string (using the logic we discussed earlier)
             context_text = self.format_docs_with_metadata(retrieved_docs)
 
-            # Switch instructions based on the mode
-            if mode == "dashboard":
-                instruction = """
-                Synthesize a high-level executive dashboard from these chunks.
-                You must highlight:
-                1. KEY DECISIONS & RISKS: From the actionable insights.
-                2. STAKEHOLDERS & OBLIGATIONS: From the entities and detected relationships.
-                3. PRIMARY THEMES: Based on the content and headers.
-
-                Format the output for a quick professional briefing.
-                """
-            else:
-                instruction = f"Answer the following user search query: {user_query}"
-
             # Run the chain
             chain = self.prompt | llm | StrOutputParser()
             return chain.invoke({"task_instruction": instruction, "context": context_text})
@@ -203,10 +309,3 @@ class RAGEngine:
                 raise HTTPException(status_code=401, detail="INVALID_API_KEY")
             # For other AI errors (quota, etc.)
             raise HTTPException(status_code=502, detail=f"AI Engine Error: {str(e)}")
-        
-
-
-
-
-
-
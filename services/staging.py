@@ -0,0 +1,85 @@
+import os
+import uuid
+from datetime import datetime, timedelta
+import bson
+from core.cache import LRUCache
+
+STAGING_TTL_SECONDS = int(os.getenv("ANALYSIS_STAGING_TTL_SECONDS", str(6 * 3600)))
+
+
+class AnalysisStaging:
+    """
+    Holds /analyze output server-side until the user stores it, so chunks and
+    embeddings never make the round trip through the browser.
+    Entries live in the tenant's analysis_staging collection (expired by a TTL
+    index). Payloads too large for one BSON document, or workspaces without
+    storage configured, fall back to a per-process TTL cache.
+    """
+
+    _MAX_DOCUMENT_BYTES = 15 * 1024 * 1024
+
+    def __init__(self):
+        self._memory = LRUCache(max_size=int(os.getenv("ANALYSIS_STAGING_MEMORY_SIZE", "64")), ttl=STAGING_TTL_SECONDS)
+        self._indexed = set()
+
+    def stage(self, tenant_db, workspace_id: str, username: str, result: dict) -> str:
+        analysis_id = str(uuid.uuid4())
+        entry = {
+            "_id": analysis_id,
+            "workspace_id": workspace_id,
+            "username": username,
+            "filename": result["filename"],
+            "intelligence": result["intelligence"],
+            "insights": result["insights"],
+            "summaries": result["summaries"],
+            "raw_chunks": result["raw_chunks"],
+            "chunks": result.get("chunks"),
+            "embeddings": result["embeddings"],
+            "created_at": datetime.utcnow(),
+            "expire_at": datetime.utcnow() + timedelta(seconds=STAGING_TTL_SECONDS),
+        }
+
+        if tenant_db is not None and len(bson.encode(entry)) <= self._MAX_DOCUMENT_BYTES:
+            self._ensure_ttl_index(tenant_db)
+            tenant_db.analysis_staging.insert_one(entry)
+        else:
+            self._memory.set(analysis_id, entry)
+        return analysis_id
+
+    def get(self, tenant_db, workspace_id: str, analysis_id: str):
+        entry = self._memory.get(analysis_id)
+        if entry is None and tenant_db is not None:
+            entry = tenant_db.analysis_staging.find_one({"_id": analysis_id})
+            # TTL monitor runs about once a minute; don't serve an entry it hasn't reaped yet
+            if entry and entry["expire_at"] < datetime.utcnow():
+                entry = None
+        if not entry or entry["workspace_id"] != workspace_id:
+            return None
+        return entry
+
+    def discard(self, tenant_db, analysis_id: str):
+        self._memory.pop(analysis_id)
+        if tenant_db is not None:
+            tenant_db.analysis_staging.delete_one({"_id": analysis_id})
+
+    def _ensure_ttl_index(self, tenant_db):
+        if tenant_db.name in self._indexed:
+            return
+        tenant_db.analysis_staging.create_index("expire_at", expireAfterSeconds=0)
+        self._indexed.add(tenant_db.name)
+
+
+def public_result(result: dict, analysis_id: str, include_embeddings: bool = False) -> dict:
+    """The /analyze response: everything the UI shows, embeddings only on request."""
+    response = {
+        "analysis_id": analysis_id,
+        "filename": result["filename"],
+        "intelligence": result["intelligence"],
+        "insights": result["insights"],
+        "summaries": result["summaries"],
+        "raw_chunks": result["raw_chunks"],
+        "chunk_count": len(result["raw_chunks"]),
+    }
+    if include_embeddings:
+        response["embeddings"] = result["embeddings"]
+    return response
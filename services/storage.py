@@ -1,24 +1,47 @@
+import base64
+import json
+import re
 import uuid
 from datetime import datetime
+from core.vectors import encode_vector
+from services.corpus_state import bump_corpus_generation
+from services.ingestion import normalize_header
+
+# Report fields that are lists and can be paged with offset/limit
+REPORT_LIST_SECTIONS = ("entities", "relationships", "actionable_insights", "section_summaries")
+REPORT_SECTIONS = ("document_intent", "major_themes", "executive_summary", "technical_summary") + REPORT_LIST_SECTIONS
+
+# Chunk fields the report is built from; never the embedding or raw text
+_REPORT_CHUNK_PROJECTION = {"_id": 0, "chunk_index": 1, "actionable_insights": 1, "entities": 1,
+                            "relationships": 1, "section_header": 1, "section_summary": 1}
 
 class StorageService:
-    def __init__(self, mongodb):
+    def __init__(self, mongodb, vector_backend=None, lexical_index=None):
         self.db = mongodb
+        # Indexes that keep their own copy of the chunks (local vector index, BM25) are told about every write
+        self.index_hooks = [hook for hook in (vector_backend, lexical_index) if hook is not None]
+        # Corpus generation after this service's last write (None until it writes)
+        self.generation = None
     
-    def final_storage_logic(self, doc_summaries, insight_list, intelligence, raw_chunks, embeddings, filename, owner, parent_group_id=None):
+    def final_storage_logic(self, doc_summaries, insight_list, intelligence, raw_chunks, embeddings, filename, owner,
+                            parent_group_id=None, chunk_records=None):
         """
         Combines high-level summaries with granular raw chunks and actionable insights.
+        chunk_records carries each chunk's header path, pages and offsets from ingestion;
+        payloads staged before it existed fall back to matching headers in the text.
         """
         if parent_group_id:
             existing = self.db.documents.find_one({
                 "parent_group_id": parent_group_id, 
                 "is_current": True
-            })
+            }, {"version": 1})
             version = existing.get("version", 1) + 1
             
             # Retire ONLY this specific document identity
             self.db.documents.update_many({"parent_group_id": parent_group_id}, {"$set": {"is_current": False}})
             self.db.chunks.update_many({"parent_group_id": parent_group_id}, {"$set": {"is_current": False}})
+            for hook in self.index_hooks:
+                hook.on_chunks_updated({"parent_group_id": parent_group_id}, {"is_current": False})
         else:
             # Brand new identity (even if filename is the same as something else)
             parent_group_id = str(uuid.uuid4())
@@ -26,6 +49,7 @@ class StorageService:
 
 
         doc_id = str(uuid.uuid4())
+        upload_date = datetime.utcnow().isoformat()
 
 
         insights_by_chunk = {}
@@ -63,7 +87,7 @@ class StorageService:
             "filename": filename,
             "version": version,
             "is_current": True,
-            "upload_date": datetime.utcnow().isoformat(),
+            "upload_date": upload_date,
             "owner": owner,
             "document_intent": intelligence['document_intent'],
             "major_themes": intelligence['topics'],
@@ -75,13 +99,29 @@ class StorageService:
         }
 
         # 2. Prepare Child Chunks (Searchable Units)
-        # We map raw 1500-char chunks to their nearest AI-generated Section Summary
+        # Each chunk is joined to its section summary by header, one dict lookup per chunk
         child_chunks = []
+        summaries_by_header = {}
+        for section in doc_summaries['section_summaries']:
+            summaries_by_header.setdefault(normalize_header(section['section_header']), section)
+        if chunk_records is not None and len(chunk_records) != len(raw_chunks):
+            print(f"WARNING: {len(chunk_records)} chunk records for {len(raw_chunks)} chunks of '{filename}'; matching sections by text.")
+            chunk_records = None
 
         for i, chunk_text in enumerate(raw_chunks):
 
-            # Heuristic: Find which section header belongs to this chunk
-            matched_header, matched_summary = self._match_section(chunk_text, doc_summaries)
+            record = chunk_records[i] if chunk_records else None
+            matched = self._join_section(record, summaries_by_header) if record is not None else None
+            if matched is not None:
+                matched_header, matched_summary = matched
+            elif record is not None:
+                # The model renamed or merged the header: fall back to finding a summarized header in the text
+                matched_header, matched_summary = self._match_section(chunk_text, doc_summaries)
+                if (matched_header, matched_summary) == ("General", "N/A"):
+                    matched_header = record.get("section_header") or "General"
+            else:
+                # Legacy payload without records: find which section header appears in this chunk
+                matched_header, matched_summary = self._match_section(chunk_text, doc_summaries)
 
             current_insights = insights_by_chunk.get(i, [])
             flat_types = list(set([ins['type'] for ins in current_insights]))
@@ -93,7 +133,7 @@ class StorageService:
                 "chunk_index": i,
                 "section_header": matched_header,
                 "chunk_text": chunk_text,  # The actual raw text for RAG retrieval
-                "embedding": embeddings[i],  # TODO: Call your embedding function here
+                "embedding": encode_vector(embeddings[i]),  # Format set by VECTOR_STORAGE_FORMAT
                 "entities": entities_by_chunk.get(i, []),
                 "relationships": rels_by_chunk.get(i, []),
                 "section_summary": matched_summary,
@@ -101,17 +141,50 @@ class StorageService:
                 "insight_types": flat_types,
                 "version": version,
                 "is_current": True,
+                # Copied from the parent so RAG context needs no lookup; every version writes new chunks
+                "filename": filename,
+                "upload_date": upload_date,
             }
+            if record is not None:
+                chunk_entry.update({
+                    "header_path": record.get("header_path") or [],
+                    "section_id": record.get("section_id"),
+                    "pages": record.get("pages") or [],
+                    "char_start": record.get("char_start"),
+                    "char_end": record.get("char_end"),
+                })
             child_chunks.append(chunk_entry)
 
         # 3. Atomic Inserts into MongoDB Atlas
         self.db.documents.insert_one(parent_doc)
         self.db.chunks.insert_many(child_chunks)
+        self._save_report(self._build_report(parent_doc, child_chunks))
+        for hook in self.index_hooks:
+            hook.on_chunks_inserted(child_chunks)
+        self._corpus_changed()
 
         print(f"Document '{filename}' stored. Parent ID: {doc_id} | Chunks: {len(child_chunks)}")
         return doc_id
     
 
+    def _corpus_changed(self):
+        self.generation = bump_corpus_generation(self.db)
+        for hook in self.index_hooks:
+            hook.advance_generation(self.generation)
+        return self.generation
+
+    @staticmethod
+    def _join_section(record: dict, summaries_by_header: dict):
+        """
+        The chunk's section header and summary from the deepest header on its
+        path that has a summary, or None when no header on the path matches.
+        """
+        for header in reversed(record.get("header_path") or []):
+            section = summaries_by_header.get(normalize_header(header))
+            if section is not None:
+                return section['section_header'], section['summary_text']
+        return None
+
     def _match_section(self, chunk_text: str, doc_summaries):
 
         for section in doc_summaries['section_summaries']:
@@ -123,23 +196,79 @@ class StorageService:
 
 
 
-    def get_all_documents(self):
-        """Retrieves the list for the individual bars in the Archive tab."""
-        docs = self.db.documents.find({"is_current": True}, {"_id": 1, "filename": 1, "upload_date": 1}).sort("upload_date", -1)
-        return [{"id": str(d["_id"]), "filename": d["filename"], "upload_date": d["upload_date"]} for d in docs]
+    def get_all_documents(self, limit: int = 50, cursor: str = None, filename_prefix: str = None,
+                          uploaded_after: str = None, uploaded_before: str = None):
+        """
+        One page of the Archive tab, newest first. Pages are keyset-paginated on
+        (upload_date, _id) so each one is a bounded index scan however many
+        documents the workspace holds; pass next_cursor back to get the next.
+        Dates are ISO strings compared against upload_date (after inclusive, before exclusive).
+        """
+        query = {"is_current": True}
+        if filename_prefix:
+            query["filename"] = {"$regex": f"^{re.escape(filename_prefix)}"}
+        if uploaded_after or uploaded_before:
+            query["upload_date"] = {}
+            if uploaded_after:
+                query["upload_date"]["$gte"] = uploaded_after
+            if uploaded_before:
+                query["upload_date"]["$lt"] = uploaded_before
+        if cursor:
+            last_date, last_id = self._decode_cursor(cursor)
+            query = {"$and": [query, {"$or": [
+                {"upload_date": {"$lt": last_date}},
+                {"upload_date": last_date, "_id": {"$lt": last_id}},
+            ]}]}
+
+        docs = list(
+            self.db.documents.find(query, {"_id": 1, "filename": 1, "upload_date": 1})
+            .sort([("upload_date", -1), ("_id", -1)])
+            .limit(limit + 1)
+        )
+        has_more = len(docs) > limit
+        docs = docs[:limit]
+        return {
+            "items": [{"id": str(d["_id"]), "filename": d["filename"], "upload_date": d["upload_date"]} for d in docs],
+            "next_cursor": self._encode_cursor(docs[-1]) if has_more else None,
+        }
+
+    @staticmethod
+    def _encode_cursor(doc: dict) -> str:
+        raw = json.dumps([doc["upload_date"], str(doc["_id"])]).encode("utf-8")
+        return base64.urlsafe_b64encode(raw).decode("ascii")
+
+    @staticmethod
+    def _decode_cursor(cursor: str):
+        try:
+            last_date, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+            return last_date, last_id
+        except Exception:
+            raise ValueError("Invalid cursor")
     
 
+    def get_document_full_history(self, doc_id, section: str = None, offset: int = 0, limit: int = None):
+        """
+        Serves the materialized report for the detailed history view in one read.
+        section restricts it to one field; offset/limit page the list fields.
+        Documents stored before reports existed are materialized on first read.
+        """
+        if section is not None and section not in REPORT_SECTIONS:
+            raise ValueError(f"Unknown report section '{section}'")
 
+        report = self.db.reports.find_one({"_id": doc_id}, self._report_projection(section, offset, limit))
+        if report is not None:
+            return report
 
-    def get_document_full_history(self, doc_id):
-        """Assembles parent and child data for the detailed history view."""
-        parent = self.db.documents.find_one({"_id": doc_id})
+        parent = self.db.documents.find_one({"_id": doc_id}, {"audit_log": 0, "dashboard_snapshot": 0})
         if not parent:
             return None
-            
-        chunks = list(self.db.chunks.find({"parent_doc_id": doc_id}).sort("chunk_index", 1))
-        
-        # Reconstruct the analysis format for the frontend
+        chunks = self.db.chunks.find({"parent_doc_id": doc_id}, _REPORT_CHUNK_PROJECTION).sort("chunk_index", 1)
+        report = self._build_report(parent, chunks)
+        self._save_report(report)
+        return self._project_report(report, section, offset, limit)
+
+    def _build_report(self, parent: dict, chunks) -> dict:
+        """Reconstructs the analysis format the frontend expects."""
         all_entities = []
         all_relationships = []
         all_insights = []
@@ -163,7 +292,8 @@ class StorageService:
                 })
                 seen_headers.add(c["section_header"])
 
-        return {
+        report = {
+            "_id": parent["_id"],
             "filename": parent["filename"],
             "document_intent": parent.get("document_intent"),
             "major_themes": parent.get("major_themes", []),
@@ -174,6 +304,41 @@ class StorageService:
             "actionable_insights": all_insights,
             "section_summaries": section_summaries
         }
+        report["counts"] = {name: len(report[name]) for name in REPORT_LIST_SECTIONS}
+        return report
+
+    def _save_report(self, report: dict):
+        try:
+            self.db.reports.replace_one({"_id": report["_id"]}, report, upsert=True)
+        except Exception as e:
+            # Reports are a read optimization; the history view rebuilds one if it's missing
+            print(f"WARNING: Could not materialize report for {report['_id']}: {e}")
+
+    @staticmethod
+    def _page(offset: int, limit: int):
+        return {"$slice": [offset, limit if limit is not None else 2 ** 31 - 1]}
+
+    def _report_projection(self, section, offset, limit):
+        paged = offset or limit is not None
+        if section is not None:
+            value = self._page(offset, limit) if paged and section in REPORT_LIST_SECTIONS else 1
+            return {"_id": 0, "filename": 1, "counts": 1, section: value}
+        projection = {"_id": 0}
+        if paged:
+            projection.update({name: self._page(offset, limit) for name in REPORT_LIST_SECTIONS})
+        return projection
+
+    @staticmethod
+    def _project_report(report, section, offset, limit):
+        """Same shape as _report_projection, applied in Python."""
+        end = None if limit is None else offset + limit
+        if section is not None:
+            value = report[section][offset:end] if section in REPORT_LIST_SECTIONS else report[section]
+            return {"filename": report["filename"], "counts": report["counts"], section: value}
+        projected = {k: v for k, v in report.items() if k != "_id"}
+        for name in REPORT_LIST_SECTIONS:
+            projected[name] = report[name][offset:end]
+        return projected
     
     def soft_delete_document(self, doc_id: str):
         """
@@ -191,4 +356,7 @@ class StorageService:
             {"parent_doc_id": doc_id},
             {"$set": {"is_current": False}}
         )
+        for hook in self.index_hooks:
+            hook.on_chunks_updated({"parent_doc_id": doc_id}, {"is_current": False})
+        self._corpus_changed()
         return True
\ No newline at end of file
@@ -0,0 +1,109 @@
+import hashlib
+import os
+import tempfile
+from fastapi import HTTPException, UploadFile
+
+UPLOAD_SPILL_THRESHOLD_BYTES = int(os.getenv("UPLOAD_SPILL_THRESHOLD_BYTES", str(32 * 1024 * 1024)))
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(100 * 1024 * 1024)))
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or tempfile.gettempdir()
+
+_BLOCK_SIZE = 1024 * 1024
+
+
+def configure_multipart_spooling():
+    """
+    Starlette spools multipart file parts to disk above 1MB by default;
+    raise that to our own threshold so medium uploads stay in memory end to end.
+    """
+    try:
+        from starlette.formparsers import MultiPartParser
+        MultiPartParser.spool_max_size = UPLOAD_SPILL_THRESHOLD_BYTES
+    except (ImportError, AttributeError):
+        pass
+
+
+UPLOAD_TOO_LARGE = f"File exceeds the {UPLOAD_MAX_BYTES // (1024 * 1024)}MB upload limit."
+
+
+def exceeds_upload_limit(content_length) -> bool:
+    """Lets oversize uploads be rejected from the header, before the body is parsed."""
+    try:
+        return content_length is not None and int(content_length) > UPLOAD_MAX_BYTES
+    except ValueError:
+        return False
+
+
+class UploadBuffer:
+    """
+    An upload read block by block, hashed on the way in.
+    Uploads up to UPLOAD_SPILL_THRESHOLD_BYTES stay in memory and are handed to
+    Docling as a stream; larger ones spill to a temp file in UPLOAD_SPOOL_DIR
+    (never the app directory), which close() removes.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.size = 0
+        self.sha256 = None
+        self._memory = bytearray()
+        self._spill = None
+
+    @classmethod
+    async def from_upload(cls, upload: UploadFile):
+        buffer = cls(os.path.basename(upload.filename))
+        digest = hashlib.sha256()
+        try:
+            while True:
+                block = await upload.read(_BLOCK_SIZE)
+                if not block:
+                    break
+                buffer.size += len(block)
+                if buffer.size > UPLOAD_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail=UPLOAD_TOO_LARGE)
+                digest.update(block)
+                buffer._write(block)
+        except BaseException:
+            buffer.close()
+            raise
+
+        if buffer._spill is not None:
+            buffer._spill.flush()
+        buffer.sha256 = digest.hexdigest()
+        return buffer
+
+    def _write(self, block: bytes):
+        if self._spill is None and len(self._memory) + len(block) <= UPLOAD_SPILL_THRESHOLD_BYTES:
+            self._memory.extend(block)
+            return
+        if self._spill is None:
+            self._spill = tempfile.NamedTemporaryFile(dir=UPLOAD_SPOOL_DIR, prefix="alphadoc_", suffix=f"_{self.filename}", delete=False)
+            self._spill.write(self._memory)
+            self._memory = bytearray()
+        self._spill.write(block)
+
+    @property
+    def in_memory(self) -> bool:
+        return self._spill is None
+
+    @property
+    def source(self):
+        """What IngestionService accepts: a (filename, bytes) pair, or the spill file path."""
+        if self.in_memory:
+            return (self.filename, bytes(self._memory))
+        return self._spill.name
+
+    def read_bytes(self) -> bytes:
+        if self.in_memory:
+            return bytes(self._memory)
+        with open(self._spill.name, "rb") as f:
+            return f.read()
+
+    def close(self):
+        self._memory = bytearray()
+        if self._spill is not None:
+            self._spill.close()
+            try:
+                os.remove(self._spill.name)
+            except FileNotFoundError:
+                pass
+            self._spill = None
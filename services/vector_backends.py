@@ -0,0 +1,540 @@
+import hashlib
+import json
+import math
+import os
+import threading
+import uuid
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+from langchain_mongodb import MongoDBAtlasVectorSearch
+from core.cache import LRUCache
+from core.database import workspace_config
+from core.vectors import decode_vector
+
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "atlas").lower()
+LOCAL_INDEX_DIR = os.getenv("LOCAL_VECTOR_INDEX_DIR") or os.path.expanduser("~/.alphadoc/vector_index")
+# Above this many vectors the local index searches an IVF partition instead of every row
+LOCAL_IVF_THRESHOLD = int(os.getenv("LOCAL_VECTOR_IVF_THRESHOLD", "20000"))
+LOCAL_IVF_NPROBE = int(os.getenv("LOCAL_VECTOR_IVF_NPROBE", "8"))
+
+
+# --- MongoDB-style filter matching (the subset the self-query translator emits) ---
+
+def _values_at(doc: dict, path: str):
+    """All values at a dotted path, descending into arrays like MongoDB does."""
+    values = [doc]
+    for part in path.split("."):
+        found = []
+        for value in values:
+            items = value if isinstance(value, list) else [value]
+            for item in items:
+                if isinstance(item, dict) and part in item:
+                    found.append(item[part])
+        values = found
+
+    flat = []
+    for value in values:
+        flat.extend(value if isinstance(value, list) else [value])
+    return flat
+
+
+def _compare(values, op, arg):
+    ops = {
+        "$gt": lambda v: v > arg,
+        "$gte": lambda v: v >= arg,
+        "$lt": lambda v: v < arg,
+        "$lte": lambda v: v <= arg,
+    }
+    for v in values:
+        try:
+            if ops[op](v):
+                return True
+        except TypeError:
+            continue
+    return False
+
+
+def _match_condition(values, condition):
+    if not (isinstance(condition, dict) and any(str(k).startswith("$") for k in condition)):
+        condition = {"$eq": condition}
+
+    for op, arg in condition.items():
+        if op == "$eq":
+            ok = arg in values
+        elif op == "$ne":
+            ok = arg not in values
+        elif op == "$in":
+            ok = any(v in arg for v in values)
+        elif op == "$nin":
+            ok = not any(v in arg for v in values)
+        elif op in ("$gt", "$gte", "$lt", "$lte"):
+            ok = _compare(values, op, arg)
+        elif op == "$exists":
+            ok = bool(values) == bool(arg)
+        else:
+            raise ValueError(f"Unsupported filter operator: {op}")
+        if not ok:
+            return False
+    return True
+
+
+def match_filter(doc: dict, flt: dict) -> bool:
+    """Evaluates a MongoDB query filter against a plain dict."""
+    for key, condition in (flt or {}).items():
+        if key == "$and":
+            ok = all(match_filter(doc, f) for f in condition)
+        elif key == "$or":
+            ok = any(match_filter(doc, f) for f in condition)
+        elif key == "$nor":
+            ok = not any(match_filter(doc, f) for f in condition)
+        else:
+            ok = _match_condition(_values_at(doc, key), condition)
+        if not ok:
+            return False
+    return True
+
+
+# --- Local in-process index ---
+
+class LocalVectorIndex:
+    """
+    Cosine-similarity index for one workspace, kept on local disk.
+    Unit-normalised float32 vectors are appended to vectors.f32 and read back
+    through a memory map. Chunk text and metadata go to an append-only log
+    (meta.jsonl): one "add" record per row and one "set" record per metadata
+    update, so a write costs O(batch) rather than O(corpus); the log is
+    compacted once set records outnumber rows. index.json holds the committed
+    row count and is replaced last, so rows half-written before a crash are
+    truncated on load instead of misaligning every later row.
+    Small corpora are searched brute-force with NumPy; past LOCAL_IVF_THRESHOLD
+    rows an IVF (k-means partition) index is trained and only the
+    LOCAL_IVF_NPROBE closest partitions are scanned.
+    The files are owned by one process: run a single worker per host when
+    VECTOR_BACKEND=local.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._header_path = os.path.join(directory, "index.json")
+        self._vectors_path = os.path.join(directory, "vectors.f32")
+        self._log_path = os.path.join(directory, "meta.jsonl")
+        self._ivf_path = os.path.join(directory, "ivf.npz")
+        # Written by earlier versions: one JSON document rewritten on every change
+        self._legacy_meta_path = os.path.join(directory, "meta.json")
+        self._lock = threading.RLock()
+
+        self.dim = None
+        self._ids = []
+        self._meta = []
+        self._rows = {}
+        self._log_records = 0
+        self._vectors = None
+        self._centroids = None
+        self._assignments = None
+        self._trained_count = 0
+        self._load()
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def exists(self):
+        return os.path.exists(self._header_path)
+
+    # --- Persistence ---
+
+    def _load(self):
+        if not self.exists:
+            if os.path.exists(self._legacy_meta_path):
+                self._migrate_legacy()
+            return
+        with open(self._header_path) as f:
+            header = json.load(f)
+        self.dim = header["dim"]
+        committed = header["rows"]
+
+        clean = self._replay_log(committed)
+        rows = min(committed, len(self._ids), self._file_rows(self._vectors_path, self.dim))
+        if rows < len(self._ids):
+            del self._ids[rows:], self._meta[rows:]
+        self._rows = {chunk_id: row for row, chunk_id in enumerate(self._ids)}
+        self._truncate(self._vectors_path, rows * self.dim * 4)
+        if rows != committed or not clean:
+            print(f"WARNING: Local vector index {self.directory} discarded uncommitted writes; {rows} rows kept.")
+            self._compact()
+        self._open_vectors()
+        self._load_ivf()
+
+    def _replay_log(self, committed: int) -> bool:
+        """Rebuilds ids and metadata from meta.jsonl. Returns False if it held uncommitted or torn records."""
+        self._ids, self._meta, self._log_records = [], [], 0
+        rows = {}
+        clean = True
+        if not os.path.exists(self._log_path):
+            return committed == 0
+        with open(self._log_path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    clean = False  # Torn last line
+                    break
+                self._log_records += 1
+                if record["op"] == "add":
+                    if len(self._ids) >= committed:
+                        clean = False
+                        continue
+                    rows[record["id"]] = len(self._ids)
+                    self._ids.append(record["id"])
+                    self._meta.append(record["meta"])
+                elif record["op"] == "set":
+                    for chunk_id in record["ids"]:
+                        if chunk_id in rows:
+                            self._meta[rows[chunk_id]].update(record["values"])
+        return clean
+
+    def _migrate_legacy(self):
+        with open(self._legacy_meta_path) as f:
+            state = json.load(f)
+        self.dim = state["dim"]
+        rows = min(len(state["ids"]), self._file_rows(self._vectors_path, self.dim))
+        self._ids, self._meta = state["ids"][:rows], state["meta"][:rows]
+        self._rows = {chunk_id: row for row, chunk_id in enumerate(self._ids)}
+        self._truncate(self._vectors_path, rows * self.dim * 4)
+        # The old IVF file can't be trusted to match; it is retrained when the corpus qualifies
+        if os.path.exists(self._ivf_path):
+            os.remove(self._ivf_path)
+        self._compact()
+        os.remove(self._legacy_meta_path)
+        self._open_vectors()
+
+    @staticmethod
+    def _file_rows(path: str, dim: int) -> int:
+        if not dim or not os.path.exists(path):
+            return 0
+        return os.path.getsize(path) // (dim * 4)
+
+    @staticmethod
+    def _truncate(path: str, size: int):
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            with open(path, "r+b") as f:
+                f.truncate(size)
+
+    def _write_header(self):
+        tmp = self._header_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"dim": self.dim, "rows": len(self._ids)}, f)
+        os.replace(tmp, self._header_path)
+
+    def _append_log(self, records: list[dict]):
+        with open(self._log_path, "a") as f:
+            f.writelines(json.dumps(record, default=str) + "\n" for record in records)
+        self._log_records += len(records)
+
+    def _compact(self):
+        """Rewrites meta.jsonl as one add record per row, then commits the row count."""
+        tmp = self._log_path + ".tmp"
+        with open(tmp, "w") as f:
+            f.writelines(
+                json.dumps({"op": "add", "id": chunk_id, "meta": meta}, default=str) + "\n"
+                for chunk_id, meta in zip(self._ids, self._meta)
+            )
+        os.replace(tmp, self._log_path)
+        self._log_records = len(self._ids)
+        self._write_header()
+
+    def _open_vectors(self):
+        if self._ids:
+            self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(len(self._ids), self.dim))
+        else:
+            self._vectors = None
+
+    # --- Writes ---
+
+    def add(self, chunks: list[dict]):
+        """Appends chunk documents (as stored in MongoDB, embedding included). Known ids are skipped."""
+        with self._lock:
+            new = [c for c in chunks if str(c["_id"]) not in self._rows and c.get("embedding") is not None]
+            if not new:
+                return 0
+
+            matrix = np.asarray([decode_vector(c["embedding"]) for c in new], dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            matrix /= np.where(norms == 0, 1, norms)
+            if self.dim is None:
+                self.dim = matrix.shape[1]
+
+            records = []
+            for chunk in new:
+                chunk_id = str(chunk["_id"])
+                meta = {k: v for k, v in chunk.items() if k != "embedding"}
+                records.append({"op": "add", "id": chunk_id, "meta": meta})
+
+            # Vectors, then metadata, then the row count: the header is the commit point
+            with open(self._vectors_path, "ab") as f:
+                f.write(matrix.tobytes())
+            self._append_log(records)
+            for record in records:
+                self._rows[record["id"]] = len(self._ids)
+                self._ids.append(record["id"])
+                self._meta.append(record["meta"])
+            self._write_header()
+            self._open_vectors()
+
+            if len(self._ids) >= LOCAL_IVF_THRESHOLD and len(self._ids) >= 2 * self._trained_count:
+                self._train_ivf()
+            else:
+                self._assign_new_rows()
+            return len(new)
+
+    def update_metadata(self, match: dict, values: dict):
+        """Applies values to every row whose metadata matches (e.g. soft deletes)."""
+        with self._lock:
+            changed = []
+            for chunk_id, meta in zip(self._ids, self._meta):
+                if match_filter(meta, match):
+                    meta.update(values)
+                    changed.append(chunk_id)
+            if changed:
+                self._append_log([{"op": "set", "ids": changed, "values": values}])
+                if self._log_records > 2 * len(self._ids) + 1000:
+                    self._compact()
+            return len(changed)
+
+    def build_from_collection(self, collection, batch_size: int = 1000):
+        """Bootstraps the index from a tenant's chunks collection."""
+        batch = []
+        for chunk in collection.find({"embedding": {"$exists": True}}, batch_size=batch_size):
+            batch.append(chunk)
+            if len(batch) >= batch_size:
+                self.add(batch)
+                batch = []
+        if batch:
+            self.add(batch)
+
+    def search(self, query_vector, k: int = 4, pre_filter: dict = None):
+        """Returns [(metadata, score)] best first, restricted to rows matching pre_filter."""
+        with self._lock:
+            if self._vectors is None:
+                return []
+            q = np.asarray(query_vector, dtype=np.float32)
+            q /= (np.linalg.norm(q) or 1.0)
+
+            if self._centroids is not None:
+                probes = np.argsort(-(self._centroids @ q))[:LOCAL_IVF_NPROBE]
+                rows = np.flatnonzero(np.isin(self._assignments, probes))
+            else:
+                rows = np.arange(len(self._ids))
+
+            scores = self._vectors[rows] @ q
+            results = []
+            for i in np.argsort(-scores):
+                meta = self._meta[rows[i]]
+                if pre_filter and not match_filter(meta, pre_filter):
+                    continue
+                results.append((meta, float(scores[i])))
+                if len(results) >= k:
+                    break
+            return results
+
+    # --- IVF ---
+
+    def _assignments_path(self, trained_count: int):
+        # One file per training run, so ivf.npz always names assignments made with its centroids
+        return os.path.join(self.directory, f"ivf_assignments_{trained_count}.i32")
+
+    def _load_ivf(self):
+        if not os.path.exists(self._ivf_path):
+            return
+        ivf = np.load(self._ivf_path)
+        self._centroids = ivf["centroids"]
+        self._trained_count = int(ivf["trained_count"])
+        path = self._assignments_path(self._trained_count)
+        assignments = np.fromfile(path, dtype=np.int32) if os.path.exists(path) else np.empty(0, dtype=np.int32)
+        self._assignments = assignments[:len(self._ids)]
+        self._truncate(path, len(self._assignments) * 4)
+        self._assign_new_rows()
+
+    def _train_ivf(self, iterations: int = 10):
+        n = len(self._ids)
+        nlist = max(1, int(math.sqrt(n)))
+        rng = np.random.default_rng(0)
+        sample = self._vectors[rng.choice(n, size=min(n, nlist * 40), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[labels == c]
+                if len(members):
+                    centroid = members.mean(axis=0)
+                    centroids[c] = centroid / (np.linalg.norm(centroid) or 1.0)
+
+        previous = self._assignments_path(self._trained_count) if self._centroids is not None else None
+        self._centroids = centroids
+        self._assignments = np.empty(0, dtype=np.int32)
+        self._trained_count = n
+        if os.path.exists(self._assignments_path(n)):
+            os.remove(self._assignments_path(n))  # Left by a run that crashed before committing
+        self._assign_new_rows()
+        tmp = self._ivf_path + ".tmp.npz"
+        np.savez(tmp, centroids=self._centroids, trained_count=self._trained_count)
+        os.replace(tmp, self._ivf_path)
+        if previous and os.path.exists(previous):
+            os.remove(previous)
+        print(f"DEBUG: Trained IVF index with {nlist} lists over {n} vectors in {self.directory}.")
+
+    def _assign_new_rows(self, block: int = 65536):
+        if self._centroids is None:
+            return
+        start = len(self._assignments)
+        parts = [self._assignments]
+        for offset in range(start, len(self._ids), block):
+            parts.append(np.argmax(self._vectors[offset:offset + block] @ self._centroids.T, axis=1).astype(np.int32))
+        self._assignments = np.concatenate(parts)
+        if len(self._assignments) > start:
+            with open(self._assignments_path(self._trained_count), "ab") as f:
+                f.write(self._assignments[start:].tobytes())
+
+
+class LocalVectorStore(VectorStore):
+    """LangChain adapter so the SelfQueryRetriever can search a LocalVectorIndex."""
+
+    def __init__(self, index: LocalVectorIndex, embedding, text_key: str = "chunk_text"):
+        self.index = index
+        self._embedding = embedding
+        self.text_key = text_key
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        """Embeds and indexes texts. The app's chunks arrive through StorageService instead."""
+        texts = list(texts)
+        ids = [str(i) for i in ids] if ids else [str(uuid.uuid4()) for _ in texts]
+        vectors = self._embedding.embed_documents(texts)
+        self.index.add([
+            {**(metadata or {}), "_id": chunk_id, self.text_key: text, "embedding": vector}
+            for chunk_id, text, vector, metadata in zip(ids, texts, vectors, metadatas or [None] * len(texts))
+        ])
+        return ids
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, directory: str = None, **kwargs):
+        """Builds a store over a LocalVectorIndex in directory (required) and adds texts to it."""
+        if not directory:
+            raise ValueError("LocalVectorStore.from_texts needs the index directory.")
+        store = cls(LocalVectorIndex(directory), embedding, kwargs.pop("text_key", "chunk_text"))
+        store.add_texts(texts, metadatas, **kwargs)
+        return store
+
+    def similarity_search_with_score(self, query: str, k: int = 4, pre_filter: dict = None, **kwargs):
+        vector = self._embedding.embed_query(query)
+        return self.similarity_search_by_vector_with_score(vector, k, pre_filter)
+
+    def similarity_search_by_vector_with_score(self, vector, k: int = 4, pre_filter: dict = None):
+        results = []
+        for meta, score in self.index.search(vector, k, pre_filter):
+            metadata = {key: value for key, value in meta.items() if key != self.text_key}
+            results.append((Document(page_content=meta.get(self.text_key, ""), metadata=metadata), score))
+        return results
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def similarity_search_by_vector(self, embedding, k: int = 4, pre_filter: dict = None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, pre_filter)]
+
+
+# --- Backends ---
+
+class VectorBackend:
+    """
+    Where chunk vectors are searched. Subclasses provide as_vectorstore(embedding_model),
+    the LangChain VectorStore the retriever runs on. StorageService calls the
+    on_* hooks so backends that keep their own copy of the vectors stay in sync.
+    """
+
+    name = "base"
+    # What a cached vector store is bound to; a change means it must be rebuilt
+    source = None
+
+    def on_chunks_inserted(self, chunks: list[dict]):
+        pass
+
+    def on_chunks_updated(self, match: dict, values: dict):
+        pass
+
+    def advance_generation(self, generation: int):
+        pass
+
+
+class AtlasVectorBackend(VectorBackend):
+    """MongoDB Atlas Vector Search; Atlas indexes writes itself, so the hooks are no-ops."""
+
+    name = "atlas"
+
+    def __init__(self, collection, index_name: str):
+        self.collection = collection
+        self.index_name = index_name
+        self.source = collection
+
+    def as_vectorstore(self, embedding_model):
+        return MongoDBAtlasVectorSearch(
+            collection=self.collection,
+            embedding=embedding_model, # Your text-embedding-004 wrapper
+            index_name=self.index_name,
+            text_key="chunk_text",
+            relevance_score_fn="cosine",
+        )
+
+
+class LocalVectorBackend(VectorBackend):
+    name = "local"
+
+    def __init__(self, index: LocalVectorIndex, collection):
+        self.index = index
+        self.collection = collection
+        self.source = index
+
+    def as_vectorstore(self, embedding_model):
+        return LocalVectorStore(self.index, embedding_model)
+
+    def on_chunks_inserted(self, chunks: list[dict]):
+        self.index.add(chunks)
+
+    def on_chunks_updated(self, match: dict, values: dict):
+        self.index.update_metadata(match, values)
+
+
+_local_indexes = LRUCache(max_size=int(os.getenv("LOCAL_VECTOR_INDEX_CACHE_SIZE", "32")))
+_local_indexes_lock = threading.Lock()
+
+
+def _get_local_index(workspace_id: str, collection):
+    # Keyed and stored by cluster too: after a storage URI change the old cluster's vectors must not be served
+    config = workspace_config.get(workspace_id)
+    source = hashlib.sha256((config.mongodb_uri if config else "").encode()).hexdigest()[:12]
+    key = (workspace_id, source)
+    index = _local_indexes.get(key)
+    if index is not None:
+        return index
+    with _local_indexes_lock:
+        index = _local_indexes.get(key)
+        if index is None:
+            _local_indexes.pop_where(lambda k: k[0] == workspace_id and k != key)
+            index = LocalVectorIndex(os.path.join(LOCAL_INDEX_DIR, f"workspace_{workspace_id}_{source}"))
+            if not index.exists:
+                index.build_from_collection(collection)
+            _local_indexes.set(key, index)
+    return index
+
+
+def get_vector_backend(workspace_id: str, tenant_db, index_name: str) -> VectorBackend:
+    """The backend selected by VECTOR_BACKEND ("atlas" or "local")."""
+    if VECTOR_BACKEND == "local":
+        return LocalVectorBackend(_get_local_index(workspace_id, tenant_db["chunks"]), tenant_db["chunks"])
+    return AtlasVectorBackend(tenant_db["chunks"], index_name)
@@ -0,0 +1,293 @@
+import asyncio
+from datetime import datetime, timedelta
+import pytest
+from fastapi import HTTPException
+from services.jobs import (
+    CANCELLED, FAILED, QUEUED, RUNNING, SUCCEEDED, InMemoryJobStore, JobManager,
+)
+
+USER = {"workspace_id": "acme", "username": "alice", "role": "researcher"}
+
+
+class FakePipeline:
+    """Stands in for AnalysisPipeline; each run waits for release() when gated."""
+
+    def __init__(self, gated=False, error=None):
+        self.gate = asyncio.Event()
+        if not gated:
+            self.gate.set()
+        self.started = asyncio.Event()
+        self.error = error
+        self.before_return = None
+        self.runs = 0
+
+    def release(self):
+        self.gate.set()
+
+    async def run(self, source, filename, workspace_id, on_stage=None):
+        self.runs += 1
+        on_stage("converting", "started")
+        self.started.set()
+        await self.gate.wait()
+        on_stage("converting", "finished")
+        if self.error:
+            raise self.error
+        if self.before_return:
+            self.before_return()
+        return {"filename": filename, "size": len(source[1])}
+
+
+def make_manager(pipeline, store=None, **env):
+    manager = JobManager(store or InMemoryJobStore(), pipeline)
+    for key, value in env.items():
+        setattr(manager, key, value)
+    return manager
+
+
+async def wait_for_status(manager, job_id, status, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while True:
+        job = manager.store.get(job_id)
+        if job["status"] == status:
+            return job
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError(f"job is {job['status']}, expected {status}")
+        await asyncio.sleep(0.01)
+
+
+def stale_running_job(store, job_id, with_source=True):
+    long_ago = datetime.utcnow() - timedelta(hours=1)
+    store.create({
+        "_id": job_id, "workspace_id": "acme", "username": "alice", "filename": "a.pdf",
+        "status": RUNNING, "instance_id": "dead-instance", "stage": "converting", "stages": {},
+        "error": None, "created_at": long_ago, "updated_at": long_ago,
+    }, b"%PDF" if with_source else None)
+    if not with_source:
+        store.clear_source(job_id)
+
+
+def test_job_runs_to_success():
+    async def scenario():
+        manager = make_manager(FakePipeline())
+        await manager.start()
+        try:
+            job_id = await manager.submit(b"%PDF-1.7", "a.pdf", USER)
+            await wait_for_status(manager, job_id, SUCCEEDED)
+            status = manager.status(job_id, "acme")
+            assert status["stages"]["converting"]["seconds"] is not None
+            assert manager.result(job_id, "acme") == {"filename": "a.pdf", "size": 8}
+            assert manager.store.get_source(job_id) is None
+        finally:
+            await manager.stop()
+
+    asyncio.run(scenario())
+
+
+def test_pipeline_error_fails_job():
+    async def scenario():
+        manager = make_manager(FakePipeline(error=HTTPException(status_code=428, detail="AI_CONFIG_MISSING")))
+        await manager.start()
+        try:
+            job_id = await manager.submit(b"%PDF", "a.pdf", USER)
+            job = await wait_for_status(manager, job_id, FAILED)
+            assert job["error"] == "AI_CONFIG_MISSING"
+            with pytest.raises(HTTPException) as exc:
+                manager.result(job_id, "acme")
+            assert exc.value.status_code == 409
+        finally:
+            await manager.stop()
+
+    asyncio.run(scenario())
+
+
+def test_jobs_are_scoped_to_their_workspace():
+    async def scenario():
+        manager = make_manager(FakePipeline())
+        await manager.start()
+        try:
+            job_id = await manager.submit(b"%PDF", "a.pdf", USER)
+            with pytest.raises(HTTPException) as exc:
+                manager.status(job_id, "other")
+            assert exc.value.status_code == 404
+        finally:
+            await manager.stop()
+
+    asyncio.run(scenario())
+
+
+def test_cancel_running_job():
+    async def scenario():
+        pipeline = FakePipeline(gated=True)
+        manager = make_manager(pipeline)
+        await manager.start()
+        try:
+            job_id = await manager.submit(b"%PDF", "a.pdf", USER)
+            await pipeline.started.wait()
+            assert manager.cancel(job_id, "acme") == CANCELLED
+            await asyncio.sleep(0.05)
+            job = manager.store.get(job_id)
+            assert job["status"] == CANCELLED
+            assert job_id not in manager._running
+            assert manager.store.get_source(job_id) is None
+        finally:
+            await manager.stop()
+
+    asyncio.run(scenario())
+
+
+def test_cancel_queued_job_is_never_run():
+    async def scenario():
+        pipeline = FakePipeline(gated=True)
+        manager = make_manager(pipeline, workers=1)
+        await manager.start()
+        try:
+            first = await manager.submit(b"%PDF", "a.pdf", USER)
+            second = await manager.submit(b"%PDF", "b.pdf", USER)
+            await pipeline.started.wait()
+            assert manager.cancel(second, "acme") == CANCELLED
+            pipeline.release()
+            await wait_for_status(manager, first, SUCCEEDED)
+            await asyncio.sleep(0.05)
+            assert manager.store.get(second)["status"] == CANCELLED
+            assert pipeline.runs == 1
+        finally:
+            await manager.stop()
+
+    asyncio.run(scenario())
+
+
+def test_cancel_of_finished_job_reports_its_state():
+    async def scenario():
+        manager = make_manager(FakePipeline())
+        await manager.start()
+        try:
+            job_id = await manager.submit(b"%PDF", "a.pdf", USER)
+            await wait_for_status(manager, job_id, SUCCEEDED)
+            assert manager.cancel(job_id, "acme") == SUCCEEDED
+        finally:
+            await manager.stop()
+
+    asyncio.run(scenario())
+
+
+def test_cancel_elsewhere_is_not_overwritten_by_completion():
+    async def scenario():
+        pipeline = FakePipeline()
+        manager = make_manager(pipeline)
+        # Another instance cancels while this one is finishing; _running can't see it
+        pipeline.before_return = lambda: manager.store.update(job_id, {"status": CANCELLED})
+        await manager.start()
+        try:
+            job_id = await manager.submit(b"%PDF", "a.pdf", USER)
+            await asyncio.sleep(0.1)
+            job = manager.store.get(job_id, include_result=True)
+            assert job["status"] == CANCELLED
+            assert "result" not in job
+        finally:
+            await manager.stop()
+
+    asyncio.run(scenario())
+
+
+def test_queue_full_rejects_with_retry_after():
+    async def scenario():
+        pipeline = FakePipeline(gated=True)
+        manager = make_manager(pipeline, workers=1, max_queue=1)
+        await manager.start()
+        try:
+            await manager.submit(b"%PDF", "a.pdf", USER)
+            await pipeline.started.wait()
+            await manager.submit(b"%PDF", "b.pdf", USER)
+            with pytest.raises(HTTPException) as exc:
+                await manager.submit(b"%PDF", "c.pdf", USER)
+            assert exc.value.status_code == 503
+            assert exc.value.headers["Retry-After"]
+        finally:
+            pipeline.release()
+            await manager.stop()
+
+    asyncio.run(scenario())
+
+
+def test_start_recovers_stale_running_jobs():
+    async def scenario():
+        store = InMemoryJobStore()
+        stale_running_job(store, "orphan")
+        stale_running_job(store, "lost-upload", with_source=False)
+        manager = make_manager(FakePipeline(), store)
+        await manager.start()
+        try:
+            await wait_for_status(manager, "orphan", SUCCEEDED)
+            lost = store.get("lost-upload")
+            assert lost["status"] == FAILED and lost["error"] == "INTERRUPTED"
+        finally:
+            await manager.stop()
+
+    asyncio.run(scenario())
+
+
+def test_periodic_sweep_recovers_jobs_that_go_stale_after_start():
+    async def scenario():
+        store = InMemoryJobStore()
+        manager = make_manager(FakePipeline(), store, heartbeat_interval=0.02, sweep_interval=0.02)
+        await manager.start()
+        try:
+            # A peer dies after this instance started: only a later sweep can see it
+            stale_running_job(store, "orphan")
+            await wait_for_status(manager, "orphan", SUCCEEDED)
+        finally:
+            await manager.stop()
+
+    asyncio.run(scenario())
+
+
+def test_heartbeat_keeps_long_running_job_from_being_requeued():
+    async def scenario():
+        pipeline = FakePipeline(gated=True)
+        manager = make_manager(pipeline, stale_after=0.1, heartbeat_interval=0.02, sweep_interval=0.02)
+        await manager.start()
+        try:
+            job_id = await manager.submit(b"%PDF", "a.pdf", USER)
+            await pipeline.started.wait()
+            await asyncio.sleep(0.3)
+            assert manager.store.get(job_id)["status"] == RUNNING
+            pipeline.release()
+            await wait_for_status(manager, job_id, SUCCEEDED)
+            assert pipeline.runs == 1
+        finally:
+            await manager.stop()
+
+    asyncio.run(scenario())
+
+
+def test_recover_does_not_enqueue_a_job_twice():
+    async def scenario():
+        pipeline = FakePipeline(gated=True)
+        manager = make_manager(pipeline, workers=1)
+        await manager.start()
+        try:
+            await manager.submit(b"%PDF", "a.pdf", USER)
+            waiting = await manager.submit(b"%PDF", "b.pdf", USER)
+            await pipeline.started.wait()
+            assert manager.store.get(waiting)["status"] == QUEUED
+            assert await manager.recover() == 0
+        finally:
+            pipeline.release()
+            await manager.stop()
+
+    asyncio.run(scenario())
+
+
+def test_stop_leaves_running_job_for_recovery():
+    async def scenario():
+        pipeline = FakePipeline(gated=True)
+        manager = make_manager(pipeline)
+        await manager.start()
+        job_id = await manager.submit(b"%PDF", "a.pdf", USER)
+        await pipeline.started.wait()
+        await asyncio.wait_for(manager.stop(), timeout=2)
+        job = manager.store.get(job_id)
+        assert job["status"] == RUNNING
+        assert manager.store.get_source(job_id) is not None
+
+    asyncio.run(scenario())
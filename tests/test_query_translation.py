@@ -0,0 +1,90 @@
+import pytest
+from services import query_translation
+from services.query_translation import CURRENT_ONLY, QueryTranslator
+
+VOCAB = {
+    "section_header": {"data retention": "Data Retention", "termination": "Termination"},
+    "entities.name": {"data": "Data", "agreement": "Agreement", "acme corp": "Acme Corp"},
+}
+
+
+def conditions(translation):
+    pre_filter = translation.search_kwargs["pre_filter"]
+    return pre_filter.get("$and", [])[1:]
+
+
+@pytest.fixture
+def translator():
+    return QueryTranslator()
+
+
+def test_bare_entity_mention_goes_to_translator(translator):
+    assert translator.parse("How is data retained?", VOCAB) is None
+
+
+def test_insight_question_with_bare_entity_mention_goes_to_translator(translator):
+    assert translator.parse("What are the risks in the agreement?", VOCAB) is None
+
+
+def test_insight_keyword_alone_is_parsed(translator):
+    translation = translator.parse("What are the main risks?", VOCAB)
+    assert translation.source == "parser"
+    assert conditions(translation) == [{"insight_types": {"$eq": "Risk"}}]
+
+
+def test_named_section_becomes_filter(translator):
+    translation = translator.parse("What are the risks in the Data Retention section?", VOCAB)
+    assert conditions(translation) == [
+        {"insight_types": {"$eq": "Risk"}},
+        {"section_header": {"$eq": "Data Retention"}},
+    ]
+
+
+def test_section_word_before_header(translator):
+    translation = translator.parse("Summarize section termination", VOCAB)
+    assert conditions(translation) == [{"section_header": {"$eq": "Termination"}}]
+
+
+def test_quoted_entity_becomes_filter(translator):
+    translation = translator.parse('What did "Acme Corp" commit to?', VOCAB)
+    assert conditions(translation) == [{"entities.name": {"$eq": "Acme Corp"}}]
+
+
+def test_no_vocabulary_hits_keeps_current_only(translator):
+    translation = translator.parse("Who signed it?", VOCAB)
+    assert translation.search_kwargs["pre_filter"] == CURRENT_ONLY
+
+
+def test_filter_cue_without_parsed_filter_goes_to_translator(translator):
+    assert translator.parse("Which stakeholder approved it?", VOCAB) is None
+
+
+class FakeCollection:
+    def __init__(self, headers, entities):
+        self.values = {"section_header": headers, "entities.name": entities}
+        self.calls = 0
+
+    def distinct(self, field, query):
+        self.calls += 1
+        return self.values[field]
+
+
+class FakeConfig:
+    def __init__(self, uri):
+        self.mongodb_uri = uri
+
+
+def test_vocabulary_is_reloaded_when_the_storage_uri_changes(translator, monkeypatch):
+    configs = {"acme": FakeConfig("mongodb://old")}
+    monkeypatch.setattr(query_translation.workspace_config, "get", configs.get)
+
+    old = FakeCollection(["Termination"], ["Acme Corp"])
+    assert "termination" in translator.vocabulary("acme", old, 3)["section_header"]
+    translator.vocabulary("acme", old, 3)
+    assert old.calls == 2
+
+    configs["acme"] = FakeConfig("mongodb://new")
+    new = FakeCollection(["Renewal"], [])
+    vocab = translator.vocabulary("acme", new, 3)
+    assert vocab["section_header"] == {"renewal": "Renewal"}
+    assert len(translator._vocabulary) == 1